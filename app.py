@@ -1,63 +1,134 @@
+import atexit
+import itertools
 import logging
 import time
-import re
 import threading
-from flask import Flask, render_template, request, jsonify
-from flask_socketio import SocketIO
+from collections import deque
+from flask import Flask, Response, render_template, request, jsonify
+from flask_socketio import SocketIO, join_room, leave_room
 import paho.mqtt.client as mqtt
-from scapy.all import Ether
+from broadcaster import SIZE_SAMPLE_EVERY, UNFILTERED_ROOM, Broadcaster
+from cam_log import CamLog
+from cam_batch import decode_payloads
+from cam_decoder import cam_layout, format_record, is_text_payload
+from consumer_workers import DecoderPool
+from ingest_queue import POLICIES, POLICY_DROP_OLDEST, IngestQueue
+from metrics import CONTENT_TYPE, Counter, Gauge, Histogram, Registry, process_memory
+from motion_filter import MotionFilter
+from track_store import TrackStore
 
-# Setup logging
-logging.basicConfig(level=logging.DEBUG,
+# Setup logging. Nothing is logged per message by default: at DEBUG, one
+# decoded record in DEBUG_SAMPLE_EVERY is logged (1: every record, 0: none).
+# SOCKETIO_LOGGING turns on the Socket.IO and Engine.IO packet logs.
+# GET /metrics gives the counters in the Prometheus text format.
+LOG_LEVEL = logging.INFO
+DEBUG_SAMPLE_EVERY = 1000
+SOCKETIO_LOGGING = False
+logging.basicConfig(level=LOG_LEVEL,
                     format='[%(asctime)s] %(levelname)s in %(module)s: %(message)s')
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'secret!'
-socketio = SocketIO(app, logger=True, engineio_logger=True)
+socketio = SocketIO(app, logger=SOCKETIO_LOGGING, engineio_logger=SOCKETIO_LOGGING)
 
-# Global containers for data
-RAW_MESSAGES = []
-TRANSLATED_MESSAGES = []
-VEHICLE_DATA = {}  # { vehicle_id: [[lat, lon], ...] }
+# Global containers for data, all bounded: the last MAX_MESSAGES messages
+# and, per vehicle, at most MAX_TRACK_POINTS points of the last
+# MAX_TRACK_AGE seconds. Vehicles silent for VEHICLE_TIMEOUT seconds expire.
+# Tracks are simplified as they arrive (see trace_simplifier.TRACE_LEVELS),
+# the browsers get the trace level matching their map zoom.
+MAX_MESSAGES = 1000
+MAX_TRACK_POINTS = 1000
+MAX_TRACK_AGE = 3600
+VEHICLE_TIMEOUT = 300
+RAW_MESSAGES = deque(maxlen=MAX_MESSAGES)
+TRANSLATED_MESSAGES = deque(maxlen=MAX_MESSAGES)
+VEHICLE_DATA = TrackStore(MAX_TRACK_POINTS, MAX_TRACK_AGE, VEHICLE_TIMEOUT)
+
+# When the app is run, every decoded record is also appended to a segmented
+# binary log in CAM_LOG_DIR (None disables it), CAM_LOG_SEGMENT_RECORDS
+# records per segment (24 MB) and at most CAM_LOG_MAX_SEGMENTS segments, the
+# oldest being deleted (None: no limit, the log grows forever). History
+# queries (/api/vehicles/<id>/track, /api/snapshot) are answered from it.
+# Importing the module does not open it, see start_cam_log.
+CAM_LOG_DIR = 'cam_log'
+CAM_LOG_SEGMENT_RECORDS = 1000000
+CAM_LOG_MAX_SEGMENTS = 20
+CAM_LOG = None
+
+def start_cam_log():
+    global CAM_LOG
+    if CAM_LOG is None and CAM_LOG_DIR:
+        CAM_LOG = CamLog(CAM_LOG_DIR, CAM_LOG_SEGMENT_RECORDS, CAM_LOG_MAX_SEGMENTS)
+        atexit.register(CAM_LOG.close)
 
 # MQTT configuration globals
 MQTT_BROKER = '127.0.0.1'
 MQTT_PORT = 1883
 MQTT_TOPIC = 'v2v'
 
-# Global MQTT client variable and thread handle
+# The MQTT callback only queues the payloads (at most INGEST_QUEUE_SIZE, see
+# ingest_queue for the overflow policies), PROCESSING_WORKERS threads decode
+# them. Binary CAMs are decoded in batches of up to BATCH_SIZE frames, a
+# partial batch is processed once its oldest frame has waited BATCH_MAX_WAIT
+# seconds. With more than one worker, updates of a vehicle may be reordered.
+INGEST_QUEUE_SIZE = 10000
+INGEST_POLICY = POLICY_DROP_OLDEST
+PROCESSING_WORKERS = 1
+BATCH_SIZE = 32
+BATCH_MAX_WAIT = 0.05
+
+# With DECODER_PROCESSES > 0, the MQTT subscription and the decoding move to
+# that many processes (see consumer_workers) sharing the topic through the
+# shared subscription $share/MQTT_SHARE_GROUP/MQTT_TOPIC; their records are
+# merged here, each vehicle's in timestamp order after waiting up to
+# REORDER_WINDOW seconds for the late ones.
+DECODER_PROCESSES = 0
+MQTT_SHARE_GROUP = 'v2v-consumers'
+REORDER_WINDOW = 0.1
+
+# Vehicle updates are coalesced and broadcast BROADCAST_RATE times per second.
+# The raw and translated texts are only broadcast if BROADCAST_MESSAGES is set.
+# With BINARY_UPDATES, updates are sent as packed columns (see wire_format)
+# instead of JSON objects, and raw payloads as bytes.
+BROADCAST_RATE = 10
+BROADCAST_MESSAGES = False
+BINARY_UPDATES = False
+# With SUPPRESS_UPDATES, an update only reaches the track store and the
+# browsers when the vehicle moved more than SUPPRESS_DISTANCE meters, turned
+# more than SUPPRESS_HEADING degrees or changed speed by more than
+# SUPPRESS_SPEED m/s since its last forwarded update, or SUPPRESS_MAX_INTERVAL
+# seconds (vehicle time) later, as in the ETSI CAM generation rules. All
+# updates still go to the CAM log and the message panes.
+SUPPRESS_UPDATES = True
+SUPPRESS_DISTANCE = 4.0
+SUPPRESS_HEADING = 4.0
+SUPPRESS_SPEED = 0.5
+SUPPRESS_MAX_INTERVAL = 1.0
+# Clients reporting their map bounds only get the vehicles inside them,
+# the bounds being extended by VIEWPORT_MARGIN of their size on each side.
+VIEWPORT_MARGIN = 0.2
+
+# Global MQTT client variable and thread handle, or the decoder processes
 mqtt_client = None
 mqtt_thread_handle = None
+decoder_pool = None
 mqtt_lock = threading.Lock()
 
 # Global variable to store the base vehicle timestamp (from the first packet)
 base_vehicle_timestamp = None
+debug_sample = itertools.count()
 
-def decode_vehicle_info(packet):
-    raw = packet.original
-    if len(raw) < 68:
-        logging.debug("Packet too short for decoding")
-        return "Insufficient data", None, None, None, 0, 0, None
-    vehicle_id = int.from_bytes(raw[78:82], byteorder='big')
-    timestamp = int.from_bytes(raw[52:56], byteorder='big')
-    latitude_int = int.from_bytes(raw[56:60], byteorder='big', signed=True)
-    longitude_int = int.from_bytes(raw[60:64], byteorder='big', signed=True)
-    speed_int = int.from_bytes(raw[64:66], byteorder='big')
-    heading_int = int.from_bytes(raw[66:68], byteorder='big')
-    latitude = latitude_int / 1e7
-    longitude = longitude_int / 1e7
-    speed = speed_int / 100.0
-    heading = heading_int / 10
-    info = (
-        f"Vehicle ID: {vehicle_id}\n"
-        f"Timestamp: {timestamp} ms\n"
-        f"Latitude: {latitude}\n"
-        f"Longitude: {longitude}\n"
-        f"Speed: {speed} m/s\n"
-        f"Heading: {heading}"
-    )
-    logging.debug("Decoded info: %s", info)
-    return info, vehicle_id, latitude, longitude, speed, heading, timestamp
+# Hot path metrics, the gauges are registered with the data stores below
+METRICS = Registry()
+MESSAGES = METRICS.register(Counter(
+    'v2v_messages_total', "MQTT messages handled in this process by outcome (decoded, ignored non-CAM, "
+                          "parse failure)", ['outcome']))
+for outcome in ('decoded', 'ignored', 'failed'):
+    MESSAGES.labels(outcome)
+DECODE_SECONDS = METRICS.register(Histogram('v2v_decode_batch_seconds', "Decoding time of a batch of payloads"))
+PROCESS_SECONDS = METRICS.register(Histogram(
+    'v2v_process_batch_seconds', "Time to store, log and queue for broadcast a batch of decoded records"))
+EMIT_SECONDS = METRICS.register(Histogram('v2v_emit_seconds', "Socket.IO emit time of a vehicles frame"))
 
 def on_connect(client, userdata, flags, rc):
     logging.debug("Connected to MQTT broker with result code %s", rc)
@@ -65,37 +136,55 @@ def on_connect(client, userdata, flags, rc):
     logging.debug("Subscribed to topic: %s", MQTT_TOPIC)
 
 def on_message(client, userdata, message):
-    # Ignore any packets that are not CAM (payload length != 121)
-    if len(message.payload) != 121:
-        logging.debug("Ignoring non-CAM packet with payload length: %s", len(message.payload))
+    # Runs on the paho network thread: only queue the payload
+    payload = message.payload
+    # Ignore any packets that are not CAM (other messages, beacons...):
+    # a lookup in the layouts cached by header signature
+    if not is_text_payload(payload) and cam_layout(payload) is None:
+        MESSAGES.labels('ignored').inc()
         return
+    ingest_queue.put(payload)
+
+def processing_worker():
+    while True:
+        try:
+            process_payloads(ingest_queue.get_batch(BATCH_SIZE, BATCH_MAX_WAIT))
+        except Exception as e:
+            logging.error("Error processing MQTT messages: %s", e)
+
+def process_payloads(payloads):
+    start = time.perf_counter()
+    received = len(payloads)
+    records, payloads = decode_payloads(payloads)
+    DECODE_SECONDS.observe(time.perf_counter() - start)
+    if received > len(payloads):
+        MESSAGES.labels('failed').inc(received - len(payloads))
+    process_records(records, payloads)
 
+def process_records(records, payloads, texts=None):
+    # texts: (raw, translated) text of every record when the decoder
+    # processes already made them
     global base_vehicle_timestamp
-    logging.debug("MQTT message received on topic %s", message.topic)
-    try:
-        data_str = message.payload.decode('utf-8', errors='replace')
-        logging.debug("Decoded payload (text): %s", data_str)
-        # Try to extract fields from the text payload
-        vehicle_ids = re.findall(r"Vehicle ID:\s*(\S+)", data_str)
-        latitudes = re.findall(r"Latitude:\s*([0-9.]+)", data_str)
-        longitudes = re.findall(r"Longitude:\s*([0-9.]+)", data_str)
-        speeds = re.findall(r"Speed:\s*([0-9.]+)", data_str)
-        headings = re.findall(r"Heading:\s*([0-9.]+)", data_str)
-        # For text messages no timestamp is present.
-        if vehicle_ids and latitudes and longitudes:
-            vehicle_id = vehicle_ids[-1]
-            latitude = float(latitudes[-1])
-            longitude = float(longitudes[-1])
-            speed = float(speeds[-1]) if speeds else 0
-            heading = float(headings[-1]) if headings else 0
-            timestamp = int(time.time() * 1000)  # use local time in ms as fallback timestamp
-            info = f"Vehicle ID: {vehicle_id}, Latitude: {latitude}, Longitude: {longitude}, Speed: {speed} m/s, Heading: {heading}"
+    start = time.perf_counter()
+    debug = DEBUG_SAMPLE_EVERY and logging.getLogger().isEnabledFor(logging.DEBUG)
+    raw_batch = []
+    translated_batch = []
+    updates = []
+    logged = []
+    failed = 0
+    for i, (record, payload) in enumerate(zip(records, payloads)):
+        vehicle_id, timestamp, latitude, longitude, speed, heading = record
+        if not vehicle_id:
+            logging.error("Failed to parse required fields from both text and binary formats")
+            failed += 1
+            continue
+        if texts is None:
+            data_str = payload.decode('utf-8', errors='replace')
+            info = format_record(record)
         else:
-            # If text parsing fails, try binary decoding via Scapy.
-            info, vehicle_id, latitude, longitude, speed, heading, timestamp = decode_vehicle_info(Ether(message.payload))
-            if not vehicle_id:
-                logging.error("Failed to parse required fields from both text and binary formats")
-                return
+            data_str, info = texts[i]
+        if debug and next(debug_sample) % DEBUG_SAMPLE_EVERY == 0:
+            logging.debug("Decoded info (1 in %s): %s", DEBUG_SAMPLE_EVERY, info)
 
         # Set the base vehicle timestamp if not already set.
         if timestamp is None:
@@ -103,37 +192,135 @@ def on_message(client, userdata, message):
         if base_vehicle_timestamp is None:
             base_vehicle_timestamp = timestamp
 
-        # Calculate elapsed vehicle time
-        elapsed = timestamp - base_vehicle_timestamp
-
         RAW_MESSAGES.append(data_str)
         TRANSLATED_MESSAGES.append(info)
-        VEHICLE_DATA.setdefault(vehicle_id, []).append([latitude, longitude])
-        
-        # Emit events including additional timestamp and elapsed time fields.
-        socketio.emit('raw', {'data': data_str})
-        socketio.emit('translated', {'data': info})
-        socketio.emit('update', {
+        logged.append((vehicle_id, timestamp, latitude, longitude, speed, heading))
+        raw_batch.append(payload)
+        translated_batch.append(info)
+
+    # Only the updates that changed the vehicle's motion enough reach the
+    # track store and the browsers, the others keep the vehicle alive
+    suppressed = []
+    for row, forward in zip(logged, motion_filter.select(logged)):
+        if not forward:
+            suppressed.append(row[0])
+            continue
+        vehicle_id, timestamp, latitude, longitude, speed, heading = row
+        VEHICLE_DATA.add(vehicle_id, timestamp, latitude, longitude, speed, heading)
+        updates.append({
             'vehicle_id': vehicle_id,
             'latitude': latitude,
             'longitude': longitude,
             'speed': speed,
             'heading': heading,
             'timestamp': timestamp,
-            'elapsed': elapsed
+            # Elapsed vehicle time
+            'elapsed': timestamp - base_vehicle_timestamp
         })
-        logging.debug("Emitted events for vehicle_id: %s, elapsed: %s ms", vehicle_id, elapsed)
-    except Exception as e:
-        logging.error("Error processing MQTT message: %s", e)
+    if suppressed:
+        VEHICLE_DATA.touch(suppressed)
+        broadcaster.touch(suppressed)
+
+    if CAM_LOG is not None and logged:
+        try:
+            CAM_LOG.append(logged)
+        except OSError as e:
+            logging.error("Error appending to the CAM log: %s", e)
+
+    # Sent to the browsers on the next broadcaster tick
+    for update in updates:
+        broadcaster.push(update)
+    broadcaster.push_messages(raw_batch, translated_batch)
+    logging.debug("Queued %s vehicle updates for broadcast (%s suppressed)", len(updates), len(suppressed))
+    MESSAGES.labels('decoded').inc(len(logged))
+    if failed:
+        MESSAGES.labels('failed').inc(failed)
+    PROCESS_SECONDS.observe(time.perf_counter() - start)
+
+ingest_queue = IngestQueue(INGEST_QUEUE_SIZE, INGEST_POLICY)
+motion_filter = MotionFilter(SUPPRESS_DISTANCE, SUPPRESS_HEADING, SUPPRESS_SPEED, SUPPRESS_MAX_INTERVAL,
+                             VEHICLE_TIMEOUT, enabled=SUPPRESS_UPDATES)
+broadcaster = Broadcaster(socketio, BROADCAST_RATE, BROADCAST_MESSAGES, VIEWPORT_MARGIN, VEHICLE_TIMEOUT,
+                          store=VEHICLE_DATA, binary=BINARY_UPDATES, emit_histogram=EMIT_SECONDS)
+
+def _messages_bytes():
+    return sum(len(m) for m in RAW_MESSAGES) + sum(len(m) for m in TRANSLATED_MESSAGES)
+
+def _memory_bytes():
+    memory = {('tracks',): VEHICLE_DATA.stats()['bytes_allocated'], ('messages',): _messages_bytes()}
+    rss = process_memory()
+    if rss is not None:
+        memory[('process',)] = rss
+    return memory
+
+def _clients():
+    stats = broadcaster.stats()
+    return {('viewport',): stats['viewport_clients'], ('unfiltered',): stats['clients'] - stats['viewport_clients']}
+
+def _decoder_messages():
+    # Counted in the decoder processes, which report them every STATS_INTERVAL
+    if decoder_pool is None:
+        return None
+    samples = {}
+    for index, stats in enumerate(decoder_pool.stats()['queues']):
+        for outcome in ('ignored', 'failed', 'dropped'):
+            if stats is not None and outcome in stats:
+                samples[(str(index), outcome)] = stats[outcome]
+    return samples
+
+METRICS.register(Gauge('v2v_decoder_messages_total', "Messages not decoded by the decoder processes, by outcome",
+                       _decoder_messages, ['process', 'outcome'], 'counter'))
+METRICS.register(Gauge('v2v_ingest_messages_total', "Payloads through the ingest queue by outcome",
+                       lambda: {(outcome,): ingest_queue.stats()[outcome] for outcome in ('enqueued', 'dropped')},
+                       ['outcome'], 'counter'))
+METRICS.register(Gauge('v2v_ingest_queue_depth', "Payloads waiting in the ingest queue",
+                       lambda: ingest_queue.stats()['depth']))
+METRICS.register(Gauge('v2v_ingest_lag_max_seconds', "Longest time a payload waited in the ingest queue",
+                       lambda: ingest_queue.stats()['lag_max']))
+METRICS.register(Gauge('v2v_active_vehicles', "Vehicles on the map (not expired)",
+                       lambda: broadcaster.stats()['vehicles']))
+METRICS.register(Gauge('v2v_connected_clients', "Connected dashboards, with or without a viewport", _clients,
+                       ['view']))
+METRICS.register(Gauge('v2v_broadcast_updates_total', "Vehicle updates received and sent by the broadcaster",
+                       lambda: {('in',): broadcaster.updates_in, ('out',): broadcaster.updates_out},
+                       ['direction'], 'counter'))
+METRICS.register(Gauge('v2v_broadcast_frames_total', "Vehicles frames emitted", lambda: broadcaster.frames,
+                       metric_type='counter'))
+METRICS.register(Gauge('v2v_broadcast_sampled_frame_bytes',
+                       f"Average size of the tick vehicles frames, measured on one frame in {SIZE_SAMPLE_EVERY}",
+                       lambda: broadcaster.stats()['avg_frame_bytes']))
+METRICS.register(Gauge('v2v_memory_bytes', "Memory held by the track store and the message buffers, and the "
+                                           "resident size of the process", _memory_bytes, ['store']))
+METRICS.register(Gauge('v2v_motion_filter_updates_total', "Vehicle updates through the motion filter by outcome",
+                       lambda: {('forwarded',): motion_filter.stats()['forwarded'],
+                                ('suppressed',): motion_filter.suppressed}, ['outcome'], 'counter'))
+METRICS.register(Gauge('v2v_motion_filter_forwarded_total', "Forwarded vehicle updates by reason",
+                       lambda: {(reason,): count for reason, count in dict(motion_filter.forwarded).items()},
+                       ['reason'], 'counter'))
+METRICS.register(Gauge('v2v_motion_filter_suppression_ratio', "Share of the vehicle updates suppressed",
+                       lambda: motion_filter.stats()['suppression_ratio']))
+METRICS.register(Gauge('v2v_cam_log_records', "Records in the CAM log",
+                       lambda: CAM_LOG.stats()['records'] if CAM_LOG is not None else None))
 
 def start_mqtt():
-    global mqtt_client, mqtt_thread_handle
+    global mqtt_client, mqtt_thread_handle, decoder_pool
     with mqtt_lock:
         if mqtt_client:
             try:
                 mqtt_client.disconnect()
             except Exception as e:
                 logging.error("Error disconnecting previous MQTT client: %s", e)
+            mqtt_client = None
+        if decoder_pool:
+            decoder_pool.stop()
+            decoder_pool = None
+        if DECODER_PROCESSES > 0:
+            logging.debug("Starting %s decoder processes on %s:%s", DECODER_PROCESSES, MQTT_BROKER, MQTT_PORT)
+            decoder_pool = DecoderPool(DECODER_PROCESSES, MQTT_BROKER, MQTT_PORT, MQTT_TOPIC, MQTT_SHARE_GROUP,
+                                       process_records, BATCH_SIZE, BATCH_MAX_WAIT, INGEST_QUEUE_SIZE,
+                                       INGEST_POLICY, REORDER_WINDOW)
+            decoder_pool.start()
+            return
         mqtt_client = mqtt.Client(client_id="ConsumerFlask")
         mqtt_client.on_connect = on_connect
         mqtt_client.on_message = on_message
@@ -149,16 +336,142 @@ def start_mqtt():
         mqtt_thread_handle.start()
         logging.debug("MQTT client loop started in background thread")
 
-# Start the initial MQTT connection on app launch
+def stop_decoders():
+    if decoder_pool:
+        decoder_pool.stop()
+
+atexit.register(stop_decoders)
+
+def start_workers():
+    for i in range(PROCESSING_WORKERS):
+        threading.Thread(target=processing_worker, name=f"processing-{i}", daemon=True).start()
+
+# Start the processing workers, the initial MQTT connection and the broadcast loop on app launch
+start_workers()
 start_mqtt()
+broadcaster.start()
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+def parse_viewport(data):
+    south, west, north, east = (float(data[k]) for k in ('south', 'west', 'north', 'east'))
+    zoom = float(data['zoom']) if data.get('zoom') is not None else None
+    return (south, west, north, east), zoom
+
+@socketio.on('connect')
+def on_client_connect(auth=None):
+    # The page sends its viewport and, when reconnecting, what it already
+    # has (last version, vehicles, trace sequence numbers): it then only
+    # gets what changed since. Without a viewport, a client gets every vehicle.
+    bounds = zoom = version = trace_level = None
+    vehicles = []
+    trace_seq = {}
+    if isinstance(auth, dict):
+        try:
+            if auth.get('viewport'):
+                bounds, zoom = parse_viewport(auth['viewport'])
+            if auth.get('version') is not None:
+                version = int(auth['version'])
+            if auth.get('trace_level') is not None:
+                trace_level = int(auth['trace_level'])
+            vehicles = [v for v in auth.get('vehicles') or [] if isinstance(v, (int, str))]
+            trace_seq = {v: int(seq) for v, seq in auth.get('traces') or [] if isinstance(v, (int, str))}
+        except (AttributeError, KeyError, TypeError, ValueError):
+            logging.error("Invalid client state: %s", auth)
+            bounds = zoom = version = None
+    if bounds is None:
+        join_room(UNFILTERED_ROOM)
+    broadcaster.add_client(request.sid, bounds, zoom, auth.get('epoch') if isinstance(auth, dict) else None,
+                           version, vehicles, trace_level, trace_seq)
+
+@socketio.on('disconnect')
+def on_client_disconnect(*args):
+    broadcaster.remove_client(request.sid)
+
+@socketio.on('viewport')
+def on_viewport(data):
+    try:
+        bounds, zoom = parse_viewport(data)
+    except (AttributeError, KeyError, TypeError, ValueError):
+        logging.error("Invalid viewport: %s", data)
+        return
+    leave_room(UNFILTERED_ROOM)
+    broadcaster.set_viewport(request.sid, *bounds, zoom=zoom)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(METRICS.render(), content_type=CONTENT_TYPE)
+
+@app.route('/api/stats')
+def api_stats():
+    stats = VEHICLE_DATA.stats()
+    stats['raw_messages'] = len(RAW_MESSAGES)
+    stats['translated_messages'] = len(TRANSLATED_MESSAGES)
+    stats['messages_bytes'] = _messages_bytes()
+    stats['broadcast'] = broadcaster.stats()
+    stats['ingest'] = ingest_queue.stats()
+    stats['motion_filter'] = motion_filter.stats()
+    if decoder_pool is not None:
+        stats['decoders'] = decoder_pool.stats()
+    if CAM_LOG is not None:
+        stats['cam_log'] = CAM_LOG.stats()
+    return jsonify(stats)
+
+def _int_arg(name, default=None):
+    value = request.args.get(name)
+    return default if value in (None, '') else int(value)
+
+@app.route('/api/vehicles/<vehicle_id>/track')
+def api_vehicle_track(vehicle_id):
+    # Logged positions of a vehicle, from and to being vehicle timestamps (ms)
+    if CAM_LOG is None:
+        return jsonify({'status': 'error', 'message': 'The CAM log is disabled'}), 404
+    try:
+        start = _int_arg('from')
+        end = _int_arg('to')
+        limit = _int_arg('limit', 10000)
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'from, to and limit must be integers'}), 400
+    points = CAM_LOG.track(vehicle_id, start, end, limit)
+    return jsonify({'vehicle_id': vehicle_id, 'from': start, 'to': end,
+                    'points': [point._asdict() for point in points]})
+
+@app.route('/api/snapshot')
+def api_snapshot():
+    # Latest logged position of every vehicle at a vehicle timestamp (ms),
+    # ignoring positions older than `window` ms
+    if CAM_LOG is None:
+        return jsonify({'status': 'error', 'message': 'The CAM log is disabled'}), 404
+    try:
+        at = _int_arg('at')
+        window = _int_arg('window', VEHICLE_TIMEOUT * 1000)
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'at and window must be integers'}), 400
+    if at is None:
+        return jsonify({'status': 'error', 'message': 'at is required'}), 400
+    vehicles = CAM_LOG.snapshot(at, window)
+    return jsonify({'at': at, 'window': window, 'vehicles': [vehicle._asdict() for vehicle in vehicles]})
+
+@app.route('/api/history')
+def api_history():
+    # Logged records of every vehicle between two vehicle timestamps (ms)
+    if CAM_LOG is None:
+        return jsonify({'status': 'error', 'message': 'The CAM log is disabled'}), 404
+    try:
+        start = _int_arg('from')
+        end = _int_arg('to')
+        limit = _int_arg('limit', 10000)
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'from, to and limit must be integers'}), 400
+    records = CAM_LOG.between(start, end, limit)
+    return jsonify({'from': start, 'to': end, 'records': [record._asdict() for record in records]})
+
 @app.route('/update_config', methods=['POST'])
 def update_config():
-    global MQTT_BROKER, MQTT_PORT, MQTT_TOPIC
+    global MQTT_BROKER, MQTT_PORT, MQTT_TOPIC, BATCH_SIZE, BATCH_MAX_WAIT, BROADCAST_RATE, INGEST_POLICY
+    global BINARY_UPDATES, DECODER_PROCESSES, SUPPRESS_UPDATES
     data = request.form
     new_broker = data.get('broker', MQTT_BROKER)
     new_port = data.get('port', MQTT_PORT)
@@ -167,12 +480,51 @@ def update_config():
         new_port = int(new_port)
     except ValueError:
         return jsonify({'status': 'error', 'message': 'Port must be a number'}), 400
+    try:
+        new_batch_size = int(data.get('batch_size', BATCH_SIZE))
+        new_batch_max_wait = float(data.get('batch_max_wait', BATCH_MAX_WAIT))
+        new_broadcast_rate = float(data.get('broadcast_rate', BROADCAST_RATE))
+        new_decoder_processes = int(data.get('decoder_processes', DECODER_PROCESSES))
+    except ValueError:
+        return jsonify({'status': 'error',
+                        'message': 'Batch size, max wait, broadcast rate and decoder processes must be numbers'}), 400
+    new_policy = data.get('queue_policy', INGEST_POLICY)
+    if new_policy not in POLICIES:
+        return jsonify({'status': 'error', 'message': 'Queue policy must be one of ' + ', '.join(POLICIES)}), 400
+    new_wire_format = data.get('wire_format', 'binary' if BINARY_UPDATES else 'json')
+    if new_wire_format not in ('json', 'binary'):
+        return jsonify({'status': 'error', 'message': 'Wire format must be json or binary'}), 400
+    new_suppression = data.get('update_suppression', 'on' if SUPPRESS_UPDATES else 'off')
+    if new_suppression not in ('on', 'off'):
+        return jsonify({'status': 'error', 'message': 'Update suppression must be on or off'}), 400
+    if new_batch_size < 1 or new_batch_max_wait < 0 or new_broadcast_rate <= 0 or new_decoder_processes < 0:
+        return jsonify({'status': 'error',
+                        'message': 'Batch size must be >= 1, max wait >= 0, broadcast rate > 0 '
+                                   'and decoder processes >= 0'}), 400
 
     MQTT_BROKER = new_broker
     MQTT_PORT = new_port
     MQTT_TOPIC = new_topic
-    logging.debug("Updated config: Broker:%s, Port:%s, Topic:%s", MQTT_BROKER, MQTT_PORT, MQTT_TOPIC)
-    return jsonify({'status': 'success', 'broker': MQTT_BROKER, 'port': MQTT_PORT, 'topic': MQTT_TOPIC})
+    BATCH_SIZE = new_batch_size
+    BATCH_MAX_WAIT = new_batch_max_wait
+    BROADCAST_RATE = new_broadcast_rate
+    INGEST_POLICY = new_policy
+    BINARY_UPDATES = new_wire_format == 'binary'
+    SUPPRESS_UPDATES = new_suppression == 'on'
+    # Like the broker settings, applied on the next connection
+    DECODER_PROCESSES = new_decoder_processes
+    broadcaster.rate = BROADCAST_RATE
+    broadcaster.set_binary(BINARY_UPDATES)
+    motion_filter.set_enabled(SUPPRESS_UPDATES)
+    ingest_queue.policy = INGEST_POLICY
+    logging.debug("Updated config: Broker:%s, Port:%s, Topic:%s, Batch:%s/%ss, Broadcast:%sHz (%s), Queue:%s, "
+                  "Decoders:%s, Suppression:%s", MQTT_BROKER, MQTT_PORT, MQTT_TOPIC, BATCH_SIZE, BATCH_MAX_WAIT,
+                  BROADCAST_RATE, new_wire_format, INGEST_POLICY, DECODER_PROCESSES, new_suppression)
+    return jsonify({'status': 'success', 'broker': MQTT_BROKER, 'port': MQTT_PORT, 'topic': MQTT_TOPIC,
+                    'batch_size': BATCH_SIZE, 'batch_max_wait': BATCH_MAX_WAIT,
+                    'broadcast_rate': BROADCAST_RATE, 'wire_format': new_wire_format,
+                    'queue_policy': INGEST_POLICY, 'decoder_processes': DECODER_PROCESSES,
+                    'update_suppression': new_suppression})
 
 @app.route('/connect_broker', methods=['POST'])
 def connect_broker():
@@ -181,4 +533,5 @@ def connect_broker():
     return jsonify({'status': 'success', 'message': 'Connected to broker at {}:{}'.format(MQTT_BROKER, MQTT_PORT)})
 
 if __name__ == '__main__':
+    start_cam_log()
     socketio.run(app, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,168 @@
+# Scaling curve of the multi-process consumer: the CAM frames of
+# v2v-EVA-2-0.pcap (copied onto more vehicles) are published as fast as
+# possible, then decoded by a single in-process MQTT client (the default
+# consumer path) or by 1..N decoder processes in a shared subscription,
+# measuring the merged records per second. Runs against the in-process
+# stand-in broker unless --broker points to a real one (e.g. Mosquitto).
+#
+#   python -m benchmarks.bench_consumer_scaling [--processes 1,2,4] [--messages N] [--broker host:port]
+import argparse
+import os
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+from benchmarks.mini_broker import MiniBroker, connect_publisher, encode_publish
+from cam_batch import decode_payloads
+from cam_decoder import CAM_LENGTH, format_record
+from consumer_workers import DecoderPool
+from ingest_queue import POLICY_BLOCK, IngestQueue
+from pcap_reader import iter_frames
+
+DEFAULT_PCAP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'v2v-EVA-2-0.pcap')
+# Copies of the capture are spread over this many distinct vehicle id ranges
+VEHICLE_COPIES = 16
+# A run ends when no record arrived for this long
+IDLE_TIMEOUT = 3.0
+
+
+def load_messages(path, count):
+    cams = [bytes(frame.data) for frame in iter_frames(path) if len(frame.data) == CAM_LENGTH]
+    messages = []
+    for i in range(count):
+        copy, cam = divmod(i, len(cams))
+        frame = bytearray(cams[cam])
+        vehicle = int.from_bytes(frame[78:82], 'big') + 1000 * (copy % VEHICLE_COPIES)
+        timestamp = (int.from_bytes(frame[52:56], 'big') + 1000000 * (copy // VEHICLE_COPIES)) % 2 ** 32
+        frame[78:82] = vehicle.to_bytes(4, 'big')
+        frame[52:56] = timestamp.to_bytes(4, 'big')
+        messages.append(bytes(frame))
+    return messages
+
+
+def publish_all(host, port, topic, messages):
+    sock = connect_publisher(host, port, 'bench-publisher')
+    packets = [encode_publish(topic, message) for message in messages]
+    for start in range(0, len(packets), 1000):
+        sock.sendall(b''.join(packets[start:start + 1000]))
+    return sock
+
+
+class Counter:
+    def __init__(self):
+        self.count = 0
+        self.last = None
+        self.order_errors = 0
+        self._last_timestamp = {}
+
+    def on_records(self, records, payloads, texts=None):
+        # Also checks that every vehicle's records come in timestamp order
+        for record in records:
+            previous = self._last_timestamp.get(record[0])
+            if previous is not None and record[1] < previous:
+                self.order_errors += 1
+            self._last_timestamp[record[0]] = record[1]
+        self.count += len(records)
+        self.last = time.perf_counter()
+
+
+def wait_done(counter, total, start):
+    while counter.count < total:
+        time.sleep(0.1)
+        if time.perf_counter() - (counter.last or start) > IDLE_TIMEOUT:
+            break
+
+
+def run_in_process(host, port, topic, messages, batch_size):
+    # What app.py does with DECODER_PROCESSES = 0: one MQTT client, decoding in a thread
+    counter = Counter()
+    ingest = IngestQueue(10000, POLICY_BLOCK)
+    subscribed = threading.Event()
+    client = mqtt.Client(client_id="ConsumerFlask")
+    client.on_connect = lambda c, userdata, flags, rc: c.subscribe(topic)
+    client.on_subscribe = lambda c, userdata, mid, granted: subscribed.set()
+    client.on_message = lambda c, userdata, message: ingest.put(message.payload)
+
+    def process():
+        while True:
+            records, payloads = decode_payloads(ingest.get_batch(batch_size, 0.05))
+            texts = [(payload.decode('utf-8', errors='replace'), format_record(record))
+                     for record, payload in zip(records, payloads)]
+            counter.on_records(records, payloads, texts)
+
+    threading.Thread(target=process, daemon=True).start()
+    client.connect(host, port)
+    client.loop_start()
+    subscribed.wait(10)
+    start = time.perf_counter()
+    publisher = publish_all(host, port, topic, messages)
+    wait_done(counter, len(messages), start)
+    client.loop_stop()
+    client.disconnect()
+    publisher.close()
+    return counter, start, None
+
+
+def run_pool(host, port, topic, messages, processes, batch_size, window):
+    counter = Counter()
+    pool = DecoderPool(processes, host, port, topic, 'bench', counter.on_records, batch_size=batch_size,
+                       policy=POLICY_BLOCK, reorder_window=window)
+    pool.start()
+    deadline = time.time() + 30
+    while len(pool.ready) < processes and time.time() < deadline:
+        time.sleep(0.05)
+    start = time.perf_counter()
+    publisher = publish_all(host, port, topic, messages)
+    wait_done(counter, len(messages), start)
+    stats = pool.stats()
+    pool.stop()
+    publisher.close()
+    return counter, start, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-process consumer scaling benchmark")
+    parser.add_argument('pcap', nargs='?', default=DEFAULT_PCAP)
+    parser.add_argument('--processes', default='1,2,4', help="Comma-separated decoder process counts")
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--reorder-window', type=float, default=0.1)
+    parser.add_argument('--broker', help="host:port of an MQTT broker (default: in-process stand-in)")
+    args = parser.parse_args()
+
+    if args.broker:
+        host, port = args.broker.rsplit(':', 1)
+        port = int(port)
+        broker = None
+    else:
+        broker = MiniBroker().start()
+        host, port = broker.host, broker.port
+    messages = load_messages(args.pcap, args.messages)
+    print(f"{len(messages)} CAMs of {VEHICLE_COPIES * 11} vehicles, broker "
+          f"{'in-process' if broker else args.broker}, {os.cpu_count()} CPUs")
+
+    runs = [('in-process', 0)] + [(f"{n} process(es)", n) for n in map(int, args.processes.split(','))]
+    baseline = None
+    for run, (name, processes) in enumerate(runs):
+        topic = f"bench/{run}"
+        if processes:
+            counter, start, stats = run_pool(host, port, topic, messages, processes, args.batch_size,
+                                             args.reorder_window)
+        else:
+            counter, start, stats = run_in_process(host, port, topic, messages, args.batch_size)
+        elapsed = (counter.last or start) - start
+        rate = counter.count / elapsed if elapsed > 0 else 0.0
+        baseline = baseline or rate
+        line = (f"{name:<16} {counter.count:8d} records in {elapsed:6.2f}s {rate:10.0f} rec/s "
+                f"x{rate / baseline:4.2f}  out of order: {counter.order_errors}")
+        if stats:
+            line += (f"  reordered: {stats['reorder']['reordered']}, late: {stats['reorder']['late_dropped']}, "
+                     f"split: {stats['received']}")
+        print(line)
+    if broker:
+        broker.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+# Micro-benchmark of the consumer decode path: the former regex + Scapy
+# decoding of app.py against cam_decoder, on the CAM frames of v2v-EVA-2-0.pcap.
+#
+#   python -m benchmarks.bench_decoder [pcap] [--repeat N]
+import argparse
+import os
+import re
+import time
+
+from scapy.all import Ether, rdpcap
+
+from cam_batch import decode_payloads
+from cam_decoder import CAM_LENGTH, decode_payload, format_record
+
+DEFAULT_PCAP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'v2v-EVA-2-0.pcap')
+
+
+def legacy_decode_vehicle_info(packet):
+    raw = packet.original
+    if len(raw) < 68:
+        return "Insufficient data", None, None, None, 0, 0, None
+    vehicle_id = int.from_bytes(raw[78:82], byteorder='big')
+    timestamp = int.from_bytes(raw[52:56], byteorder='big')
+    latitude_int = int.from_bytes(raw[56:60], byteorder='big', signed=True)
+    longitude_int = int.from_bytes(raw[60:64], byteorder='big', signed=True)
+    speed_int = int.from_bytes(raw[64:66], byteorder='big')
+    heading_int = int.from_bytes(raw[66:68], byteorder='big')
+    latitude = latitude_int / 1e7
+    longitude = longitude_int / 1e7
+    speed = speed_int / 100.0
+    heading = heading_int / 10
+    info = (
+        f"Vehicle ID: {vehicle_id}\n"
+        f"Timestamp: {timestamp} ms\n"
+        f"Latitude: {latitude}\n"
+        f"Longitude: {longitude}\n"
+        f"Speed: {speed} m/s\n"
+        f"Heading: {heading}"
+    )
+    return info, vehicle_id, latitude, longitude, speed, heading, timestamp
+
+
+def legacy_decode(payload):
+    data_str = payload.decode('utf-8', errors='replace')
+    vehicle_ids = re.findall(r"Vehicle ID:\s*(\S+)", data_str)
+    latitudes = re.findall(r"Latitude:\s*([0-9.]+)", data_str)
+    longitudes = re.findall(r"Longitude:\s*([0-9.]+)", data_str)
+    re.findall(r"Speed:\s*([0-9.]+)", data_str)
+    re.findall(r"Heading:\s*([0-9.]+)", data_str)
+    if vehicle_ids and latitudes and longitudes:
+        return None
+    return legacy_decode_vehicle_info(Ether(payload))
+
+
+def new_decode(payload):
+    return decode_payload(payload)
+
+
+def new_decode_formatted(payload):
+    record = decode_payload(payload)
+    return record, format_record(record)
+
+
+def run_batched(name, payloads, batch_size, repeat):
+    batches = []
+    for i in range(0, len(payloads), batch_size):
+        chunk = payloads[i:i + batch_size]
+        batches.append(chunk)
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for batch in batches:
+            decode_payloads(batch)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    per_msg = best / len(payloads) * 1e6
+    print(f"{name:<28} {per_msg:10.2f} us/msg {len(payloads) / best:14.0f} msg/s")
+    return best
+
+
+def run(name, func, payloads, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for payload in payloads:
+            func(payload)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    per_msg = best / len(payloads) * 1e6
+    print(f"{name:<28} {per_msg:10.2f} us/msg {len(payloads) / best:14.0f} msg/s")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CAM decoder micro-benchmark")
+    parser.add_argument('pcap', nargs='?', default=DEFAULT_PCAP)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    payloads = [bytes(p) for p in rdpcap(args.pcap)]
+    payloads = [p for p in payloads if len(p) == CAM_LENGTH]
+    if not payloads:
+        print("No CAM frames found in", args.pcap)
+        return
+
+    # Both paths must agree on the decoded fields
+    for payload in payloads:
+        _, *legacy = legacy_decode(payload)
+        record = decode_payload(payload)
+        assert tuple(legacy) == (record.vehicle_id, record.latitude, record.longitude,
+                                 record.speed, record.heading, record.timestamp)
+
+    print(f"{len(payloads)} CAM frames from {os.path.basename(args.pcap)}, best of {args.repeat}")
+    legacy = run("regex + scapy (legacy)", legacy_decode, payloads, args.repeat)
+    fast = run("cam_decoder", new_decode, payloads, args.repeat)
+    run("cam_decoder + format_record", new_decode_formatted, payloads, args.repeat)
+    for batch_size in (8, 32, 256):
+        run_batched(f"cam_batch (batch={batch_size})", payloads, batch_size, args.repeat)
+    print(f"speedup: x{legacy / fast:.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,383 @@
+# End-to-end benchmark of the consumer: synthetic CAMs (cam_generator) are
+# published at controlled rates to the broker and go through the real
+# consumer path of app.py (on_message, ingest queue, batch decoding,
+# track store, CAM log, broadcaster) up to the Socket.IO emit of a
+# connected dashboard (Flask-SocketIO test client). For every rate step:
+# sustained throughput, publish-to-process and publish-to-emit latency
+# percentiles, queue drops and memory growth. Results are saved as JSON,
+# --compare prints the changes against an earlier result file.
+#
+# Publish-to-emit latency includes the broadcast tick (up to 1 / broadcast
+# rate) and only counts the updates actually emitted: updates of a vehicle
+# coalesced into a newer one before the tick are reported as superseded,
+# the ones held back by the motion filter (app.SUPPRESS_UPDATES) as
+# suppressed.
+# The publisher, the stand-in broker and the consumer share this process.
+#
+#   python -m benchmarks.bench_end_to_end [--rates 1000,5000,20000] [--duration 10] [--vehicles 1000]
+#                                         [--output results.json] [--compare old.json] [--broker host:port]
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from benchmarks.cam_generator import CamGenerator
+from benchmarks.mini_broker import MiniBroker, connect_publisher, encode_publish
+from wire_format import decode_updates
+
+# The publisher sends the messages due every PUBLISH_TICK seconds in one write
+PUBLISH_TICK = 0.005
+# How long a step may take to process its backlog after publishing ended
+DRAIN_TIMEOUT = 10.0
+# A rate is sustained when nothing was dropped and at least this share of
+# the offered messages was published, processed and reached the dashboard
+SUSTAINED_RATIO = 0.99
+RESULT_VERSION = 1
+
+
+def rss_kb():
+    # (current, peak) resident set size of this process
+    values = {}
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(('VmRSS:', 'VmHWM:')):
+                key, value = line.split(':')
+                values[key] = int(value.split()[0])
+    return values.get('VmRSS'), values.get('VmHWM')
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+class Recorder:
+    # Publish, process and emit time of every message, indexed by its
+    # generator sequence number
+
+    def __init__(self, generator, capacity):
+        self.generator = generator
+        self.published = np.full(capacity, np.nan)
+        self.processed = np.full(capacity, np.nan)
+        self.emitted = np.full(capacity, np.nan)
+        self.frames = 0
+        self._ids = {}
+
+    def _seq(self, vehicle_id, timestamp):
+        # Binary frames carry the timestamps as doubles
+        seq = self.generator.sequence(vehicle_id, int(timestamp))
+        return seq if 0 <= seq < len(self.published) else None
+
+    def on_processed(self, records):
+        now = time.perf_counter()
+        for record in records:
+            seq = self._seq(record[0], record[1])
+            if seq is not None:
+                self.processed[seq] = now
+
+    def on_emitted(self, frame):
+        now = time.perf_counter()
+        self.frames += 1
+        if 'bin' in frame:
+            if frame.get('ids_reset'):
+                self._ids = {}
+            self._ids.update(frame.get('ids', ()))
+            updates = decode_updates(frame['bin'], self._ids)
+        else:
+            updates = frame.get('updates', ())
+        for update in updates:
+            seq = self._seq(update['vehicle_id'], update['timestamp'])
+            if seq is not None and np.isnan(self.emitted[seq]):
+                self.emitted[seq] = now
+
+
+def instrument(app, recorder):
+    process_records = app.process_records
+
+    def timed_process_records(records, payloads, texts=None):
+        process_records(records, payloads, texts)
+        recorder.on_processed(records)
+
+    emit = app.socketio.emit
+
+    def timed_emit(event, *args, **kwargs):
+        result = emit(event, *args, **kwargs)
+        if event == 'vehicles' and args:
+            recorder.on_emitted(args[0])
+        return result
+
+    app.process_records = timed_process_records
+    app.socketio.emit = timed_emit
+
+
+def connect_dashboard(app):
+    # One dashboard without viewport (every vehicle), its received frames
+    # being discarded regularly
+    client = app.socketio.test_client(app.app)
+
+    def drain():
+        while True:
+            time.sleep(0.2)
+            client.get_received()
+
+    threading.Thread(target=drain, name="dashboard", daemon=True).start()
+    return client
+
+
+def build_chunks(generator, pending, count, rate, topic):
+    # count messages as (first seq, number, bytes) per PUBLISH_TICK
+    packets = []
+    while len(pending) + len(packets) < count:
+        pending.extend(generator.next_frames())
+    frames, pending[:] = pending[:count], pending[count:]
+    packets = [encode_publish(topic, frame) for frame in frames]
+    chunks = []
+    sent = 0
+    tick = 1
+    while sent < count:
+        due = min(count, round(tick * PUBLISH_TICK * rate))
+        if due > sent:
+            chunks.append((sent, due - sent, b''.join(packets[sent:due])))
+            sent = due
+        tick += 1
+    return chunks
+
+
+def publish(sock, chunks, first_seq, published):
+    start = time.perf_counter()
+    for index, (offset, count, data) in enumerate(chunks):
+        delay = start + (index + 1) * PUBLISH_TICK - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        published[first_seq + offset:first_seq + offset + count] = time.perf_counter()
+        sock.sendall(data)
+    return start, time.perf_counter()
+
+
+def percentiles(latencies):
+    if not len(latencies):
+        return {'p50_ms': None, 'p99_ms': None, 'max_ms': None}
+    p50, p99 = np.percentile(latencies, (50, 99)) * 1000
+    return {'p50_ms': round(float(p50), 3), 'p99_ms': round(float(p99), 3),
+            'max_ms': round(float(latencies.max() * 1000), 3)}
+
+
+def run_step(app, recorder, sock, generator, pending, rate, duration, first_seq, topic, broadcast_rate):
+    count = int(rate * duration)
+    rss_start, _ = rss_kb()
+    chunks = build_chunks(generator, pending, count, rate, topic)
+    ingest_before = app.ingest_queue.stats()
+    suppressed_before = app.motion_filter.suppressed
+    frames_before = recorder.frames
+    start, end = publish(sock, chunks, first_seq, recorder.published)
+    del chunks
+    window = slice(first_seq, first_seq + count)
+    # Wait for the backlog, then for the broadcast of the last updates
+    deadline = time.perf_counter() + DRAIN_TIMEOUT
+    while time.perf_counter() < deadline:
+        processed = np.count_nonzero(~np.isnan(recorder.processed[window]))
+        if processed + app.ingest_queue.stats()['dropped'] - ingest_before['dropped'] >= count:
+            break
+        time.sleep(0.05)
+    time.sleep(2.0 / broadcast_rate)
+    rss_end, rss_peak = rss_kb()
+    ingest = app.ingest_queue.stats()
+
+    published = recorder.published[window]
+    processed = recorder.processed[window]
+    emitted = recorder.emitted[window]
+    done = ~np.isnan(processed)
+    shown = ~np.isnan(emitted)
+    last = np.nanmax(processed) if done.any() else end
+    processed_count = int(done.sum())
+    emitted_count = int(shown.sum())
+    suppressed = app.motion_filter.suppressed - suppressed_before
+    store = app.VEHICLE_DATA.stats()
+    return {
+        'rate': rate,
+        'duration': duration,
+        'offered': count,
+        'publish_rate': round(count / (end - start), 1),
+        'processed': processed_count,
+        'emitted': emitted_count,
+        'suppressed': suppressed,
+        'superseded': processed_count - emitted_count - suppressed,
+        'dropped': ingest['dropped'] - ingest_before['dropped'],
+        'throughput': round(processed_count / (last - start), 1) if last > start else 0.0,
+        'backlog_seconds': round(max(0.0, last - end), 3),
+        'frames': recorder.frames - frames_before,
+        'latency_process': percentiles(processed[done] - published[done]),
+        'latency_emit': percentiles(emitted[shown] - published[shown]),
+        'ingest_lag_max_ms': round(ingest['lag_max'] * 1000, 3),
+        'rss_start_kb': rss_start,
+        'rss_end_kb': rss_end,
+        'rss_growth_kb': rss_end - rss_start,
+        'rss_peak_kb': rss_peak,
+        'vehicles': store['vehicles'],
+        'track_points': store['points'],
+        'track_bytes': store['bytes_allocated'],
+    }
+
+
+def sustained(step):
+    return (step['dropped'] == 0 and step['processed'] >= SUSTAINED_RATIO * step['offered']
+            and step['publish_rate'] >= SUSTAINED_RATIO * step['rate']
+            and step['emitted'] > 0)
+
+
+def print_step(step):
+    process, emit = step['latency_process'], step['latency_emit']
+    print(f"{step['rate']:>8} msg/s  published {step['publish_rate']:>9.0f}/s  processed {step['throughput']:>9.0f}/s  "
+          f"dropped {step['dropped']:>7}  suppressed {step['suppressed'] / max(step['processed'], 1):4.0%}  process p50/p99 {process['p50_ms']} / {process['p99_ms']} ms  "
+          f"emit p50/p99 {emit['p50_ms']} / {emit['p99_ms']} ms  "
+          f"RSS {step['rss_end_kb'] / 1024:.1f} MB (+{step['rss_growth_kb'] / 1024:.1f})"
+          f"{'' if sustained(step) else '  NOT SUSTAINED'}")
+
+
+def compare(result, path):
+    with open(path) as f:
+        previous = json.load(f)
+    print(f"\nCompared with {path} ({previous['meta'].get('commit')}, {previous['meta'].get('time')}):")
+    print(f"  max sustained rate: {previous.get('max_sustained_rate')} -> {result['max_sustained_rate']}")
+    old_steps = {step['rate']: step for step in previous.get('steps', ())}
+    for step in result['steps']:
+        old = old_steps.get(step['rate'])
+        if old is None:
+            continue
+        changes = [f"throughput {old['throughput']:.0f} -> {step['throughput']:.0f}/s"]
+        for name in ('latency_process', 'latency_emit'):
+            for p in ('p50_ms', 'p99_ms'):
+                before, after = old[name][p], step[name][p]
+                if before and after is not None:
+                    changes.append(f"{name[8:]} {p[:3]} {before:.2f} -> {after:.2f} ms ({(after / before - 1) * 100:+.0f}%)")
+        changes.append(f"RSS growth {old['rss_growth_kb'] / 1024:.1f} -> {step['rss_growth_kb'] / 1024:.1f} MB")
+        print(f"  {step['rate']:>8} msg/s: " + ", ".join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end consumer throughput and latency benchmark")
+    parser.add_argument('--rates', default='1000,2000,5000,10000,20000', help="Comma-separated messages per second")
+    parser.add_argument('--duration', type=float, default=10.0, help="Seconds per rate step")
+    parser.add_argument('--vehicles', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--broker', help="host:port of an MQTT broker (default: in-process stand-in)")
+    parser.add_argument('--topic', default='bench/e2e')
+    parser.add_argument('--binary', action='store_true', help="Binary vehicle frames (app.BINARY_UPDATES)")
+    parser.add_argument('--broadcast-rate', type=float, default=10.0)
+    parser.add_argument('--decoder-processes', type=int, default=0)
+    parser.add_argument('--no-cam-log', action='store_true', help="Disable the CAM log")
+    parser.add_argument('--no-suppression', action='store_true', help="Disable the motion filter")
+    parser.add_argument('--log-level', default='WARNING',
+                        help="Consumer log level (app.py logs nothing per message, except one decoded record "
+                             "in DEBUG_SAMPLE_EVERY at DEBUG)")
+    parser.add_argument('--output', help="JSON result file")
+    parser.add_argument('--compare', help="Earlier JSON result file")
+    args = parser.parse_args()
+    rates = [int(rate) for rate in args.rates.split(',')]
+    output = os.path.abspath(args.output) if args.output else None
+    previous = os.path.abspath(args.compare) if args.compare else None
+
+    if args.broker:
+        host, port = args.broker.rsplit(':', 1)
+        port = int(port)
+        broker = None
+    else:
+        broker = MiniBroker().start()
+        host, port = broker.host, broker.port
+
+    # app.py connects to the default broker on import, its CAM log is
+    # opened here in a temporary working directory; its logging.basicConfig
+    # is a no-op once the root logger is configured
+    logging.basicConfig(level=args.log_level, format='[%(asctime)s] %(levelname)s in %(module)s: %(message)s')
+    workdir = tempfile.TemporaryDirectory(prefix='v2v-bench-')
+    os.chdir(workdir.name)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import app
+    for name in ('', 'socketio.server', 'engineio.server', 'werkzeug'):
+        logging.getLogger(name).setLevel(args.log_level)
+    if not args.no_cam_log:
+        app.start_cam_log()
+
+    generator = CamGenerator(args.vehicles, args.seed)
+    recorder = Recorder(generator, sum(int(rate * args.duration) for rate in rates))
+    instrument(app, recorder)
+    app.MQTT_BROKER, app.MQTT_PORT, app.MQTT_TOPIC = host, port, args.topic
+    app.DECODER_PROCESSES = args.decoder_processes
+    app.broadcaster.rate = args.broadcast_rate
+    app.broadcaster.set_binary(args.binary)
+    app.motion_filter.set_enabled(not args.no_suppression)
+    app.start_mqtt()
+    dashboard = connect_dashboard(app)
+    sock = connect_publisher(host, port, 'bench-e2e-publisher')
+    # Let the subscription(s) settle
+    time.sleep(1.0 if not args.decoder_processes else 3.0)
+
+    print(f"{args.vehicles} vehicles, {args.duration:g}s per step, broker {'in-process' if broker else args.broker}, "
+          f"{'binary' if args.binary else 'JSON'} frames at {args.broadcast_rate:g} Hz, "
+          f"{args.decoder_processes or 'no'} decoder processes, CAM log {'off' if app.CAM_LOG is None else 'on'}, "
+          f"motion filter {'on' if app.motion_filter.enabled else 'off'}, "
+          f"{os.cpu_count()} CPUs")
+    steps = []
+    pending = []
+    first_seq = 0
+    for rate in rates:
+        step = run_step(app, recorder, sock, generator, pending, rate, args.duration, first_seq, args.topic,
+                        args.broadcast_rate)
+        first_seq += step['offered']
+        steps.append(step)
+        print_step(step)
+
+    sustained_rates = [step['rate'] for step in steps if sustained(step)]
+    result = {
+        'version': RESULT_VERSION,
+        'meta': {
+            'commit': git_commit(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'broker': args.broker or 'in-process',
+            'vehicles': args.vehicles,
+            'seed': args.seed,
+            'duration': args.duration,
+            'binary': args.binary,
+            'broadcast_rate': args.broadcast_rate,
+            'decoder_processes': args.decoder_processes,
+            'cam_log': app.CAM_LOG is not None,
+            'suppression': app.motion_filter.enabled,
+            'log_level': args.log_level,
+            'batch_size': app.BATCH_SIZE,
+            'ingest_queue_size': app.INGEST_QUEUE_SIZE,
+            'ingest_policy': app.INGEST_POLICY,
+        },
+        'max_sustained_rate': max(sustained_rates) if sustained_rates else None,
+        'steps': steps,
+    }
+    print(f"Max sustained rate: {result['max_sustained_rate']} msg/s")
+    if previous:
+        compare(result, previous)
+    if output:
+        with open(output, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"Results written to {output}")
+
+    dashboard.disconnect()
+    sock.close()
+    app.stop_decoders()
+    if broker:
+        broker.stop()
+
+
+if __name__ == '__main__':
+    main()
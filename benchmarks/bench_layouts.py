@@ -0,0 +1,100 @@
+# Throughput of the CAM decoder on captures with different headers: the
+# header walk for every frame against the layout cached by header signature
+# (cam_decoder.cam_layout), for the MQTT filter of the consumers (every
+# frame), the per-message decoder and the batch decoder (CAM frames only).
+# Payloads are the frames as the producer publishes them; small captures
+# are cycled up to --frames frames.
+#
+#   python -m benchmarks.bench_layouts [capture ...] [--frames N] [--repeat N]
+import argparse
+import itertools
+import os
+import time
+
+import cam_decoder
+from cam_batch import decode_payloads
+from cam_decoder import cam_layout, decode_binary
+from frame_classifier import KIND_CAM, classify
+from pcap_reader import iter_frames
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CAPTURES = [os.path.join(ROOT, name) for name in
+                    ('v2v-EVA-2-0.pcap', 'etsi-its-cam-unsecured.pcapng', 'etsi-its-cam-secured.pcapng')]
+BATCH_SIZE = 256
+
+
+def best_time(func, payloads, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(payloads)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def filter_frames(payloads):
+    for payload in payloads:
+        cam_layout(payload)
+
+
+def decode_frames(payloads):
+    for payload in payloads:
+        decode_binary(payload)
+
+
+def decode_batches(payloads):
+    for i in range(0, len(payloads), BATCH_SIZE):
+        decode_payloads(payloads[i:i + BATCH_SIZE])
+
+
+def set_cache(enabled):
+    cam_decoder._LAYOUTS.clear()
+    cam_decoder.MAX_LAYOUTS = 1024 if enabled else 0
+
+
+def report(name, payloads, walk, cached):
+    print(f"  {name:<12} {walk / len(payloads) * 1e6:8.2f} us/msg {cached / len(payloads) * 1e6:8.2f} us/msg"
+          f" {len(payloads) / cached:12.0f} msg/s  x{walk / cached:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Layout-cached CAM decoder benchmark")
+    parser.add_argument('captures', nargs='*', default=DEFAULT_CAPTURES)
+    parser.add_argument('--frames', type=int, default=20000, help="Frames per capture (cycled)")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    for path in args.captures:
+        frames = []
+        cams = []
+        for frame in iter_frames(path):
+            payload = bytes(frame.data)
+            frames.append(payload)
+            if classify(payload, frame.linktype).kind == KIND_CAM:
+                cams.append(payload)
+        if not cams:
+            print(f"{os.path.basename(path)}: no CAM frame")
+            continue
+        # Both must find the CAMs the classifier finds, and only them
+        set_cache(True)
+        assert [p for p in frames if cam_layout(p) is not None] == cams
+        signatures = len(cam_decoder._LAYOUTS)
+        counts = len(frames), len(cams)
+        frames = list(itertools.islice(itertools.cycle(frames), args.frames))
+        cams = list(itertools.islice(itertools.cycle(cams), args.frames))
+
+        print(f"{os.path.basename(path)}: {counts[0]} frames, {counts[1]} CAMs,"
+              f" {signatures} header signatures, best of {args.repeat}")
+        print(f"  {'':<12} {'header walk':>15} {'cached layout':>15} {'':>18}")
+        for name, func, payloads in (('filter', filter_frames, frames), ('decode', decode_frames, cams),
+                                     (f'batch {BATCH_SIZE}', decode_batches, cams)):
+            set_cache(False)
+            walk = best_time(func, payloads, args.repeat)
+            set_cache(True)
+            cached = best_time(func, payloads, args.repeat)
+            report(name, payloads, walk, cached)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+# Cold-start cost of the entry points: import time and resident memory of
+# the modules each one imports at startup, in a fresh interpreter per run
+# (the GUIs themselves are not started). Every entry point is measured as
+# it is, with Scapy loaded lazily, and with `scapy.all` imported at startup
+# as it used to be.
+#
+#   python -m benchmarks.bench_startup [entry ...] [--repeat N]
+import argparse
+import ast
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENTRY_POINTS = ('app', 'producteur', 'consommateur', 'producer_engine')
+EAGER_SCAPY = 'scapy.all'
+
+# Run in the child: RSS before and after the imports, import time, and
+# whether Scapy got loaded along the way
+_CHILD = '''
+import importlib, json, os, sys, time
+def rss():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+sys.path.insert(0, {root!r})
+before = rss()
+start = time.perf_counter()
+for name in {modules!r}:
+    importlib.import_module(name)
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'rss': rss(), 'rss_growth': rss() - before,
+                  'scapy': 'scapy' in sys.modules}}))
+'''
+
+
+def startup_imports(entry):
+    # Modules imported at the top level of <entry>.py, in order
+    with open(os.path.join(ROOT, entry + '.py')) as f:
+        tree = ast.parse(f.read())
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and not node.level:
+            modules.append(node.module)
+    return modules
+
+
+def measure(modules, repeat):
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', _CHILD.format(root=ROOT, modules=modules)],
+                                capture_output=True, text=True, cwd=ROOT, check=True).stdout
+        runs.append(json.loads(output.splitlines()[-1]))
+    return {
+        'seconds': statistics.median(run['seconds'] for run in runs),
+        'rss': statistics.median(run['rss'] for run in runs),
+        'rss_growth': statistics.median(run['rss_growth'] for run in runs),
+        'scapy': runs[0]['scapy'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Entry point import time and memory")
+    parser.add_argument('entries', nargs='*', default=ENTRY_POINTS)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"Median of {args.repeat} cold starts, {sys.executable}")
+    print(f"{'entry point':<18}{'startup':<20}{'import':>10}{'RSS':>10}{'growth':>10}  scapy")
+    for entry in args.entries:
+        modules = startup_imports(entry)
+        for label, imports in (('lazy scapy', modules), ('scapy.all eager', modules + [EAGER_SCAPY])):
+            result = measure(imports, args.repeat)
+            print(f"{entry:<18}{label:<20}{result['seconds'] * 1000:8.0f}ms{result['rss'] / 2 ** 20:8.1f}MB"
+                  f"{result['rss_growth'] / 2 ** 20:8.1f}MB  {'yes' if result['scapy'] else 'no'}")
+
+
+if __name__ == '__main__':
+    main()
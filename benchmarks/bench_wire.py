@@ -0,0 +1,125 @@
+# Micro-benchmark of the 'vehicles' frame encodings: JSON update objects
+# against the packed columns of wire_format, encoded and decoded as
+# Socket.IO packets, on the CAM frames of v2v-EVA-2-0.pcap.
+#
+#   python -m benchmarks.bench_wire [pcap] [--repeat N]
+import argparse
+import os
+import time
+
+from socketio import packet
+
+from cam_decoder import CAM_LENGTH, decode_payload
+from pcap_reader import iter_frames
+from wire_format import IdDictionary, decode_updates, encode_updates
+
+DEFAULT_PCAP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'v2v-EVA-2-0.pcap')
+
+
+def load_updates(path):
+    updates = []
+    base = None
+    for frame in iter_frames(path):
+        if len(frame.data) != CAM_LENGTH:
+            continue
+        record = decode_payload(bytes(frame.data))
+        if base is None:
+            base = record.timestamp
+        updates.append({
+            'vehicle_id': record.vehicle_id,
+            'latitude': record.latitude,
+            'longitude': record.longitude,
+            'speed': record.speed,
+            'heading': record.heading,
+            'timestamp': record.timestamp,
+            'elapsed': record.timestamp - base,
+        })
+    return updates
+
+
+def encode_json(updates, dictionary):
+    return packet.Packet(packet.EVENT, data=['vehicles', {'updates': updates}]).encode()
+
+
+def decode_json(encoded, ids):
+    return packet.Packet(encoded_packet=encoded).data[1]['updates']
+
+
+def encode_binary(updates, dictionary):
+    frame = {'bin': encode_updates(updates, dictionary)}
+    new, _ = dictionary.announce()
+    if new:
+        frame['ids'] = new
+    return packet.Packet(packet.EVENT, data=['vehicles', frame]).encode()
+
+
+def decode_binary(encoded, ids):
+    header, *attachments = encoded
+    pkt = packet.Packet(encoded_packet=header)
+    for attachment in attachments:
+        pkt.add_attachment(attachment)
+    frame = pkt.data[1]
+    for index, vehicle_id in frame.get('ids', ()):
+        ids[index] = vehicle_id
+    return decode_updates(frame['bin'], ids)
+
+
+def packet_size(encoded):
+    if isinstance(encoded, list):
+        return sum(len(part) for part in encoded)
+    return len(encoded)
+
+
+def run(name, encode, decode, batches, total, repeat):
+    best_encode = best_decode = None
+    for _ in range(repeat):
+        dictionary = IdDictionary()
+        start = time.perf_counter()
+        encoded = [encode(batch, dictionary) for batch in batches]
+        elapsed = time.perf_counter() - start
+        best_encode = elapsed if best_encode is None else min(best_encode, elapsed)
+        ids = {}
+        start = time.perf_counter()
+        decoded = [decode(frame, ids) for frame in encoded]
+        elapsed = time.perf_counter() - start
+        best_decode = elapsed if best_decode is None else min(best_decode, elapsed)
+    assert sum(len(updates) for updates in decoded) == total
+    size = sum(packet_size(frame) for frame in encoded)
+    print(f"{name:<24} {size / total:8.1f} B/update {best_encode / total * 1e6:8.2f} us/update encode "
+          f"{best_decode / total * 1e6:8.2f} us/update decode")
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vehicle frame encoding micro-benchmark")
+    parser.add_argument('pcap', nargs='?', default=DEFAULT_PCAP)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    updates = load_updates(args.pcap)
+    if not updates:
+        print("No CAM frames found in", args.pcap)
+        return
+
+    # The binary path must give back the same updates (within float32 and
+    # 1e-7 deg resolution)
+    dictionary = IdDictionary()
+    ids = {}
+    decoded = decode_binary(encode_binary(updates, dictionary), ids)
+    for original, update in zip(updates, decoded):
+        assert original['vehicle_id'] == update['vehicle_id']
+        assert original['timestamp'] == update['timestamp']
+        assert abs(original['latitude'] - update['latitude']) < 1e-7
+        assert abs(original['speed'] - update['speed']) < 1e-3
+
+    print(f"{len(updates)} updates from {os.path.basename(args.pcap)}, best of {args.repeat}")
+    for batch_size in (1, 11, 100):
+        batches = [updates[i:i + batch_size] for i in range(0, len(updates), batch_size)]
+        print(f"-- {batch_size} updates per frame")
+        json_size = run("json", encode_json, decode_json, batches, len(updates), args.repeat)
+        binary_size = run("binary columns", encode_binary, decode_binary, batches, len(updates), args.repeat)
+        print(f"size: x{json_size / binary_size:.1f} smaller")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+# Synthetic CAM frames: N vehicles driving with smoothly varying speed and
+# heading around a centre point, one CAM per vehicle every PERIOD_MS of
+# simulated time. Frames have the 121-byte layout of v2v-EVA-2-0.pcap
+# (802.11 + LLC/SNAP + GeoNetworking SHB + BTP-B + CAM), so cam_decoder,
+# cam_batch and frame_classifier read them like captured ones.
+#
+#   python -m benchmarks.cam_generator out.pcap [--vehicles N] [--seconds S]
+import argparse
+import math
+import struct
+
+import numpy as np
+
+from cam_decoder import CAM_LENGTH
+from pcap_reader import LINKTYPE_IEEE802_11
+
+PERIOD_MS = 100
+# Around the vehicles of v2v-EVA-2-0.pcap
+CENTER = (45.0794, 7.6579)
+RADIUS_M = 2000.0
+FIRST_STATION_ID = 1000
+_EARTH_RADIUS = 6371000.0
+
+_HEADER = (
+    bytes.fromhex('08000000') + b'\xff' * 6 + bytes(6) + b'\xff' * 6 + bytes(2)   # 802.11 data
+    + bytes.fromhex('aaaa030000008947')                                       # LLC/SNAP, GeoNetworking
+    + bytes.fromhex('11005001')                                               # basic header
+    + bytes.fromhex('2050028000') + bytes([CAM_LENGTH - 76]) + bytes.fromhex('0100')  # common header, SHB
+)
+# Offsets read by cam_decoder: 44 GN address, 52 timestamp, 56 latitude,
+# 60 longitude, 64 speed, 66 heading, 72 BTP-B port 2001, 76 ITS PDU header
+# (protocol version, message id 2 = CAM), 78 station id
+_FIELDS = struct.Struct('>IiiHH')
+_STATION = struct.Struct('>I')
+
+
+def cam_template():
+    frame = bytearray(CAM_LENGTH)
+    frame[:len(_HEADER)] = _HEADER
+    frame[72:76] = (2001).to_bytes(2, 'big') + bytes(2)
+    frame[76:78] = b'\x02\x02'
+    return frame
+
+
+class CamGenerator:
+    # frames(k) returns the CAMs of every vehicle for step k (simulated time
+    # start_ms + k * PERIOD_MS), steps being generated in order. The frame
+    # with sequence number seq is step seq // vehicles, vehicle seq % vehicles.
+
+    def __init__(self, vehicles, seed=0, start_ms=0, center=CENTER, radius=RADIUS_M):
+        self.vehicles = vehicles
+        self.start_ms = start_ms
+        self.step = 0
+        rng = np.random.default_rng(seed)
+        self._rng = rng
+        distance = radius * np.sqrt(rng.random(vehicles))
+        bearing = rng.random(vehicles) * 2 * math.pi
+        self.latitude = center[0] + np.degrees(distance * np.cos(bearing) / _EARTH_RADIUS)
+        self.longitude = center[1] + np.degrees(distance * np.sin(bearing) / _EARTH_RADIUS
+                                                / math.cos(math.radians(center[0])))
+        self.speed = rng.uniform(5.0, 20.0, vehicles)           # m/s
+        self.heading = rng.uniform(0.0, 360.0, vehicles)        # degrees, clockwise from north
+        self._template = cam_template()
+
+    def station_id(self, vehicle):
+        return FIRST_STATION_ID + vehicle
+
+    def timestamp(self, step):
+        return (self.start_ms + step * PERIOD_MS) % 2 ** 32
+
+    def sequence(self, station_id, timestamp):
+        # Inverse of (station id, timestamp) for the frames generated so far
+        step = ((timestamp - self.start_ms) % 2 ** 32) // PERIOD_MS
+        return step * self.vehicles + station_id - FIRST_STATION_ID
+
+    def _move(self):
+        dt = PERIOD_MS / 1000
+        rng = self._rng
+        self.heading = (self.heading + rng.normal(0.0, 2.0, self.vehicles)) % 360.0
+        self.speed = np.clip(self.speed + rng.normal(0.0, 0.3, self.vehicles), 0.0, 35.0)
+        distance = self.speed * dt
+        heading = np.radians(self.heading)
+        self.latitude += np.degrees(distance * np.cos(heading) / _EARTH_RADIUS)
+        self.longitude += np.degrees(distance * np.sin(heading) / _EARTH_RADIUS
+                                     / np.cos(np.radians(self.latitude)))
+
+    def next_frames(self):
+        # CAMs of the next step, in vehicle order
+        step = self.step
+        if step:
+            self._move()
+        self.step += 1
+        timestamp = self.timestamp(step)
+        frames = []
+        template = self._template
+        columns = zip(np.round(self.latitude * 1e7).astype(np.int64).tolist(),
+                      np.round(self.longitude * 1e7).astype(np.int64).tolist(),
+                      np.round(self.speed * 100).astype(np.int64).tolist(),
+                      np.round(self.heading * 10).astype(np.int64).tolist())
+        for vehicle, (latitude, longitude, speed, heading) in enumerate(columns):
+            station = self.station_id(vehicle)
+            # Source MAC address (802.11 and GeoNetworking address) ends with the station id
+            _STATION.pack_into(template, 12, station)
+            _STATION.pack_into(template, 48, station)
+            _FIELDS.pack_into(template, 52, timestamp, latitude, longitude, speed, heading % 3600)
+            _STATION.pack_into(template, 78, station)
+            frames.append(bytes(template))
+        return frames
+
+
+def write_pcap(path, generator, steps):
+    # Frames stamped with their simulated time, replayable by the producer
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, LINKTYPE_IEEE802_11))
+        for _ in range(steps):
+            seconds, millis = divmod(generator.start_ms + generator.step * PERIOD_MS, 1000)
+            for frame in generator.next_frames():
+                f.write(struct.pack('<IIII', seconds, millis * 1000, len(frame), len(frame)))
+                f.write(frame)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic CAM capture generator")
+    parser.add_argument('output')
+    parser.add_argument('--vehicles', type=int, default=100)
+    parser.add_argument('--seconds', type=float, default=60.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    steps = int(args.seconds * 1000 / PERIOD_MS)
+    write_pcap(args.output, CamGenerator(args.vehicles, args.seed), steps)
+    print(f"{steps * args.vehicles} CAMs of {args.vehicles} vehicles written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
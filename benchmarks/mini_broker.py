@@ -0,0 +1,253 @@
+# Minimal in-process MQTT 3.1.1 broker for the benchmarks, standing in for
+# Mosquitto where it is not installed. Supports what the producer and the
+# consumer use: CONNECT, SUBSCRIBE/UNSUBSCRIBE with + and # wildcards and
+# shared subscriptions ($share/<group>/<filter>, one member of the group
+# gets each message, round robin), PUBLISH (delivered with QoS 0, PUBACK
+# sent for QoS 1), PINGREQ and DISCONNECT. No retained messages, sessions
+# or wills.
+#
+#   python -m benchmarks.mini_broker [--port 1883]
+import argparse
+import itertools
+import socket
+import threading
+
+CONNECT, CONNACK, PUBLISH, PUBACK, SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK, PINGREQ, PINGRESP, DISCONNECT = (
+    1, 2, 3, 4, 8, 9, 10, 11, 12, 13, 14)
+RECV_SIZE = 262144
+
+
+def encode_length(length):
+    encoded = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        encoded.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(encoded)
+
+
+def encode_publish(topic, payload):
+    # QoS 0 PUBLISH packet
+    topic = topic.encode()
+    body = len(topic).to_bytes(2, 'big') + topic + payload
+    return bytes([PUBLISH << 4]) + encode_length(len(body)) + body
+
+
+def connect_publisher(host, port, client_id):
+    # Raw MQTT connection for QoS 0 publishing (see encode_publish), so the
+    # publishing side of a benchmark costs next to nothing
+    client_id = client_id.encode()
+    body = b'\x00\x04MQTT\x04\x02\x00\x3c' + len(client_id).to_bytes(2, 'big') + client_id
+    sock = socket.create_connection((host, port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.sendall(bytes([CONNECT << 4]) + encode_length(len(body)) + body)
+    sock.recv(4)
+    return sock
+
+
+def topic_matches(filter_levels, topic_levels):
+    for i, level in enumerate(filter_levels):
+        if level == '#':
+            return True
+        if i >= len(topic_levels) or (level != '+' and level != topic_levels[i]):
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+class _Session:
+    def __init__(self, sock):
+        self.sock = sock
+        self.lock = threading.Lock()
+        self.pending = bytearray()
+
+    def flush(self):
+        with self.lock:
+            if self.pending:
+                data, self.pending = bytes(self.pending), bytearray()
+                self.sock.sendall(data)
+
+
+class MiniBroker:
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.host = host
+        self.port = port
+        self._server = None
+        self._lock = threading.Lock()
+        self._subscriptions = {}   # (session, filter) -> filter levels
+        self._groups = {}          # (group, filter) -> [filter levels, members, round robin counter]
+        self._routes = {}          # topic -> (sessions, groups), cleared on every (un)subscription
+        self.published = 0
+
+    def start(self):
+        self._server = socket.create_server((self.host, self.port))
+        self.port = self._server.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.close()
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self._server.accept()
+            except OSError:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self._serve, args=(_Session(sock),), daemon=True).start()
+
+    def _serve(self, session):
+        buffer = bytearray()
+        try:
+            while True:
+                data = session.sock.recv(RECV_SIZE)
+                if not data:
+                    break
+                buffer += data
+                touched = set()
+                position = 0
+                while True:
+                    packet = self._next_packet(buffer, position)
+                    if packet is None:
+                        break
+                    header, start, position = packet
+                    if not self._handle(session, header, memoryview(buffer)[start:position], touched):
+                        return
+                del buffer[:position]
+                for target in touched:
+                    target.flush()
+                session.flush()
+        except OSError:
+            pass
+        finally:
+            self._remove(session)
+            session.sock.close()
+
+    @staticmethod
+    def _next_packet(buffer, position):
+        # (first byte, body start, body end) of the packet at position, None if incomplete
+        length = 0
+        multiplier = 1
+        index = position + 1
+        while True:
+            if index >= len(buffer):
+                return None
+            byte = buffer[index]
+            length += (byte & 0x7f) * multiplier
+            multiplier *= 128
+            index += 1
+            if not byte & 0x80:
+                break
+        if index + length > len(buffer):
+            return None
+        return buffer[position], index, index + length
+
+    def _handle(self, session, header, body, touched):
+        kind = header >> 4
+        if kind == PUBLISH:
+            qos = (header >> 1) & 0x03
+            topic_length = int.from_bytes(body[:2], 'big')
+            topic = bytes(body[2:2 + topic_length]).decode()
+            payload_start = 2 + topic_length + (2 if qos else 0)
+            if qos == 1:
+                session.pending += bytes([PUBACK << 4, 2]) + bytes(body[2 + topic_length:payload_start])
+            if qos or header & 0x01:
+                packet = encode_publish(topic, bytes(body[payload_start:]))
+            else:
+                packet = bytes([header]) + encode_length(len(body)) + bytes(body)
+            self._route(topic, packet, touched)
+        elif kind == CONNECT:
+            session.pending += bytes([CONNACK << 4, 2, 0, 0])
+        elif kind == SUBSCRIBE:
+            packet_id = bytes(body[:2])
+            granted = bytearray()
+            position = 2
+            while position < len(body):
+                length = int.from_bytes(body[position:position + 2], 'big')
+                self._subscribe(session, bytes(body[position + 2:position + 2 + length]).decode())
+                position += 2 + length + 1
+                granted.append(0)
+            session.pending += bytes([SUBACK << 4]) + encode_length(2 + len(granted)) + packet_id + granted
+        elif kind == UNSUBSCRIBE:
+            packet_id = bytes(body[:2])
+            position = 2
+            while position < len(body):
+                length = int.from_bytes(body[position:position + 2], 'big')
+                self._unsubscribe(session, bytes(body[position + 2:position + 2 + length]).decode())
+                position += 2 + length
+            session.pending += bytes([UNSUBACK << 4, 2]) + packet_id
+        elif kind == PINGREQ:
+            session.pending += bytes([PINGRESP << 4, 0])
+        elif kind == DISCONNECT:
+            return False
+        return True
+
+    def _subscribe(self, session, topic_filter):
+        with self._lock:
+            if topic_filter.startswith('$share/'):
+                _, group, shared = topic_filter.split('/', 2)
+                entry = self._groups.setdefault((group, shared), [shared.split('/'), [], itertools.count()])
+                if session not in entry[1]:
+                    entry[1].append(session)
+            else:
+                self._subscriptions[session, topic_filter] = topic_filter.split('/')
+            self._routes = {}
+
+    def _unsubscribe(self, session, topic_filter):
+        with self._lock:
+            if topic_filter.startswith('$share/'):
+                _, group, shared = topic_filter.split('/', 2)
+                entry = self._groups.get((group, shared))
+                if entry and session in entry[1]:
+                    entry[1].remove(session)
+            else:
+                self._subscriptions.pop((session, topic_filter), None)
+            self._routes = {}
+
+    def _remove(self, session):
+        with self._lock:
+            for key in [key for key in self._subscriptions if key[0] is session]:
+                del self._subscriptions[key]
+            for entry in self._groups.values():
+                if session in entry[1]:
+                    entry[1].remove(session)
+            self._routes = {}
+
+    def _route(self, topic, packet, touched):
+        routes = self._routes
+        route = routes.get(topic)
+        if route is None:
+            levels = topic.split('/')
+            with self._lock:
+                sessions = {session for (session, _), filter_levels in self._subscriptions.items()
+                            if topic_matches(filter_levels, levels)}
+                groups = [entry for entry in self._groups.values() if topic_matches(entry[0], levels)]
+                route = routes[topic] = (sessions, groups)
+        sessions, groups = route
+        self.published += 1
+        for session in sessions:
+            with session.lock:
+                session.pending += packet
+            touched.add(session)
+        for _, members, counter in groups:
+            if members:
+                session = members[next(counter) % len(members)]
+                with session.lock:
+                    session.pending += packet
+                touched.add(session)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Minimal MQTT broker for the benchmarks")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1883)
+    args = parser.parse_args()
+    broker = MiniBroker(args.host, args.port).start()
+    print(f"Listening on {broker.host}:{broker.port}")
+    threading.Event().wait()
+
+
+if __name__ == '__main__':
+    main()
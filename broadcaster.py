@@ -0,0 +1,400 @@
+import itertools
+import json
+import logging
+import threading
+import time
+import uuid
+
+from spatial_index import GridIndex
+from trace_simplifier import level_for_zoom
+from wire_format import IdDictionary, encode_updates
+
+# Text messages kept between two ticks when they are broadcast as well
+MAX_MESSAGES_PER_FRAME = 100
+# Room of the clients that did not report a viewport: they get every vehicle
+UNFILTERED_ROOM = 'unfiltered'
+# Frame fields sent as binary attachments in binary mode
+BINARY_FIELDS = ('bin', 'raw')
+# Tick frames whose JSON size is measured, for the frame size stats: one in
+# N (1: every frame). Sync frames (one per connection) are all measured.
+SIZE_SAMPLE_EVERY = 20
+
+
+class ClientView:
+    __slots__ = ('bounds', 'visible', 'dirty', 'resync', 'level', 'trace_seq', 'ids')
+
+    def __init__(self, level=0):
+        self.bounds = None     # (south, west, north, east) including the margin
+        self.visible = set()   # vehicles the client currently displays
+        self.dirty = False     # viewport changed since the last tick
+        self.resync = False    # every visible vehicle must be sent again
+        self.level = level     # trace level matching the map zoom
+        self.trace_seq = {}    # vehicle_id -> trace points already sent
+        self.ids = None        # vehicle id dictionary of binary frames (None: the room's)
+
+
+class Broadcaster:
+    # Coalesces vehicle updates and sends them to the browsers on a fixed
+    # tick: one 'vehicles' frame per tick holding the latest update of every
+    # vehicle that changed since the previous one. Clients that reported
+    # their map bounds only get the vehicles inside them (plus a margin),
+    # with the current state of vehicles entering the view and a 'leave'
+    # list for the ones leaving it.
+    #
+    # With a track store, frames also carry the simplified trace points of
+    # the level matching each client's zoom: 'traces' maps a vehicle to the
+    # points kept since the previous frame, and 'trace_reset' lists the
+    # vehicles whose trace must be replaced by these points (vehicles
+    # entering the view, zoom level changes), 'trace_seq' giving their
+    # sequence numbers.
+    #
+    # Frames carry the version of the state they bring the client to (one
+    # version per tick with changes). A connecting client first gets a sync
+    # frame with the whole state in its view, or, when it reconnects to the
+    # same server (epoch) with the last version it received, only what
+    # changed since.
+    #
+    # In binary mode the updates are sent as packed columns ('bin', see
+    # wire_format) with the vehicle ids replaced by indexes in a dictionary
+    # per connection (shared by the unfiltered room): 'ids' lists the new
+    # [index, vehicle_id] entries, 'ids_reset' tells to drop the previous ones.
+
+    def __init__(self, socketio, rate=10, include_messages=False,
+                 viewport_margin=0.2, vehicle_timeout=300.0, cell_size=0.01,
+                 store=None, default_level=0, binary=False, emit_histogram=None):
+        self.socketio = socketio
+        # Optional metrics.Histogram of the Socket.IO emit durations
+        self.emit_histogram = emit_histogram
+        self.binary = binary
+        self.store = store
+        self.default_level = default_level
+        self.rate = rate
+        self.include_messages = include_messages
+        self.viewport_margin = viewport_margin
+        self.vehicle_timeout = vehicle_timeout
+        self._lock = threading.Lock()
+        self._latest = {}
+        self._state = {}      # vehicle_id -> latest update
+        self._versions = {}   # vehicle_id -> version of the frame carrying the latest update
+        self._last_seen = {}  # vehicle_id -> time.time() of the latest update
+        self._index = GridIndex(cell_size)
+        self._clients = {}
+        self._room_trace_seq = {}
+        self._room_ids = IdDictionary()
+        self._raw = []
+        self._translated = []
+        self._task = None
+        self._last_sweep = time.time()
+        self.epoch = uuid.uuid4().hex[:8]
+        self.version = 0
+        self.syncs = 0
+        self.resumed_syncs = 0
+        self.updates_in = 0
+        self.updates_out = 0
+        self.frames = 0
+        self._emit_seq = itertools.count()
+        self.sync_bytes = 0
+        # Sizes of the sampled tick frames only
+        self.sampled_frames = 0
+        self.sampled_bytes = 0
+        self.sampled_updates = 0
+        self.max_frame_bytes = 0
+        self.emit_seconds = 0.0
+        self.trace_points_out = 0
+        self.trace_resets = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = self.socketio.start_background_task(self._run)
+
+    def add_client(self, sid, bounds=None, zoom=None, epoch=None, version=None,
+                   vehicles=(), trace_level=None, trace_seq=None):
+        # Registers a client and sends it its sync frame. A reconnecting
+        # client reports the epoch and version of the last frame it got, the
+        # vehicles it displays and, for the trace level it draws, the trace
+        # sequence number of each vehicle.
+        with self._lock:
+            client = self._clients[sid] = ClientView(self.default_level)
+            if bounds is not None:
+                client.bounds = self._with_margin(*bounds)
+                if zoom is not None:
+                    client.level = level_for_zoom(zoom, self._levels())
+            known = set(vehicles)
+            resume = epoch == self.epoch and version is not None and version <= self.version
+            if client.bounds is None:
+                in_view = set(self._state)
+            else:
+                in_view = self._index.query(*client.bounds)
+            if resume:
+                updates = [self._state[v] for v in in_view if v not in known or self._versions[v] > version]
+                if trace_seq and trace_level == client.level:
+                    client.trace_seq = {v: seq for v, seq in trace_seq.items() if v in known}
+                self.resumed_syncs += 1
+            else:
+                updates = [self._state[v] for v in in_view]
+            self.syncs += 1
+            client.visible = in_view
+            frame = {'epoch': self.epoch, 'version': self.version, 'updates': updates}
+            # Unfiltered clients then follow the room frames, their traces
+            # stop where the room is
+            self._traces([update['vehicle_id'] for update in updates], client.level, client.trace_seq, frame,
+                         self._room_trace_seq if client.bounds is None else None)
+            leaving = known - in_view
+            if leaving:
+                frame['leave'] = list(leaving)
+            if self.binary:
+                # The client gets the whole dictionary. New room entries stay
+                # pending, the next room frame announces them to the others.
+                if client.bounds is None:
+                    dictionary = self._room_ids
+                else:
+                    dictionary = client.ids = IdDictionary()
+                frame['bin'] = encode_updates(frame.pop('updates'), dictionary)
+                if client.bounds is not None:
+                    dictionary.announce()
+                frame['ids'] = dictionary.entries()
+                frame['ids_reset'] = True
+            elif client.bounds is not None:
+                client.ids = IdDictionary(reset=True)
+        self._emit(sid, frame, len(updates), sync=True)
+
+    def remove_client(self, sid):
+        with self._lock:
+            self._clients.pop(sid, None)
+
+    def _with_margin(self, south, west, north, east):
+        lat_margin = (north - south) * self.viewport_margin
+        lon_margin = (east - west) * self.viewport_margin
+        return (south - lat_margin, west - lon_margin, north + lat_margin, east + lon_margin)
+
+    def set_viewport(self, sid, south, west, north, east, zoom=None):
+        with self._lock:
+            client = self._clients.get(sid)
+            if client is None:
+                return
+            if client.bounds is None:
+                # Leaving the unfiltered room: the client has what the room got
+                client.visible = set(self._state)
+                client.trace_seq = dict(self._room_trace_seq)
+                client.ids = self._room_ids.copy()
+            client.bounds = self._with_margin(south, west, north, east)
+            client.dirty = True
+            if zoom is not None:
+                level = level_for_zoom(zoom, self._levels())
+                if level != client.level:
+                    # Every trace is sent again at the new level
+                    client.level = level
+                    client.trace_seq = {}
+                    client.resync = True
+
+    def set_binary(self, enabled):
+        # Dictionaries start over when switching to binary frames
+        with self._lock:
+            if enabled and not self.binary:
+                self._room_ids = IdDictionary(reset=True)
+                for client in self._clients.values():
+                    client.ids = IdDictionary(reset=True) if client.bounds is not None else None
+            self.binary = enabled
+
+    def _encode(self, frame, dictionary):
+        if not self.binary:
+            return
+        dictionary.clear_if_full()
+        frame['bin'] = encode_updates(frame.pop('updates'), dictionary)
+        new, reset = dictionary.announce()
+        if new:
+            frame['ids'] = new
+        if reset:
+            frame['ids_reset'] = True
+
+    def _levels(self):
+        return self.store.levels if self.store is not None else ((0, 0.0),)
+
+    def push(self, update):
+        vehicle_id = update['vehicle_id']
+        with self._lock:
+            self._latest[vehicle_id] = update
+            self._state[vehicle_id] = update
+            self._versions[vehicle_id] = self.version + 1
+            self._last_seen[vehicle_id] = time.time()
+            self._index.update(vehicle_id, update['latitude'], update['longitude'])
+            self.updates_in += 1
+
+    def touch(self, vehicle_ids):
+        # Vehicles with updates that were not pushed (see motion_filter)
+        # are still alive
+        now = time.time()
+        with self._lock:
+            for vehicle_id in vehicle_ids:
+                if vehicle_id in self._last_seen:
+                    self._last_seen[vehicle_id] = now
+
+    def push_messages(self, raw, translated):
+        if not self.include_messages:
+            return
+        with self._lock:
+            self._raw.extend(raw)
+            self._translated.extend(translated)
+            del self._raw[:-MAX_MESSAGES_PER_FRAME]
+            del self._translated[:-MAX_MESSAGES_PER_FRAME]
+
+    def _run(self):
+        while True:
+            self.socketio.sleep(1.0 / self.rate)
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error("Error broadcasting vehicle updates: %s", e)
+
+    def _expire(self, now):
+        # Vehicles silent for vehicle_timeout seconds leave every view
+        silent = now - self.vehicle_timeout
+        expired = [v for v, seen in self._last_seen.items() if seen < silent]
+        for vehicle_id in expired:
+            del self._last_seen[vehicle_id]
+            del self._state[vehicle_id]
+            del self._versions[vehicle_id]
+            self._latest.pop(vehicle_id, None)
+            self._index.remove(vehicle_id)
+            self._room_trace_seq.pop(vehicle_id, None)
+        return expired
+
+    def _traces(self, vehicles, level, sent, frame, until=None):
+        # Adds to the frame the trace points of the vehicles not sent yet
+        # (up to the sequence numbers in `until`, when given)
+        if self.store is None:
+            return
+        traces = {}
+        reset = []
+        for vehicle_id in vehicles:
+            seq = sent.get(vehicle_id)
+            limit = until.get(vehicle_id) if until is not None else None
+            points, sent[vehicle_id], contiguous = self.store.trace_since(vehicle_id, level, seq or 0, limit)
+            if seq is None or not contiguous:
+                reset.append(vehicle_id)
+            elif not points:
+                continue
+            traces[vehicle_id] = points
+            self.trace_points_out += len(points)
+        if traces:
+            frame['traces'] = traces
+        if reset:
+            frame['trace_reset'] = reset
+            frame['trace_seq'] = {vehicle_id: sent[vehicle_id] for vehicle_id in reset}
+            frame['trace_level'] = level
+            self.trace_resets += len(reset)
+
+    def flush(self):
+        now = time.time()
+        frames = []
+        with self._lock:
+            expired = []
+            if now - self._last_sweep >= 1.0:
+                self._last_sweep = now
+                expired = self._expire(now)
+            changed = self._latest
+            self._latest = {}
+            if changed or expired:
+                self.version += 1
+            messages = None
+            if self._raw:
+                messages = (self._raw, self._translated)
+                self._raw = []
+                self._translated = []
+
+            unfiltered = any(client.bounds is None for client in self._clients.values())
+            if unfiltered and (changed or expired or messages):
+                frame = {'version': self.version, 'updates': list(changed.values())}
+                count = len(changed)
+                self._traces(changed, self.default_level, self._room_trace_seq, frame)
+                if expired:
+                    frame['leave'] = expired
+                if messages:
+                    raw, frame['translated'] = messages
+                    if self.binary:
+                        frame['raw'] = b''.join(raw)
+                        frame['raw_lengths'] = [len(payload) for payload in raw]
+                    else:
+                        frame['raw'] = [payload.decode('utf-8', errors='replace') for payload in raw]
+                self._encode(frame, self._room_ids)
+                frames.append((UNFILTERED_ROOM, frame, count))
+
+            for sid, client in self._clients.items():
+                if client.bounds is None or not (changed or expired or client.dirty):
+                    continue
+                client.dirty = False
+                visible = self._index.query(*client.bounds)
+                entering = visible if client.resync else visible - client.visible
+                client.resync = False
+                leaving = (client.visible - visible).union(v for v in expired if v in client.visible)
+                updates = [update for vehicle_id, update in changed.items() if vehicle_id in visible]
+                updates.extend(self._state[v] for v in entering if v not in changed)
+                client.visible = visible
+                for vehicle_id in leaving:
+                    client.trace_seq.pop(vehicle_id, None)
+                if updates or leaving:
+                    frame = {'version': self.version, 'updates': updates}
+                    self._traces([update['vehicle_id'] for update in updates], client.level, client.trace_seq, frame)
+                    if leaving:
+                        frame['leave'] = list(leaving)
+                    self._encode(frame, client.ids)
+                    frames.append((sid, frame, len(updates)))
+
+        for to, frame, count in frames:
+            self._emit(to, frame, count)
+
+    def _emit(self, to, frame, count, sync=False):
+        # Called from add_client and the tick, outside the lock: the
+        # counters are updated under it once the frame is sent
+        start = time.perf_counter()
+        size = None
+        if sync or next(self._emit_seq) % SIZE_SAMPLE_EVERY == 0:
+            # Serializing the frame again only to measure it would double the
+            # encoding cost of every tick: sizes are sampled
+            if 'bin' in frame:
+                text = {key: value for key, value in frame.items() if key not in BINARY_FIELDS}
+                size = len(json.dumps(text, separators=(',', ':'))) + sum(len(frame.get(key, b'')) for key in BINARY_FIELDS)
+            else:
+                size = len(json.dumps(frame, separators=(',', ':')))
+        emit_start = time.perf_counter()
+        self.socketio.emit('vehicles', frame, to=to)
+        end = time.perf_counter()
+        if self.emit_histogram is not None:
+            self.emit_histogram.observe(end - emit_start)
+        with self._lock:
+            self.emit_seconds += end - start
+            self.frames += 1
+            self.updates_out += count
+            if sync:
+                self.sync_bytes += size
+            elif size is not None:
+                self.sampled_frames += 1
+                self.sampled_bytes += size
+                self.sampled_updates += count
+                if size > self.max_frame_bytes:
+                    self.max_frame_bytes = size
+
+    def stats(self):
+        # Tick frame sizes: averages and max of the sampled frames
+        with self._lock:
+            return {
+                'rate': self.rate,
+                'clients': len(self._clients),
+                'viewport_clients': sum(1 for c in self._clients.values() if c.bounds is not None),
+                'vehicles': len(self._state),
+                'frames': self.frames,
+                'updates_in': self.updates_in,
+                'updates_out': self.updates_out,
+                'sampled_frames': self.sampled_frames,
+                'avg_frame_bytes': self.sampled_bytes / self.sampled_frames if self.sampled_frames else 0,
+                'bytes_per_update': self.sampled_bytes / self.sampled_updates if self.sampled_updates else 0,
+                'max_frame_bytes': self.max_frame_bytes,
+                'emit_seconds': self.emit_seconds,
+                'trace_points_out': self.trace_points_out,
+                'trace_resets': self.trace_resets,
+                'binary': self.binary,
+                'version': self.version,
+                'syncs': self.syncs,
+                'resumed_syncs': self.resumed_syncs,
+                'sync_bytes': self.sync_bytes,
+            }
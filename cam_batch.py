@@ -0,0 +1,84 @@
+import logging
+
+import numpy as np
+
+from cam_decoder import CamRecord, cam_layout, decode_fields, decode_text, is_text_payload
+
+# Same fields as cam_decoder, read at once for all the frames of a batch
+# with the same layout and length (one dtype per layout and length)
+_FIELD_NAMES = ['timestamp', 'latitude', 'longitude', 'speed', 'heading', 'vehicle_id']
+_FIELD_FORMATS = ['>u4', '>i4', '>i4', '>u2', '>u2', '>u4']
+_DTYPES = {}
+# Shorter runs are read frame by frame with the struct of their layout
+MIN_BATCH = 8
+
+
+def cam_dtype(layout, length):
+    dtype = _DTYPES.get((layout, length))
+    if dtype is None:
+        position = layout.position
+        dtype = _DTYPES[(layout, length)] = np.dtype({
+            'names': _FIELD_NAMES,
+            'formats': _FIELD_FORMATS,
+            'offsets': [position + 8, position + 12, position + 16, position + 20, position + 22, layout.end - 4],
+            'itemsize': length,
+        })
+    return dtype
+
+
+def decode_batch(frames, count, dtype):
+    cams = np.frombuffer(frames, dtype=dtype, count=count)
+    columns = (
+        cams['vehicle_id'].tolist(),
+        cams['timestamp'].tolist(),
+        (cams['latitude'] / 1e7).tolist(),
+        (cams['longitude'] / 1e7).tolist(),
+        (cams['speed'] / 100.0).tolist(),
+        (cams['heading'] / 10).tolist(),
+    )
+    return list(map(CamRecord._make, zip(*columns)))
+
+
+def _decode_run(frames, layout):
+    # Frames with the same layout and length
+    if len(frames) < MIN_BATCH:
+        return [decode_fields(frame, layout) for frame in frames]
+    return decode_batch(b''.join(frames), len(frames), cam_dtype(layout, len(frames[0])))
+
+
+def decode_payloads(payloads):
+    # Consecutive binary CAMs with the same layout and length are decoded
+    # together, text payloads one by one, in order. Returns the records and
+    # their payloads, without the undecodable ones.
+    records = []
+    decoded = []
+    frames = []
+    run_layout = None
+    run_length = 0
+    for payload in payloads:
+        if is_text_payload(payload):
+            record = decode_text(bytes(payload))
+            if record is not None:
+                if frames:
+                    records += _decode_run(frames, run_layout)
+                    decoded += frames
+                    frames = []
+                records.append(record)
+                decoded.append(payload)
+                continue
+        layout = cam_layout(payload)
+        if layout is None:
+            logging.error("Failed to parse required fields from both text and binary formats")
+            continue
+        if layout is not run_layout or len(payload) != run_length:
+            if frames:
+                records += _decode_run(frames, run_layout)
+                decoded += frames
+                frames = []
+            run_layout = layout
+            run_length = len(payload)
+        frames.append(payload)
+    if frames:
+        records += _decode_run(frames, run_layout)
+        decoded += frames
+    return records, decoded
@@ -0,0 +1,209 @@
+import re
+import struct
+from collections import namedtuple
+
+from frame_classifier import ETHERTYPE_GEONETWORKING, geonetworking_headers, geonetworking_offset
+from pcap_reader import LINKTYPE_ETHERNET, LINKTYPE_IEEE802_11
+
+# Size of the CAM frames of v2v-EVA-2-0.pcap (802.11 header + LLC/SNAP +
+# GeoNetworking SHB + BTP-B + CAM). Other captures have other headers
+# (Ethernet, security envelope, TSB...): see cam_layout.
+CAM_LENGTH = 121
+
+# Where the CAM fields are in a frame, found by walking its headers:
+#   position: source position vector of the GeoNetworking extended header,
+#     GN address (8 bytes), timestamp (u32), latitude (s32, 1e-7 deg),
+#     longitude (s32, 1e-7 deg), speed (u16, cm/s), heading (u16, 0.1 deg)
+#   btp: BTP header (destination port 2001), followed by the ITS PDU header
+#     (protocol version, message id 2 = CAM, station id u32 = vehicle id)
+#   end: size of a frame holding all of them
+#   fields: reads timestamp..heading and the station id from position
+CamLayout = namedtuple('CamLayout', ['position', 'btp', 'end', 'fields'])
+
+# Layouts by header signature (see _signature): the header walk only runs
+# for the first frame of every kind of headers. None for the headers that
+# cannot carry a CAM. At most MAX_LAYOUTS signatures are kept.
+MAX_LAYOUTS = 1024
+_LAYOUTS = {}
+_UNKNOWN = object()
+
+_CAM_PORT = (2001).to_bytes(2, 'big')
+_CAM_MESSAGE_ID = 2
+_ETHERTYPE = ETHERTYPE_GEONETWORKING.to_bytes(2, 'big')
+_ETHERTYPE_VLAN = b'\x81\x00'
+# LLC/SNAP header followed by the GeoNetworking ethertype (802.11)
+_SNAP_GN = b'\xaa\xaa\x03\x00\x00\x00' + _ETHERTYPE
+# IEEE 1609.2 envelope: protocol version 3, signed or unsecured content
+_SEC_SIGNED = b'\x03\x81'
+_SEC_UNSECURED = b'\x03\x80'
+# Header type, subtype of the common header -> the source position vector
+# is the first field of the extended header (SHB, beacon), it follows the
+# sequence number otherwise
+_POSITION_FIRST = {(5, 0), (1, 0)}
+# Frames shorter than an Ethernet header (up to its ethertype) are not
+# GeoNetworking, whatever the link layer; the link checks of _signature
+# read within it
+_MIN_LENGTH = 14
+
+# Text payloads ("Vehicle ID: ..., Latitude: ...") are matched in a single pass,
+# the last occurrence of every field wins.
+_TEXT_FIELDS = re.compile(
+    rb"Vehicle ID:\s*(\S+)"
+    rb"|Latitude:\s*([0-9.]+)"
+    rb"|Longitude:\s*([0-9.]+)"
+    rb"|Speed:\s*([0-9.]+)"
+    rb"|Heading:\s*([0-9.]+)"
+)
+
+# timestamp is None for text payloads, which do not carry one
+CamRecord = namedtuple('CamRecord', ['vehicle_id', 'timestamp', 'latitude', 'longitude', 'speed', 'heading'])
+
+
+def is_text_payload(payload):
+    # Binary frames always contain non-ASCII bytes (broadcast MAC address,
+    # positions...), text payloads never do.
+    if not isinstance(payload, bytes):
+        payload = bytes(payload)
+    return payload.isascii()
+
+
+def _linktype(frame):
+    ethertype = frame[12:14]
+    if ethertype == _ETHERTYPE or ethertype == _ETHERTYPE_VLAN:
+        return LINKTYPE_ETHERNET
+    return LINKTYPE_IEEE802_11
+
+
+def _signature(frame):
+    # The bytes the header walk decides on, up to the GeoNetworking common
+    # header (frame control, LLC/SNAP or ethertype, basic header, security
+    # envelope without its lengths, next header and header type), so that
+    # frames with the same signature have the same layout. None for
+    # everything that cannot hold a CAM, never cached: frames that are not
+    # GeoNetworking over Ethernet or 802.11 data + LLC/SNAP, frames cut
+    # before the common header and envelopes that do not carry the packet
+    # in clear.
+    length = len(frame)
+    if length < _MIN_LENGTH:
+        return None
+    ethertype = frame[12:14]
+    if ethertype == _ETHERTYPE:
+        offset = 14
+        signature = ethertype
+    elif ethertype == _ETHERTYPE_VLAN:
+        if frame[16:18] != _ETHERTYPE:
+            return None
+        offset = 18
+        signature = ethertype
+    else:
+        # 802.11 data frame (protocol version 0), QoS control and fourth
+        # address moving the LLC/SNAP header
+        if frame[0] & 0x0f != 0x08:
+            return None
+        offset = 34 if frame[0] & 0x80 else 32
+        if frame[1] & 0x03 == 0x03:
+            offset += 6
+        if frame[offset - 8:offset] != _SNAP_GN:
+            return None
+        signature = frame[:2]
+    common = offset + 4
+    if length < common + 8:
+        return None
+    basic = frame[offset:offset + 1]
+    if basic[0] & 0x0f == 2:
+        envelope = common
+        while frame[common:common + 2] == _SEC_SIGNED:
+            common += 4
+        if frame[common:common + 2] != _SEC_UNSECURED or length < common + 3:
+            return None
+        # OER length determinant: only its size matters
+        first = frame[common + 2]
+        size = first & 0x7f if first & 0x80 else 0
+        basic += frame[envelope:common + 2] + bytes((size,))
+        common += 3 + size
+        if length < common + 8:
+            return None
+    return signature + basic + frame[common:common + 2]
+
+
+def _resolve(frame):
+    # Header walk of frame_classifier
+    offset = geonetworking_offset(frame, _linktype(frame))
+    if offset is None or len(frame) < offset + 4:
+        return None
+    headers = geonetworking_headers(frame, offset)
+    if headers is None or headers.btp is None:
+        return None
+    position = headers.extended
+    if (headers.header_type, headers.subtype) not in _POSITION_FIRST:
+        position += 4
+    station = headers.btp + 6
+    return CamLayout(position, headers.btp, station + 4,
+                     struct.Struct(f'>8xIiiHH{station - position - 24}xI'))
+
+
+def cam_layout(frame):
+    # CamLayout of a binary CAM, None for any other frame: a signature
+    # lookup, then the BTP port and the message id at the cached offsets
+    signature = _signature(frame)
+    if signature is None:
+        return None
+    layout = _LAYOUTS.get(signature, _UNKNOWN)
+    if layout is _UNKNOWN:
+        layout = _resolve(frame)
+        if len(_LAYOUTS) < MAX_LAYOUTS:
+            _LAYOUTS[signature] = layout
+    if layout is None:
+        return None
+    btp = layout.btp
+    if len(frame) < layout.end or frame[btp:btp + 2] != _CAM_PORT or frame[btp + 5] != _CAM_MESSAGE_ID:
+        return None
+    return layout
+
+
+def decode_fields(raw, layout):
+    timestamp, latitude, longitude, speed, heading, vehicle_id = layout.fields.unpack_from(raw, layout.position)
+    return CamRecord(vehicle_id, timestamp, latitude / 1e7, longitude / 1e7, speed / 100.0, heading / 10)
+
+
+def decode_binary(raw):
+    layout = cam_layout(raw)
+    if layout is None:
+        return None
+    return decode_fields(raw, layout)
+
+
+def decode_text(payload):
+    fields = [None] * 5
+    for match in _TEXT_FIELDS.finditer(payload):
+        fields[match.lastindex - 1] = match.group(match.lastindex)
+    vehicle_id, latitude, longitude, speed, heading = fields
+    if vehicle_id is None or latitude is None or longitude is None:
+        return None
+    try:
+        return CamRecord(vehicle_id.decode('utf-8', errors='replace'), None,
+                         float(latitude), float(longitude),
+                         float(speed) if speed else 0, float(heading) if heading else 0)
+    except ValueError:
+        return None
+
+
+def decode_payload(payload):
+    # Text first (as the consumer always did), binary layout otherwise
+    if is_text_payload(payload):
+        record = decode_text(bytes(payload))
+        if record is not None:
+            return record
+    return decode_binary(payload)
+
+
+def format_record(record):
+    timestamp = f"{record.timestamp} ms" if record.timestamp is not None else "N/A"
+    return (
+        f"Vehicle ID: {record.vehicle_id}\n"
+        f"Timestamp: {timestamp}\n"
+        f"Latitude: {record.latitude}\n"
+        f"Longitude: {record.longitude}\n"
+        f"Speed: {record.speed} m/s\n"
+        f"Heading: {record.heading}"
+    )
@@ -0,0 +1,420 @@
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+
+# Fixed-width little-endian record: timestamp (ms), vehicle id (u32),
+# latitude and longitude (1e-7 deg), speed (cm/s), heading (0.1 deg)
+RECORD = struct.Struct('<qIiiHH')
+RECORD_SIZE = RECORD.size
+_TIMESTAMP = struct.Struct('<q')
+
+# One (min, max) timestamp pair per block of BLOCK_RECORDS records
+BLOCK_RECORDS = 256
+
+# Index file: header, block table, vehicle table, record numbers
+_INDEX_MAGIC = b'CAMI'
+_INDEX_VERSION = 1
+_INDEX_HEADER = struct.Struct('<4sHIIII')   # magic, version, block size, records, blocks, vehicles
+_BLOCK_ENTRY = struct.Struct('<qq')         # min timestamp, max timestamp
+_VEHICLE_ENTRY = struct.Struct('<IIIB3x')   # vehicle, first record number, count, unsorted
+
+SEGMENT_SUFFIX = '.seg'
+INDEX_SUFFIX = '.idx'
+
+LogRecord = namedtuple('LogRecord', ['vehicle_id', 'timestamp', 'latitude', 'longitude', 'speed', 'heading'])
+
+
+def vehicle_key(vehicle_id):
+    # Station ids are stored as is, other (text) ids as their CRC-32
+    if isinstance(vehicle_id, int):
+        return vehicle_id & 0xFFFFFFFF
+    text = str(vehicle_id)
+    if text.isdigit() and int(text) <= 0xFFFFFFFF:
+        return int(text)
+    return zlib.crc32(text.encode('utf-8'))
+
+
+def _u16(value):
+    return min(max(int(round(value)), 0), 0xFFFF)
+
+
+def pack_record(vehicle_id, timestamp, latitude, longitude, speed, heading):
+    return RECORD.pack(int(timestamp), vehicle_key(vehicle_id),
+                       int(round(latitude * 1e7)), int(round(longitude * 1e7)),
+                       _u16(speed * 100), _u16(heading * 10))
+
+
+def read_record(view, number):
+    timestamp, vehicle_id, latitude, longitude, speed, heading = RECORD.unpack_from(view, number * RECORD_SIZE)
+    return LogRecord(vehicle_id, timestamp, latitude / 1e7, longitude / 1e7, speed / 100.0, heading / 10)
+
+
+def _timestamp(view, number):
+    return _TIMESTAMP.unpack_from(view, number * RECORD_SIZE)[0]
+
+
+class SegmentIndex:
+    # Sparse timestamp index (min and max of every block of records) and
+    # per-vehicle index (record numbers in append order) of one segment.
+    # Vehicles whose timestamps did not arrive in order are flagged, their
+    # records are scanned instead of bisected.
+
+    def __init__(self):
+        self.records = 0
+        self.block_min = array('q')
+        self.block_max = array('q')
+        self.vehicles = {}
+        self.unsorted = set()
+        self.shared = False  # record number arrays still appended to (see frozen)
+        self._last = {}
+        self._bounds = None
+
+    @property
+    def min_timestamp(self):
+        return min(self.block_min) if self.block_min else None
+
+    @property
+    def max_timestamp(self):
+        return max(self.block_max) if self.block_max else None
+
+    def add(self, key, timestamp):
+        number = self.records
+        if number % BLOCK_RECORDS == 0:
+            self.block_min.append(timestamp)
+            self.block_max.append(timestamp)
+        elif timestamp < self.block_min[-1]:
+            self.block_min[-1] = timestamp
+        elif timestamp > self.block_max[-1]:
+            self.block_max[-1] = timestamp
+        numbers = self.vehicles.get(key)
+        if numbers is None:
+            numbers = self.vehicles[key] = array('I')
+        elif timestamp < self._last[key]:
+            self.unsorted.add(key)
+        numbers.append(number)
+        self._last[key] = timestamp
+        self.records += 1
+        self._bounds = None
+
+    def frozen(self):
+        # Copy of the tables as they are now, for the readers of the segment
+        # being appended to: the record number arrays are shared (append
+        # only), readers cut them at records (see numbers)
+        index = SegmentIndex()
+        index.shared = True
+        index.records = self.records
+        index.block_min = array('q', self.block_min)
+        index.block_max = array('q', self.block_max)
+        index.vehicles = dict(self.vehicles)
+        index.unsorted = set(self.unsorted)
+        return index
+
+    def numbers(self, key):
+        # Record numbers of a vehicle (ascending). Shared arrays keep
+        # growing: the records this index covers are copied.
+        numbers = self.vehicles.get(key)
+        if numbers and self.shared:
+            return numbers[:bisect_left(numbers, self.records)]
+        return numbers
+
+    def blocks_between(self, start, end):
+        # Running max of the block maxima and running min (from the end) of
+        # the block minima are both sorted: the blocks that may hold
+        # timestamps in [start, end] are found by bisection.
+        if self._bounds is None:
+            prefix_max, suffix_min = array('q'), array('q')
+            for value in self.block_max:
+                prefix_max.append(max(value, prefix_max[-1]) if prefix_max else value)
+            for value in reversed(self.block_min):
+                suffix_min.append(min(value, suffix_min[-1]) if suffix_min else value)
+            suffix_min.reverse()
+            self._bounds = (prefix_max, suffix_min)
+        prefix_max, suffix_min = self._bounds
+        first = bisect_left(prefix_max, start)
+        last = bisect_right(suffix_min, end)
+        return [block for block in range(first, last)
+                if self.block_max[block] >= start and self.block_min[block] <= end]
+
+    def save(self, path):
+        entries = []
+        numbers = array('I')
+        for key, records in self.vehicles.items():
+            entries.append(_VEHICLE_ENTRY.pack(key, len(numbers), len(records), key in self.unsorted))
+            numbers.extend(records)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(_INDEX_HEADER.pack(_INDEX_MAGIC, _INDEX_VERSION, BLOCK_RECORDS, self.records,
+                                       len(self.block_min), len(entries)))
+            for pair in zip(self.block_min, self.block_max):
+                f.write(_BLOCK_ENTRY.pack(*pair))
+            f.write(b''.join(entries))
+            f.write(numbers.tobytes())
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        magic, version, block_records, records, blocks, vehicles = _INDEX_HEADER.unpack_from(data)
+        if magic != _INDEX_MAGIC or version != _INDEX_VERSION or block_records != BLOCK_RECORDS:
+            raise ValueError(f"Unsupported index file: {path}")
+        index = cls()
+        index.records = records
+        offset = _INDEX_HEADER.size
+        for _ in range(blocks):
+            low, high = _BLOCK_ENTRY.unpack_from(data, offset)
+            index.block_min.append(low)
+            index.block_max.append(high)
+            offset += _BLOCK_ENTRY.size
+        entries = [_VEHICLE_ENTRY.unpack_from(data, offset + i * _VEHICLE_ENTRY.size) for i in range(vehicles)]
+        numbers = array('I', data[offset + vehicles * _VEHICLE_ENTRY.size:])
+        for key, first, count, unsorted in entries:
+            index.vehicles[key] = numbers[first:first + count]
+            if unsorted:
+                index.unsorted.add(key)
+        return index
+
+    @classmethod
+    def build(cls, view, records):
+        index = cls()
+        for number in range(records):
+            timestamp, key = struct.unpack_from('<qI', view, number * RECORD_SIZE)
+            index.add(key, timestamp)
+        return index
+
+
+class _Timestamps:
+    # Timestamps of the given records of a segment, as a sequence for
+    # bisect (its key argument needs Python 3.10)
+    __slots__ = ('view', 'numbers')
+
+    def __init__(self, view, numbers):
+        self.view = view
+        self.numbers = numbers
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def __getitem__(self, position):
+        return _timestamp(self.view, self.numbers[position])
+
+
+class Segment:
+    __slots__ = ('number', 'path', 'index', 'view')
+
+    def __init__(self, number, path, index, view=None):
+        self.number = number
+        self.path = path
+        self.index = index
+        self.view = view
+
+
+def _map(path, records):
+    if not records:
+        return None
+    with open(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), records * RECORD_SIZE, access=mmap.ACCESS_READ)
+
+
+class CamLog:
+    # Append-only log of decoded CAMs in rotating segment files of at most
+    # segment_records records (<number>.seg), each with its index
+    # (<number>.idx) written when the segment is closed and rebuilt from the
+    # segment if missing. At most max_segments segments are kept (None: no
+    # limit). Queries read memory-mapped segments and bisect the indexes.
+
+    def __init__(self, directory, segment_records=1000000, max_segments=None):
+        self.directory = directory
+        self.segment_records = segment_records
+        self.max_segments = max_segments
+        self._lock = threading.Lock()
+        self._segments = []
+        self._file = None
+        self._active = None
+        self.appended = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+        self._open(self._segments[-1].number + 1 if self._segments else 0)
+
+    def _path(self, number, suffix=SEGMENT_SUFFIX):
+        return os.path.join(self.directory, f"{number:08d}{suffix}")
+
+    def _load(self):
+        numbers = sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(self.directory)
+                         if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit())
+        for number in numbers:
+            path = self._path(number)
+            size = os.path.getsize(path)
+            if size % RECORD_SIZE:
+                # Partial record left by a crash
+                logging.error("Truncating partial record at the end of %s", path)
+                with open(path, 'r+b') as f:
+                    f.truncate(size - size % RECORD_SIZE)
+            records = size // RECORD_SIZE
+            if not records:
+                for empty in (path, self._path(number, INDEX_SUFFIX)):
+                    if os.path.exists(empty):
+                        os.remove(empty)
+                continue
+            view = _map(path, records)
+            index = None
+            index_path = self._path(number, INDEX_SUFFIX)
+            if os.path.exists(index_path):
+                try:
+                    index = SegmentIndex.load(index_path)
+                except (OSError, ValueError, struct.error) as e:
+                    logging.error("Cannot read index %s: %s", index_path, e)
+            if index is None or index.records != records:
+                logging.debug("Rebuilding index of %s", path)
+                index = SegmentIndex.build(view, records)
+                index.save(index_path)
+            self._segments.append(Segment(number, path, index, view))
+        self._apply_retention()
+
+    def _open(self, number):
+        path = self._path(number)
+        self._file = open(path, 'ab', buffering=0)
+        self._active = Segment(number, path, SegmentIndex())
+
+    def _rotate(self):
+        segment = self._active
+        self._file.close()
+        segment.index.save(self._path(segment.number, INDEX_SUFFIX))
+        segment.view = _map(segment.path, segment.index.records)
+        self._segments.append(segment)
+        self._apply_retention()
+        self._open(segment.number + 1)
+
+    def _apply_retention(self):
+        if self.max_segments is None:
+            return
+        while len(self._segments) > self.max_segments:
+            segment = self._segments.pop(0)
+            # Queries in progress keep their mapping of the deleted file
+            for path in (segment.path, self._path(segment.number, INDEX_SUFFIX)):
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    logging.error("Cannot remove %s: %s", path, e)
+
+    def append(self, records):
+        # records: (vehicle_id, timestamp, latitude, longitude, speed, heading)
+        # tuples; one write per segment touched
+        with self._lock:
+            chunk = []
+            count = 0
+            for record in records:
+                if self._active.index.records >= self.segment_records:
+                    self._file.write(b''.join(chunk))
+                    chunk = []
+                    self._rotate()
+                self._active.index.add(vehicle_key(record[0]), int(record[1]))
+                chunk.append(pack_record(*record))
+                count += 1
+            if chunk:
+                self._file.write(b''.join(chunk))
+            self.appended += count
+
+    def close(self):
+        with self._lock:
+            if self._file is not None and not self._file.closed:
+                self._file.close()
+                if self._active.index.records:
+                    self._active.index.save(self._path(self._active.number, INDEX_SUFFIX))
+
+    def _views(self):
+        # (index, view) of every non-empty segment, oldest first. The active
+        # segment is mapped up to its current size, with a frozen copy of
+        # its index: append() keeps changing the live one.
+        with self._lock:
+            views = [(segment.index, segment.view) for segment in self._segments if segment.view is not None]
+            active = self._active.index
+            if active.records and not self._file.closed:
+                active = active.frozen()
+                views.append((active, _map(self._active.path, active.records)))
+        return views
+
+    def track(self, vehicle_id, start=None, end=None, limit=None):
+        # Records of a vehicle with start <= timestamp <= end, oldest first
+        key = vehicle_key(vehicle_id)
+        start = -2 ** 63 if start is None else start
+        end = 2 ** 63 - 1 if end is None else end
+        result = []
+        for index, view in self._views():
+            numbers = index.numbers(key)
+            if not numbers or index.max_timestamp < start or index.min_timestamp > end:
+                continue
+            if key in index.unsorted:
+                numbers = [n for n in numbers if start <= _timestamp(view, n) <= end]
+            else:
+                timestamps = _Timestamps(view, numbers)
+                low = bisect_left(timestamps, start)
+                high = bisect_right(timestamps, end, low)
+                numbers = numbers[low:high]
+            result.extend(read_record(view, n) for n in numbers)
+            if limit is not None and len(result) >= limit:
+                return result[:limit]
+        return result
+
+    def snapshot(self, at, window=None):
+        # Latest record of every vehicle with a timestamp <= at (and >= at -
+        # window), sorted by vehicle
+        found = {}
+        oldest = -2 ** 63 if window is None else at - window
+        for index, view in self._views():
+            if index.min_timestamp > at or index.max_timestamp < oldest:
+                continue
+            for key in index.vehicles:
+                numbers = index.numbers(key)
+                if not numbers:
+                    continue
+                if key in index.unsorted:
+                    candidates = [n for n in numbers if _timestamp(view, n) <= at]
+                    if not candidates:
+                        continue
+                    number = max(candidates, key=lambda n: _timestamp(view, n))
+                else:
+                    position = bisect_right(_Timestamps(view, numbers), at)
+                    if not position:
+                        continue
+                    number = numbers[position - 1]
+                timestamp = _timestamp(view, number)
+                if timestamp >= oldest and (key not in found or timestamp >= found[key].timestamp):
+                    found[key] = read_record(view, number)
+        return [found[key] for key in sorted(found)]
+
+    def between(self, start=None, end=None, limit=None):
+        # Records of every vehicle with start <= timestamp <= end, in append order
+        start = -2 ** 63 if start is None else start
+        end = 2 ** 63 - 1 if end is None else end
+        result = []
+        for index, view in self._views():
+            if index.max_timestamp < start or index.min_timestamp > end:
+                continue
+            for block in index.blocks_between(start, end):
+                first = block * BLOCK_RECORDS
+                for number in range(first, min(first + BLOCK_RECORDS, index.records)):
+                    if start <= _timestamp(view, number) <= end:
+                        result.append(read_record(view, number))
+                        if limit is not None and len(result) >= limit:
+                            return result
+        return result
+
+    def stats(self):
+        with self._lock:
+            segments = self._segments + [self._active]
+            records = sum(segment.index.records for segment in segments)
+            return {
+                'directory': self.directory,
+                'segments': len(segments),
+                'records': records,
+                'bytes': records * RECORD_SIZE,
+                'appended': self.appended,
+                'segment_records': self.segment_records,
+                'max_segments': self.max_segments,
+            }
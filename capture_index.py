@@ -0,0 +1,171 @@
+import logging
+import math
+import mmap
+import os
+import struct
+import zlib
+
+import numpy as np
+
+from frame_classifier import KIND_CAM, KIND_NAMES, classify
+from pcap_reader import LINKTYPE_IEEE802_11, Frame, walk_records
+
+# Sidecar file written next to the capture (<capture>.idx), rebuilt when
+# the size or the modification time of the capture changes
+INDEX_SUFFIX = '.idx'
+_INDEX_MAGIC = b'V2VCIDX2'
+_INDEX_HEADER = struct.Struct('<8sqqq')   # magic, capture size, capture mtime (ns), frames
+
+# One entry per frame; timestamp is NaN for frames without one (pcapng SPB),
+# kind is a frame_classifier.KIND_* value
+INDEX_DTYPE = np.dtype([
+    ('offset', '<u8'),
+    ('timestamp', '<f8'),
+    ('length', '<u4'),
+    ('vehicle', '<u4'),
+    ('linktype', '<u2'),
+    ('kind', 'u1'),
+    ('flags', 'u1'),
+])
+FLAG_SECURED = 0x01
+FLAG_STATION = 0x02   # vehicle is the station id of the message
+
+
+def vehicle_key(frame, linktype, classification=None):
+    # ITS messages are keyed by station id, any other frame by its source
+    # MAC address, so every packet of a vehicle goes through the same worker.
+    if classification is None:
+        classification = classify(frame, linktype)
+    if classification.station is not None:
+        return classification.station
+    if linktype == LINKTYPE_IEEE802_11:
+        return zlib.crc32(frame[10:16])
+    return zlib.crc32(frame[6:12])
+
+
+class CaptureIndex:
+    # Frame table of one capture: byte offset, timestamp, length, link
+    # type, class and vehicle key of every frame, in file order.
+
+    def __init__(self, path, entries):
+        self.path = path
+        self.entries = entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def cam_count(self):
+        return int(np.count_nonzero(self.entries['kind'] == KIND_CAM))
+
+    def vehicles(self):
+        # Station ids found in the messages, sorted
+        entries = self.entries
+        return np.unique(entries['vehicle'][(entries['flags'] & FLAG_STATION) != 0]).tolist()
+
+    def kind_counts(self, positions=None):
+        # (frames, bytes) per class, of the given positions or of every frame
+        entries = self.entries if positions is None else self.entries[positions]
+        frames = np.bincount(entries['kind'], minlength=len(KIND_NAMES))
+        sizes = np.bincount(entries['kind'], weights=entries['length'], minlength=len(KIND_NAMES))
+        return frames.tolist(), sizes.astype(np.int64).tolist()
+
+    def duration(self):
+        timestamps = self.entries['timestamp']
+        timestamps = timestamps[~np.isnan(timestamps)]
+        return float(timestamps.max() - timestamps.min()) if len(timestamps) else 0.0
+
+    def position_at(self, seconds):
+        # First frame at least `seconds` after the first one of the capture
+        timestamps = self.entries['timestamp']
+        if not len(timestamps) or np.isnan(timestamps[0]):
+            return 0
+        later = np.flatnonzero(timestamps - timestamps[0] >= seconds)
+        return int(later[0]) if len(later) else len(timestamps)
+
+    def select(self, start=0, start_time=None, vehicles=None):
+        # Positions of the frames to send: from frame `start` (and from
+        # `start_time` seconds into the capture), of the given vehicles only
+        if start_time is not None:
+            start = max(start, self.position_at(start_time))
+        positions = np.arange(start, len(self.entries))
+        if vehicles is not None:
+            keys = self.entries['vehicle'][start:]
+            positions = positions[np.isin(keys, np.fromiter(vehicles, dtype='<u4'))]
+        return positions
+
+    def frames(self, positions):
+        # Yields (position, Frame) for the given positions, read through a
+        # memory map. As with pcap_reader.iter_frames, frame.data is only
+        # valid until the next frame is read.
+        if not len(positions):
+            return
+        with open(self.path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mm)
+        entries = self.entries
+        try:
+            for position in positions.tolist():
+                offset, timestamp, length, _, linktype, _, _ = entries[position].item()
+                data = view[offset:offset + length]
+                yield position, Frame(None if math.isnan(timestamp) else timestamp, linktype, data, offset)
+                data.release()
+        finally:
+            view.release()
+            try:
+                mm.close()
+            except BufferError:
+                pass
+
+
+def build_index(path):
+    rows = []
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for timestamp, linktype, offset, length in walk_records(mm):
+                    frame = mm[offset:offset + length]
+                    classification = classify(frame, linktype)
+                    flags = FLAG_SECURED if classification.secured else 0
+                    if classification.station is not None:
+                        flags |= FLAG_STATION
+                    rows.append((offset, float('nan') if timestamp is None else timestamp, length,
+                                 vehicle_key(frame, linktype, classification), linktype,
+                                 classification.kind, flags))
+    return np.array(rows, dtype=INDEX_DTYPE)
+
+
+def _read_sidecar(index_path, stat):
+    with open(index_path, 'rb') as f:
+        header = f.read(_INDEX_HEADER.size)
+        if len(header) < _INDEX_HEADER.size:
+            return None
+        magic, size, mtime, count = _INDEX_HEADER.unpack(header)
+        if magic != _INDEX_MAGIC or size != stat.st_size or mtime != stat.st_mtime_ns:
+            return None
+        entries = np.fromfile(f, dtype=INDEX_DTYPE, count=count)
+    return entries if len(entries) == count else None
+
+
+def load_index(path):
+    # Index of a capture, from its sidecar file when it is up to date,
+    # otherwise built (one pass over the record headers) and saved. A
+    # capture in a read-only directory is indexed in memory only.
+    stat = os.stat(path)
+    index_path = path + INDEX_SUFFIX
+    entries = None
+    if os.path.exists(index_path):
+        try:
+            entries = _read_sidecar(index_path, stat)
+        except (OSError, ValueError) as e:
+            logging.error("Cannot read capture index %s: %s", index_path, e)
+    if entries is None:
+        entries = build_index(path)
+        try:
+            with open(index_path + '.tmp', 'wb') as f:
+                f.write(_INDEX_HEADER.pack(_INDEX_MAGIC, stat.st_size, stat.st_mtime_ns, len(entries)))
+                entries.tofile(f)
+            os.replace(index_path + '.tmp', index_path)
+        except OSError as e:
+            logging.error("Cannot write capture index %s: %s", index_path, e)
+    return CaptureIndex(path, entries)
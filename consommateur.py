@@ -1,111 +1,175 @@
+import itertools
+import threading
+import time
 import tkinter as tk
+from collections import deque
 from tkinter import scrolledtext, messagebox, filedialog
 from tkinter import ttk
 import paho.mqtt.client as mqtt
-from scapy.all import Ether
-import folium
-from io import BytesIO
-from PIL import Image, ImageTk
+from PIL import ImageTk
+
+from cam_decoder import cam_layout, decode_fields
+from map_renderer import MapRenderer
+
+# La carte est redessinée au plus MAP_FPS fois par seconde depuis la boucle
+# Tk : fond de carte mis en cache pour la vue courante, véhicules et traces
+# dessinés par-dessus (voir map_renderer)
+MAP_WIDTH = 800
+MAP_HEIGHT = 600
+MAP_FPS = 10
+# Temps de rendu moyennés sur les RENDER_STATS_FRAMES dernières images
+RENDER_STATS_FRAMES = 50
+
+# Les messages reçus vont dans un tampon circulaire de MAX_MESSAGES messages
+# (source de l'enregistrement) ; le thread Tk affiche ceux qui sont arrivés
+# toutes les FLUSH_INTERVAL_MS millisecondes, en gardant les VIEW_MESSAGES
+# derniers dans chaque vue. Le détail Scapy d'un paquet n'est calculé que
+# lorsqu'on clique sur sa ligne.
+MAX_MESSAGES = 10000
+VIEW_MESSAGES = 1000
+FLUSH_INTERVAL_MS = 100
 
 client = None  # Global MQTT client
-map_widget = None
-vehicle_markers = {}
-vehicle_paths = {}  # Global dictionary to store each vehicle's movement path
-
-def decode_vehicle_info(packet):
-    raw = packet.original
-    # Vérifier qu'on a suffisamment d'octets
-    if len(raw) < 68:
-        return "Insufficient data for vehicle info", None, None, None
-
-    # Identifiant véhicule à partir de raw[26:46]
-    source_pos = raw[26:46]
-    vehicle_id = source_pos[:8].hex()
-
-    # Utilisation des offsets demandés
-    # Timestamp : bytes 52 à 55 (slice raw[52:55])
-    timestamp = int.from_bytes(raw[52:56], byteorder='big')
-    # Latitude : bytes 56 à 59 (slice raw[56:59])
-    latitude_int = int.from_bytes(raw[56:60], byteorder='big', signed=True)
-    # Longitude : bytes 60 à 63 (slice raw[60:63])
-    longitude_int = int.from_bytes(raw[60:64], byteorder='big', signed=True)
-    # Vitesse : bytes 64 à 65 (slice raw[64:65]) - division par 100 pour obtenir m/s
-    speed_int = int.from_bytes(raw[64:66], byteorder='big')
-    # Heading : bytes 66 à 67 (slice raw[66:67])
-    heading_int = int.from_bytes(raw[66:68], byteorder='big')
-
-    latitude = latitude_int / 1e7
-    longitude = longitude_int / 1e7
-    speed = speed_int / 100.0
-    # Ici heading est divisé par 10 pour obtenir les degrés (ajuster selon la spécification réelle)
-    heading = heading_int / 10
+messages = deque(maxlen=MAX_MESSAGES)   # (n°, payload, infos décodées)
+pending = deque(maxlen=VIEW_MESSAGES)   # messages pas encore affichés
+message_seq = itertools.count(1)
+raw_seqs = deque()                      # n° du message de chaque ligne de raw_text
+raw_sizes = deque()                     # lignes de chaque message affiché, par vue
+info_sizes = deque()
+renderer = None
+map_fitted = False
+render_times = deque(maxlen=RENDER_STATS_FRAMES)
+save_results = deque()                  # fins d'enregistrement à afficher
+
+def decode_vehicle_info(raw):
+    # Position des champs selon les en-têtes de la trame (802.11 ou
+    # Ethernet, enveloppe de sécurité, type d'en-tête GeoNetworking), voir
+    # cam_decoder.cam_layout ; None pour ce qui n'est pas un CAM
+    layout = cam_layout(raw)
+    if layout is None:
+        return "Not a CAM (no vehicle info)", None, None, None
+
+    # Identifiant véhicule : adresse GeoNetworking de l'émetteur (8 octets
+    # en tête du vecteur de position)
+    vehicle_id = raw[layout.position:layout.position + 8].hex()
+
+    # Timestamp, latitude, longitude (1e-7 degré), vitesse (cm/s), cap
+    # (0,1 degré) et identifiant de station, lus aux offsets du layout
+    record = decode_fields(raw, layout)
 
     info = (f"Vehicle GN_ADDR: {vehicle_id}\n"
-            f"Timestamp: {timestamp} ms\n"
-            f"Latitude: {latitude}\n"
-            f"Longitude: {longitude}\n"
-            f"Speed: {speed} m/s\n"
-            f"Heading: {heading} degrees")
-    return info, vehicle_id, latitude, longitude
+            f"Station ID: {record.vehicle_id}\n"
+            f"Timestamp: {record.timestamp} ms\n"
+            f"Latitude: {record.latitude}\n"
+            f"Longitude: {record.longitude}\n"
+            f"Speed: {record.speed} m/s\n"
+            f"Heading: {record.heading} degrees")
+    return info, vehicle_id, record.latitude, record.longitude
 
 def on_message(client, userdata, message):
-    packet = Ether(message.payload)
-    raw_details = packet.show(dump=True)
-    info, vehicle_id, latitude, longitude = decode_vehicle_info(packet)
-    raw_text.insert(tk.END, raw_details + "\n\n")
-    raw_text.see(tk.END)
-    info_text.insert(tk.END, info + "\n\n")
-    info_text.see(tk.END)
-    update_map(vehicle_id, latitude, longitude)
-
-def update_map(vehicle_id, latitude, longitude):
-    global vehicle_markers, vehicle_paths, map_widget, map_label
-
-    # Met à jour le chemin du véhicule
-    if vehicle_id in vehicle_paths:
-        vehicle_paths[vehicle_id].append([latitude, longitude])
+    # Thread MQTT : aucun widget n'est touché ici, voir flush_messages et render_map
+    payload = message.payload
+    info, vehicle_id, latitude, longitude = decode_vehicle_info(payload)
+    entry = (next(message_seq), payload, info)
+    messages.append(entry)
+    pending.append(entry)
+    if latitude is not None:
+        renderer.add(vehicle_id, latitude, longitude)
+
+def packet_summary(entry):
+    seq, payload, info = entry
+    return f"#{seq}  {len(payload)} octets  {payload[:16].hex(' ')}...\n"
+
+def append_view(widget, texts, sizes):
+    # Ajoute les textes en un seul insert, supprime les plus anciens au-delà
+    # de VIEW_MESSAGES ; renvoie le nombre de messages supprimés
+    follow = widget.yview()[1] >= 1.0
+    widget.insert(tk.END, ''.join(texts))
+    sizes.extend(text.count('\n') for text in texts)
+    excess = len(sizes) - VIEW_MESSAGES
+    if excess > 0:
+        lines = sum(sizes.popleft() for _ in range(excess))
+        widget.delete("1.0", f"{lines + 1}.0")
+    # On ne fait défiler que si l'utilisateur était déjà en bas
+    if follow:
+        widget.see(tk.END)
+    return max(excess, 0)
+
+def flush_messages():
+    batch = []
+    while pending:
+        try:
+            batch.append(pending.popleft())
+        except IndexError:
+            break
+    if batch:
+        raw_seqs.extend(entry[0] for entry in batch)
+        for _ in range(append_view(raw_text, [packet_summary(entry) for entry in batch], raw_sizes)):
+            raw_seqs.popleft()
+        append_view(info_text, [entry[2] + "\n\n" for entry in batch], info_sizes)
+    while save_results:
+        status_label.config(text=save_results.popleft())
+        save_button.config(state=tk.NORMAL)
+    root.after(FLUSH_INTERVAL_MS, flush_messages)
+
+def find_message(seq):
+    # Les n° se suivent dans le tampon ; None si le message en est sorti
+    try:
+        entry = messages[seq - messages[0][0]]
+    except IndexError:
+        return None
+    return entry if entry[0] == seq else None
+
+def packet_dump(payload):
+    # Scapy (plusieurs secondes et des dizaines de Mo à l'import) n'est
+    # chargé qu'au premier détail de paquet demandé : clic sur une ligne ou
+    # enregistrement des messages
+    from scapy.all import Ether
+    return Ether(payload).show(dump=True)
+
+def show_packet(event):
+    line = int(raw_text.index(f"@{event.x},{event.y}").split('.')[0])
+    if not 1 <= line <= len(raw_seqs):
+        return
+    seq = raw_seqs[line - 1]
+    entry = find_message(seq)
+    packet_text.delete("1.0", tk.END)
+    if entry is None:
+        packet_text.insert(tk.END, f"Paquet #{seq} plus disponible")
+        return
+    packet_text.insert(tk.END, f"Paquet #{seq}\n" + packet_dump(entry[1]))
+
+def change_view(action):
+    # Nouvelle vue : les traces sont reprojetées tout de suite, le fond de
+    # carte est reconstruit hors de la boucle Tk
+    if action == 'fit':
+        if renderer.fit() is None:
+            return
     else:
-        vehicle_paths[vehicle_id] = [[latitude, longitude]]
-
-    # Supprime l'ancien marker si présent
-    if vehicle_id in vehicle_markers:
-        marker = vehicle_markers[vehicle_id]
-        if marker.get_name() in map_widget._children:
-            map_widget._children.pop(marker.get_name())
-
-    # Place un nouveau marker à la dernière position reçue
-    marker = folium.Marker(
-        location=[latitude, longitude],
-        popup=f"Vehicle ID: {vehicle_id}",
-        icon=folium.Icon(color='red', icon='info-sign')
-    )
-    vehicle_markers[vehicle_id] = marker
-    marker.add_to(map_widget)
-
-    # Supprime la polyline précédente pour ce véhicule si elle existe, pour une mise à jour propre
-    polyline_name = f"polyline_{vehicle_id}"
-    if polyline_name in map_widget._children:
-        map_widget._children.pop(polyline_name)
-        
-    # Dessine la trajectoire du véhicule avec une polyline
-    folium.PolyLine(
-        vehicle_paths[vehicle_id],
-        color="blue",
-        weight=2.5,
-        opacity=1,
-        name=polyline_name
-    ).add_to(map_widget)
-
-    # Régénère l'image de la carte et met à jour le label Tkinter
-    map_data = map_widget._to_png(5)
-    map_image = BytesIO(map_data)
-    pic = Image.open(map_image)
-    map_photo = ImageTk.PhotoImage(pic)
-    map_label.config(image=map_photo)
-    map_label.image = map_photo
-
-    # Rafraîchir l'interface utilisateur
-    root.update_idletasks()
+        renderer.zoom_by(action)
+    threading.Thread(target=renderer.build_base, daemon=True).start()
+
+def render_map():
+    global map_fitted
+    start = time.perf_counter()
+    if not map_fitted and renderer.vehicles:
+        # Première position reçue : vue centrée sur les véhicules
+        map_fitted = True
+        change_view('fit')
+    image = renderer.render()
+    if image is not None:
+        photo = ImageTk.PhotoImage(image)
+        map_label.config(image=photo)
+        map_label.image = photo
+        elapsed = time.perf_counter() - start
+        render_times.append(elapsed)
+        render_label.config(text=f"Rendu : {elapsed * 1000:.1f} ms "
+                                 f"(moyenne {sum(render_times) / len(render_times) * 1000:.1f} ms, "
+                                 f"max {max(render_times) * 1000:.1f} ms sur {len(render_times)} images) - "
+                                 f"{renderer.vehicles} véhicule(s), zoom {renderer.zoom}")
+    # Cadence fixe, quel que soit le nombre de messages reçus
+    delay = 1.0 / MAP_FPS - (time.perf_counter() - start)
+    root.after(max(1, int(delay * 1000)), render_map)
 
 def start_mqtt():
     global client
@@ -140,15 +204,32 @@ def stop_mqtt():
     except Exception:
         pass
 
+def write_messages(file_path, snapshot):
+    # Thread d'enregistrement : le détail Scapy de milliers de paquets prend
+    # plusieurs secondes, la boucle Tk n'attend pas ; le résultat est affiché
+    # par flush_messages
+    try:
+        with open(file_path, 'w') as file:
+            file.write("=== Raw Packets ===\n")
+            for seq, payload, info in snapshot:
+                file.write(packet_dump(payload) + "\n\n")
+            file.write("\n=== Vehicle Information ===\n")
+            for seq, payload, info in snapshot:
+                file.write(info + "\n\n")
+        save_results.append(f"{len(snapshot)} messages enregistrés")
+    except Exception as e:
+        save_results.append(f"Échec de l'enregistrement : {e}")
+
 def save_messages():
     file_path = filedialog.asksaveasfilename(defaultextension=".txt",
                                              filetypes=[("Fichiers textes", "*.txt"), ("Tous les fichiers", "*.*")])
     if file_path:
-        with open(file_path, 'w') as file:
-            file.write("=== Raw Packets ===\n")
-            file.write(raw_text.get("1.0", tk.END))
-            file.write("\n=== Vehicle Information ===\n")
-            file.write(info_text.get("1.0", tk.END))
+        # Copie du tampon (les MAX_MESSAGES derniers messages), écrite hors
+        # de la boucle Tk
+        snapshot = list(messages)
+        save_button.config(state=tk.DISABLED)
+        status_label.config(text=f"Enregistrement de {len(snapshot)} messages...")
+        threading.Thread(target=write_messages, args=(file_path, snapshot), daemon=True).start()
 
 root = tk.Tk()
 root.title("MQTT Consumer Avancé")
@@ -189,9 +270,13 @@ status_label.pack(pady=5)
 notebook = ttk.Notebook(root)
 notebook.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
 
-raw_frame = tk.Frame(notebook)
-raw_text = scrolledtext.ScrolledText(raw_frame, wrap=tk.WORD, width=100, height=30)
-raw_text.pack(fill=tk.BOTH, expand=True)
+raw_frame = tk.PanedWindow(notebook, orient=tk.VERTICAL)
+raw_text = scrolledtext.ScrolledText(raw_frame, wrap=tk.NONE, width=100, height=15)
+raw_text.bind("<ButtonRelease-1>", show_packet)
+raw_frame.add(raw_text)
+packet_text = scrolledtext.ScrolledText(raw_frame, wrap=tk.WORD, width=100, height=15)
+packet_text.insert(tk.END, "Cliquer sur un paquet pour afficher son détail")
+raw_frame.add(packet_text)
 notebook.add(raw_frame, text="Raw Packets")
 
 info_frame = tk.Frame(notebook)
@@ -200,12 +285,20 @@ info_text.pack(fill=tk.BOTH, expand=True)
 notebook.add(info_frame, text="Vehicle Info")
 
 map_frame = tk.Frame(notebook)
+map_controls = tk.Frame(map_frame)
+map_controls.pack(fill=tk.X)
+tk.Button(map_controls, text="Zoom +", command=lambda: change_view(1)).pack(side=tk.LEFT, padx=2)
+tk.Button(map_controls, text="Zoom -", command=lambda: change_view(-1)).pack(side=tk.LEFT, padx=2)
+tk.Button(map_controls, text="Recentrer", command=lambda: change_view('fit')).pack(side=tk.LEFT, padx=2)
+render_label = tk.Label(map_controls, text="Rendu : -")
+render_label.pack(side=tk.LEFT, padx=10)
 map_label = tk.Label(map_frame)
 map_label.pack(fill=tk.BOTH, expand=True)
 notebook.add(map_frame, text="Map")
 
-# Initialisation de la carte folium centrée sur une position par défaut
-map_widget = folium.Map(location=[48.8566, 2.3522], zoom_start=12)
+# Carte centrée sur une position par défaut jusqu'à la première position reçue
+renderer = MapRenderer(MAP_WIDTH, MAP_HEIGHT, 48.8566, 2.3522, 12)
+threading.Thread(target=renderer.build_base, daemon=True).start()
 
 log_frame = tk.Frame(root)
 log_frame.pack(padx=10, pady=5, fill=tk.BOTH, expand=True)
@@ -213,4 +306,6 @@ tk.Label(log_frame, text="Log:").pack(anchor=tk.W)
 log_area = scrolledtext.ScrolledText(log_frame, wrap=tk.WORD, width=80, height=10)
 log_area.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
 
+flush_messages()
+render_map()
 root.mainloop()
\ No newline at end of file
@@ -0,0 +1,310 @@
+import argparse
+import heapq
+import logging
+import os
+import secrets
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing.connection import Client, Listener, wait
+
+import paho.mqtt.client as mqtt
+
+from cam_batch import decode_payloads
+from cam_decoder import cam_layout, format_record, is_text_payload
+from ingest_queue import POLICIES, POLICY_DROP_OLDEST, IngestQueue
+
+# Decoder processes of the multi-process consumer: every process has its own
+# MQTT client in the shared subscription $share/<group>/<topic> (the broker
+# hands each message to one member of the group), decodes what it receives
+# and sends the records to the consumer process over a local connection.
+CLIENT_ID = "ConsumerFlask"
+AUTHKEY_ENV = 'V2V_DECODER_AUTHKEY'
+# Interval of the queue stats sent by the decoder processes
+STATS_INTERVAL = 1.0
+# How often the consumer releases the records that waited long enough
+MERGE_TICK = 0.01
+# How long stop() waits for a decoder process before killing it
+STOP_TIMEOUT = 2.0
+
+
+def shared_topic(group, topic):
+    return f"$share/{group}/{topic}"
+
+
+class ReorderBuffer:
+    # The records of a vehicle may be decoded by any process, so they can
+    # arrive out of order. Each record is held `window` seconds, then the
+    # records of a vehicle are released oldest first (vehicle timestamp);
+    # a record older than one already released for its vehicle is dropped.
+
+    def __init__(self, window):
+        self.window = window
+        self._pending = {}   # vehicle -> heap of (timestamp, seq, arrival, item)
+        self._newest = {}    # vehicle -> newest timestamp received
+        self._released = {}  # vehicle -> timestamp of the last released record
+        self._seq = 0
+        self._ready = []     # records without timestamp, released on the next call
+        self.released = 0
+        self.reordered = 0
+        self.late = 0
+
+    def push(self, items, now):
+        # items: (record, payload, texts), record being a CamRecord tuple
+        for item in items:
+            vehicle, timestamp = item[0][0], item[0][1]
+            if timestamp is None:
+                self._ready.append(item)
+                continue
+            released = self._released.get(vehicle)
+            if released is not None and timestamp < released:
+                self.late += 1
+                continue
+            newest = self._newest.get(vehicle)
+            if newest is not None and timestamp < newest:
+                self.reordered += 1
+            else:
+                self._newest[vehicle] = timestamp
+            self._seq += 1
+            heapq.heappush(self._pending.setdefault(vehicle, []), (timestamp, self._seq, now, item))
+
+    def pop_ready(self, now):
+        items, self._ready = self._ready, []
+        deadline = now - self.window
+        for vehicle in list(self._pending):
+            heap = self._pending[vehicle]
+            # The oldest record of a vehicle holds back the newer ones
+            # until it has waited the whole window itself
+            while heap and heap[0][2] <= deadline:
+                timestamp, _, _, item = heapq.heappop(heap)
+                self._released[vehicle] = timestamp
+                items.append(item)
+            if not heap:
+                del self._pending[vehicle]
+        self.released += len(items)
+        return items
+
+    def stats(self):
+        return {
+            'window': self.window,
+            'held': sum(len(heap) for heap in self._pending.values()),
+            'released': self.released,
+            'reordered': self.reordered,
+            'late_dropped': self.late,
+        }
+
+
+class DecoderPool:
+    # Runs `processes` decoder processes and merges their records: on_records
+    # (records, payloads, texts) is called from one merge thread, the records
+    # of each vehicle in timestamp order (see ReorderBuffer).
+
+    def __init__(self, processes, broker, port, topic, group, on_records, batch_size=32, batch_max_wait=0.05,
+                 queue_size=10000, policy=POLICY_DROP_OLDEST, reorder_window=0.1):
+        self.processes = processes
+        self.broker = broker
+        self.port = port
+        self.topic = topic
+        self.group = group
+        self.on_records = on_records
+        self.batch_size = batch_size
+        self.batch_max_wait = batch_max_wait
+        self.queue_size = queue_size
+        self.policy = policy
+        self.reorder = ReorderBuffer(reorder_window)
+        self._listener = None
+        self._children = []
+        self._connections = []
+        self._lock = threading.Lock()
+        self._stopping = False
+        self.ready = set()
+        self.received = [0] * processes
+        self.worker_stats = [None] * processes
+
+    def start(self):
+        authkey = secrets.token_bytes(16)
+        self._listener = Listener(authkey=authkey)
+        env = dict(os.environ, **{AUTHKEY_ENV: authkey.hex()})
+        script = os.path.abspath(__file__)
+        for index in range(self.processes):
+            self._children.append(subprocess.Popen([
+                sys.executable, script, '--index', str(index), '--address', str(self._listener.address),
+                '--broker', self.broker, '--port', str(self.port), '--topic', self.topic, '--group', self.group,
+                '--batch-size', str(self.batch_size), '--batch-max-wait', str(self.batch_max_wait),
+                '--queue-size', str(self.queue_size), '--policy', self.policy,
+            ], env=env))
+        threading.Thread(target=self._accept, name="decoder-accept", daemon=True).start()
+        threading.Thread(target=self._merge, name="decoder-merge", daemon=True).start()
+
+    def _accept(self):
+        for _ in range(self.processes):
+            try:
+                connection = self._listener.accept()
+            except OSError:
+                return
+            with self._lock:
+                self._connections.append(connection)
+
+    def _merge(self):
+        while not self._stopping:
+            with self._lock:
+                connections = list(self._connections)
+            if not connections:
+                time.sleep(MERGE_TICK)
+                continue
+            for connection in wait(connections, timeout=MERGE_TICK):
+                try:
+                    message = connection.recv()
+                except (EOFError, OSError):
+                    if not self._stopping:
+                        logging.error("A decoder process disconnected")
+                    with self._lock:
+                        if connection in self._connections:
+                            self._connections.remove(connection)
+                    continue
+                self._handle(message)
+            self._release()
+
+    def _handle(self, message):
+        kind, index = message[0], message[1]
+        if kind == 'records':
+            _, _, records, payloads, texts = message
+            self.received[index] += len(records)
+            self.reorder.push(zip(records, payloads, texts), time.monotonic())
+        elif kind == 'stats':
+            self.worker_stats[index] = message[2]
+        elif kind == 'ready':
+            self.ready.add(index)
+        elif kind == 'log':
+            logging.error("Decoder %s: %s", index, message[2])
+
+    def _release(self):
+        items = self.reorder.pop_ready(time.monotonic())
+        if not items:
+            return
+        records, payloads, texts = (list(column) for column in zip(*items))
+        try:
+            self.on_records(records, payloads, texts)
+        except Exception as e:
+            logging.error("Error processing decoded records: %s", e)
+
+    def stop(self):
+        self._stopping = True
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            try:
+                connection.send(('stop',))
+                connection.close()
+            except OSError:
+                pass
+        if self._listener is not None:
+            self._listener.close()
+        for child in self._children:
+            try:
+                child.wait(STOP_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                child.kill()
+                child.wait()
+
+    def stats(self):
+        return {
+            'processes': self.processes,
+            'subscription': shared_topic(self.group, self.topic),
+            'connected': len(self._connections),
+            'subscribed': len(self.ready),
+            'received': list(self.received),
+            'queues': list(self.worker_stats),
+            'reorder': self.reorder.stats(),
+        }
+
+
+def run_decoder(index, address, authkey, broker, port, topic, group, batch_size, batch_max_wait, queue_size, policy):
+    connection = Client(address, authkey=authkey)
+    send_lock = threading.Lock()
+
+    def send(message):
+        try:
+            with send_lock:
+                connection.send(message)
+        except (EOFError, OSError):
+            # The consumer went away
+            os._exit(0)
+
+    ingest = IngestQueue(queue_size, policy)
+    # Payloads that are not CAMs, and CAMs that could not be decoded
+    counts = {'ignored': 0, 'failed': 0}
+    client = mqtt.Client(client_id=f"{CLIENT_ID}-{index}")
+
+    def on_connect(client, userdata, flags, rc):
+        client.subscribe(shared_topic(group, topic))
+
+    def on_subscribe(client, userdata, mid, granted_qos):
+        send(('ready', index))
+
+    def on_message(client, userdata, message):
+        # Same filter as the single-process consumer (app.on_message)
+        payload = message.payload
+        if is_text_payload(payload) or cam_layout(payload) is not None:
+            ingest.put(payload)
+        else:
+            counts['ignored'] += 1
+
+    client.on_connect = on_connect
+    client.on_subscribe = on_subscribe
+    client.on_message = on_message
+    try:
+        client.connect(broker, port, 60)
+    except Exception as e:
+        send(('log', index, f"MQTT connection failed: {e}"))
+        return
+    client.loop_start()
+
+    def control():
+        # 'stop' or the end of the connection
+        try:
+            connection.recv()
+        except (EOFError, OSError):
+            pass
+        client.disconnect()
+        os._exit(0)
+
+    def report():
+        while True:
+            time.sleep(STATS_INTERVAL)
+            send(('stats', index, dict(ingest.stats(), **counts)))
+
+    threading.Thread(target=control, daemon=True).start()
+    threading.Thread(target=report, daemon=True).start()
+    while True:
+        payloads = ingest.get_batch(batch_size, batch_max_wait)
+        received = len(payloads)
+        records, payloads = decode_payloads(payloads)
+        counts['failed'] += received - len(payloads)
+        # The texts of the message panes are made here too, off the consumer process
+        texts = [(payload.decode('utf-8', errors='replace'), format_record(record))
+                 for record, payload in zip(records, payloads)]
+        send(('records', index, [tuple(record) for record in records], payloads, texts))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Decoder process of the multi-process consumer")
+    parser.add_argument('--index', type=int, required=True)
+    parser.add_argument('--address', required=True)
+    parser.add_argument('--broker', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1883)
+    parser.add_argument('--topic', default='v2v')
+    parser.add_argument('--group', default='v2v-consumers')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--batch-max-wait', type=float, default=0.05)
+    parser.add_argument('--queue-size', type=int, default=10000)
+    parser.add_argument('--policy', choices=POLICIES, default=POLICY_DROP_OLDEST)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s in %(module)s: %(message)s')
+    run_decoder(args.index, args.address, bytes.fromhex(os.environ[AUTHKEY_ENV]), args.broker, args.port,
+                args.topic, args.group, args.batch_size, args.batch_max_wait, args.queue_size, args.policy)
+
+
+if __name__ == '__main__':
+    main()
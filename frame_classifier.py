@@ -0,0 +1,197 @@
+import struct
+from collections import namedtuple
+
+from pcap_reader import LINKTYPE_ETHERNET, LINKTYPE_IEEE802_11
+
+ETHERTYPE_GEONETWORKING = 0x8947
+_ETHERTYPE_VLAN = 0x8100
+
+# Frame classes, in the order of the index column (capture_index) and of
+# the per-class counters of the producer
+KIND_OTHER = 0     # not GeoNetworking (ARP, IP...)
+KIND_GN = 1        # GeoNetworking without a BTP payload (location service...)
+KIND_BEACON = 2
+KIND_BTP = 3       # BTP on a port without its own class
+KIND_CAM = 4
+KIND_DENM = 5
+KIND_MAPEM = 6
+KIND_SPATEM = 7
+KIND_IVIM = 8
+KIND_SREM = 9
+KIND_SSEM = 10
+KIND_CPM = 11
+KIND_VAM = 12
+KIND_NAMES = ('other', 'gn', 'beacon', 'btp', 'cam', 'denm', 'mapem', 'spatem', 'ivim', 'srem', 'ssem', 'cpm', 'vam')
+# Pseudo class name matching every secured frame (see parse_classes)
+SECURED = 'secured'
+
+# Well-known BTP destination ports (ETSI TS 103 248)
+BTP_PORTS = {
+    2001: KIND_CAM,
+    2002: KIND_DENM,
+    2003: KIND_MAPEM,
+    2004: KIND_SPATEM,
+    2006: KIND_IVIM,
+    2007: KIND_SREM,
+    2008: KIND_SSEM,
+    2009: KIND_CPM,
+    2018: KIND_VAM,
+}
+
+# GeoNetworking common header: next header -> BTP-A/BTP-B, header type ->
+# size of the extended header that follows (TSB depends on the subtype)
+_GN_NEXT_BTP = (1, 2)
+_GN_HEADER_TYPE_BEACON = 1
+_GN_HEADER_TYPE_TSB = 5
+_GN_HEADER_TYPE_LS = 6
+_GN_EXTENDED_SIZES = {1: 24, 2: 48, 3: 44, 4: 44}
+_GN_TSB_SIZES = {0: 28, 1: 28}
+_GN_LS_SIZES = {0: 36, 1: 48}
+_GN_BASIC_SIZE = 4
+_GN_COMMON_SIZE = 8
+_BTP_SIZE = 4
+# Basic header next header values
+_GN_BASIC_COMMON = 1
+_GN_BASIC_SECURED = 2
+
+# IEEE 1609.2 / ETSI TS 103 097 envelope: Ieee1609Dot2Data content choices
+_SEC_PROTOCOL_VERSION = 3
+_SEC_UNSECURED = 0x80
+_SEC_SIGNED = 0x81
+
+_PORT = struct.Struct('>H')
+_STATION = struct.Struct('>I')
+
+# station: id from the ITS PDU header of the message, None without one
+Classification = namedtuple('Classification', ['kind', 'secured', 'station'])
+
+_NOT_GEONETWORKING = Classification(KIND_OTHER, False, None)
+
+# Headers of a GeoNetworking packet: header type and subtype of the common
+# header, offsets of the extended header and of the BTP header (None when
+# the packet does not carry BTP)
+GnHeaders = namedtuple('GnHeaders', ['header_type', 'subtype', 'extended', 'btp'])
+
+
+def geonetworking_offset(frame, linktype):
+    # Start of the GeoNetworking basic header, None for other protocols
+    if linktype == LINKTYPE_IEEE802_11:
+        if len(frame) < 24 or frame[0] & 0x0c != 0x08:
+            return None
+        offset = 24
+        if frame[0] & 0x80:
+            offset += 2                 # QoS control
+        if frame[1] & 0x03 == 0x03:
+            offset += 6                 # fourth address (WDS)
+        # LLC/SNAP then the ethertype
+        if frame[offset:offset + 6] != b'\xaa\xaa\x03\x00\x00\x00':
+            return None
+        offset += 6
+    elif linktype == LINKTYPE_ETHERNET:
+        offset = 12
+        if frame[offset:offset + 2] == _ETHERTYPE_VLAN.to_bytes(2, 'big'):
+            offset += 4
+    else:
+        return None
+    if frame[offset:offset + 2] != ETHERTYPE_GEONETWORKING.to_bytes(2, 'big'):
+        return None
+    return offset + 2
+
+
+def _read_length(frame, offset):
+    # OER length determinant: (length, offset of the content)
+    first = frame[offset]
+    if first < 0x80:
+        return first, offset + 1
+    size = first & 0x7f
+    return int.from_bytes(frame[offset + 1:offset + 1 + size], 'big'), offset + 1 + size
+
+
+def _secured_payload(frame, offset):
+    # Offset of the GeoNetworking common header carried in an
+    # Ieee1609Dot2Data, None when the payload is not in clear (encrypted,
+    # external hash) or the envelope is not understood
+    while offset + 2 <= len(frame) and frame[offset] == _SEC_PROTOCOL_VERSION:
+        content = frame[offset + 1]
+        if content == _SEC_UNSECURED:
+            _, offset = _read_length(frame, offset + 2)
+            return offset
+        if content != _SEC_SIGNED:
+            return None
+        # hashId, then the SignedDataPayload preamble: data present?
+        if offset + 4 > len(frame) or not frame[offset + 3] & 0x40:
+            return None
+        offset += 4
+    return None
+
+
+def geonetworking_headers(frame, offset):
+    # Walks the basic, common (through the security envelope) and extended
+    # headers from the basic header at offset. None when the common header
+    # is missing (other basic next header, payload not in clear, frame cut).
+    basic_next = frame[offset] & 0x0f
+    offset += _GN_BASIC_SIZE
+    if basic_next == _GN_BASIC_SECURED:
+        offset = _secured_payload(frame, offset)
+        if offset is None:
+            return None
+    elif basic_next != _GN_BASIC_COMMON:
+        return None
+    if len(frame) < offset + _GN_COMMON_SIZE:
+        return None
+    common_next = frame[offset] >> 4
+    header_type, subtype = frame[offset + 1] >> 4, frame[offset + 1] & 0x0f
+    if header_type == _GN_HEADER_TYPE_TSB:
+        extended = _GN_TSB_SIZES.get(subtype)
+    elif header_type == _GN_HEADER_TYPE_LS:
+        extended = _GN_LS_SIZES.get(subtype)
+    else:
+        extended = _GN_EXTENDED_SIZES.get(header_type)
+    offset += _GN_COMMON_SIZE
+    btp = None
+    if extended is not None and common_next in _GN_NEXT_BTP:
+        btp = offset + extended
+    return GnHeaders(header_type, subtype, offset, btp)
+
+
+def classify(frame, linktype):
+    offset = geonetworking_offset(frame, linktype)
+    if offset is None or len(frame) < offset + _GN_BASIC_SIZE:
+        return _NOT_GEONETWORKING
+    secured = frame[offset] & 0x0f == _GN_BASIC_SECURED
+    headers = geonetworking_headers(frame, offset)
+    if headers is None:
+        return Classification(KIND_GN, secured, None)
+    if headers.header_type == _GN_HEADER_TYPE_BEACON:
+        return Classification(KIND_BEACON, secured, None)
+    offset = headers.btp
+    if offset is None or len(frame) < offset + _BTP_SIZE:
+        return Classification(KIND_GN, secured, None)
+    kind = BTP_PORTS.get(_PORT.unpack_from(frame, offset)[0], KIND_BTP)
+    # ITS PDU header: protocol version, message id, station id
+    offset += _BTP_SIZE
+    station = None
+    if kind != KIND_BTP and len(frame) >= offset + 6:
+        station = _STATION.unpack_from(frame, offset + 2)[0]
+    return Classification(kind, secured, station)
+
+
+def parse_classes(names):
+    # Comma-separated class names ('cpm,beacon'), 'secured' standing for
+    # every secured frame -> frozenset of names
+    classes = set()
+    for name in names.split(','):
+        name = name.strip().lower()
+        if not name:
+            continue
+        if name not in KIND_NAMES and name != SECURED:
+            raise ValueError(f"Unknown frame class '{name}' (expected {', '.join(KIND_NAMES + (SECURED,))})")
+        classes.add(name)
+    return frozenset(classes)
+
+
+def class_topic(base, kind, secured):
+    # <base>/<class>, <base>/secured/<class> for secured frames
+    if secured:
+        return f"{base}/secured/{KIND_NAMES[kind]}"
+    return f"{base}/{KIND_NAMES[kind]}"
@@ -0,0 +1,95 @@
+import threading
+import time
+from collections import deque
+
+# What put() does when the queue is full
+POLICY_DROP_OLDEST = 'drop-oldest'
+POLICY_DROP_NEWEST = 'drop-newest'
+POLICY_BLOCK = 'block'
+POLICIES = (POLICY_DROP_OLDEST, POLICY_DROP_NEWEST, POLICY_BLOCK)
+
+
+class IngestQueue:
+    # Bounded queue between the MQTT network thread (put) and the
+    # processing workers (get_batch), with depth, drop and lag counters.
+
+    def __init__(self, maxsize=10000, policy=POLICY_DROP_OLDEST):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown overflow policy: {policy}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self._items = deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self.enqueued = 0
+        self.dropped = 0
+        self.dequeued = 0
+        self.lag_sum = 0.0
+        self.lag_max = 0.0
+        self.lag_last = 0.0
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, item):
+        # Returns False when the item (or an older one) had to be dropped
+        with self._lock:
+            accepted = True
+            if len(self._items) >= self.maxsize:
+                if self.policy == POLICY_DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+                if self.policy == POLICY_DROP_OLDEST:
+                    self._items.popleft()
+                    self.dropped += 1
+                    accepted = False
+                else:
+                    while len(self._items) >= self.maxsize:
+                        self._not_full.wait()
+            self._items.append((time.monotonic(), item))
+            self.enqueued += 1
+            self._not_empty.notify()
+            return accepted
+
+    def get_batch(self, max_items, max_wait):
+        # Waits for at least one item, then up to max_wait seconds (counted
+        # from the arrival of the oldest one) for max_items items. Another
+        # worker may take the items in the meantime: the wait starts over.
+        with self._lock:
+            while True:
+                while not self._items:
+                    self._not_empty.wait()
+                deadline = self._items[0][0] + max_wait
+                while len(self._items) < max_items:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._not_empty.wait(remaining)
+                if self._items:
+                    break
+            count = min(max_items, len(self._items))
+            batch = [self._items.popleft() for _ in range(count)]
+            self._not_full.notify_all()
+            now = time.monotonic()
+            lag = now - batch[0][0]
+            self.dequeued += count
+            self.lag_sum += sum(now - enqueued_at for enqueued_at, _ in batch)
+            self.lag_last = lag
+            if lag > self.lag_max:
+                self.lag_max = lag
+        return [item for _, item in batch]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'depth': len(self._items),
+                'maxsize': self.maxsize,
+                'policy': self.policy,
+                'enqueued': self.enqueued,
+                'dropped': self.dropped,
+                'dequeued': self.dequeued,
+                'lag_avg': self.lag_sum / self.dequeued if self.dequeued else 0.0,
+                'lag_max': self.lag_max,
+                'lag_last': self.lag_last,
+            }
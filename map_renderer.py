@@ -0,0 +1,221 @@
+import logging
+import math
+import os
+import threading
+import urllib.request
+from collections import deque
+from io import BytesIO
+
+from PIL import Image, ImageDraw
+
+# Map of the Tkinter consumer: the base map of the current view is stitched
+# once from Web Mercator tiles (cached in memory and in TILE_CACHE_DIR), the
+# vehicles are drawn over a copy of it with PIL. Without network access the
+# base is a plain grid.
+TILE_SIZE = 256
+TILE_URL = 'https://tile.openstreetmap.org/{z}/{x}/{y}.png'
+TILE_CACHE_DIR = 'tile_cache'
+TILE_TIMEOUT = 5.0
+USER_AGENT = 'v2v-mqtt-consumer/1.0'
+MIN_ZOOM = 2
+MAX_ZOOM = 19
+# Points of trace kept per vehicle
+TRACE_POINTS = 500
+MARKER_RADIUS = 5
+_MAX_LATITUDE = 85.05112878
+
+_BACKGROUND = (229, 227, 223)
+_GRID = (210, 207, 200)
+_TRACE = (30, 90, 220)
+_MARKER = (220, 40, 40)
+_OUTLINE = (255, 255, 255)
+
+
+def world_position(latitude, longitude):
+    # Web Mercator coordinates in [0, 1), independent of the zoom level
+    latitude = max(-_MAX_LATITUDE, min(_MAX_LATITUDE, latitude))
+    sin_lat = math.sin(math.radians(latitude))
+    x = (longitude + 180.0) / 360.0
+    y = 0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)
+    return x, y
+
+
+def world_to_latlng(x, y):
+    longitude = x * 360.0 - 180.0
+    latitude = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y))))
+    return latitude, longitude
+
+
+class TileSource:
+    # Tiles from TILE_URL, kept in memory and on disk; a blank tile for the
+    # ones that cannot be fetched (no retry until the next view)
+
+    def __init__(self, url=TILE_URL, cache_dir=TILE_CACHE_DIR):
+        self.url = url
+        self.cache_dir = cache_dir
+        self._tiles = {}
+        self._failed = set()
+        self.fetched = 0
+        self.failures = 0
+
+    def _blank(self):
+        tile = Image.new('RGB', (TILE_SIZE, TILE_SIZE), _BACKGROUND)
+        draw = ImageDraw.Draw(tile)
+        draw.line([(0, 0), (TILE_SIZE - 1, 0)], fill=_GRID)
+        draw.line([(0, 0), (0, TILE_SIZE - 1)], fill=_GRID)
+        return tile
+
+    def tile(self, zoom, x, y):
+        key = (zoom, x, y)
+        tile = self._tiles.get(key)
+        if tile is not None:
+            return tile
+        path = os.path.join(self.cache_dir, str(zoom), str(x), f"{y}.png") if self.cache_dir else None
+        if path and os.path.exists(path):
+            try:
+                tile = Image.open(path).convert('RGB')
+            except OSError:
+                tile = None
+        if tile is None and key not in self._failed and self.url:
+            try:
+                request = urllib.request.Request(self.url.format(z=zoom, x=x, y=y),
+                                                 headers={'User-Agent': USER_AGENT})
+                with urllib.request.urlopen(request, timeout=TILE_TIMEOUT) as response:
+                    data = response.read()
+                if path:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    with open(path, 'wb') as f:
+                        f.write(data)
+                tile = Image.open(BytesIO(data)).convert('RGB')
+                self.fetched += 1
+            except (OSError, ValueError) as e:
+                logging.debug("Tile %s/%s/%s unavailable: %s", zoom, x, y, e)
+                self._failed.add(key)
+                self.failures += 1
+        if tile is None:
+            tile = self._blank()
+        self._tiles[key] = tile
+        return tile
+
+
+class MapRenderer:
+    # add() may be called from any thread (MQTT), render() from the Tk
+    # main loop: it returns None when nothing changed since the previous
+    # frame. The traces are kept in world coordinates and, for the current
+    # view, in pixels: points are projected once, when they arrive or when
+    # the view changes, never per frame.
+
+    def __init__(self, width, height, latitude, longitude, zoom, tiles=None, trace_points=TRACE_POINTS):
+        self.width = width
+        self.height = height
+        self.tiles = tiles or TileSource()
+        self.trace_points = trace_points
+        self._lock = threading.Lock()
+        self._world = {}     # vehicle_id -> deque of world positions
+        self._pixels = {}    # vehicle_id -> deque of pixel positions in the current view
+        self._base = None
+        self._base_view = None
+        self._generation = 0
+        self._dirty = True
+        self.zoom = zoom
+        self._origin = (0.0, 0.0)
+        self.set_view(latitude, longitude, zoom)
+
+    @property
+    def vehicles(self):
+        return len(self._world)
+
+    def _pixel(self, position):
+        scale = TILE_SIZE * 2 ** self.zoom
+        return position[0] * scale - self._origin[0], position[1] * scale - self._origin[1]
+
+    def center(self):
+        scale = TILE_SIZE * 2 ** self.zoom
+        return world_to_latlng((self._origin[0] + self.width / 2) / scale, (self._origin[1] + self.height / 2) / scale)
+
+    def set_view(self, latitude, longitude, zoom):
+        # Re-projects the traces, the base map is rebuilt by build_base()
+        zoom = max(MIN_ZOOM, min(MAX_ZOOM, int(zoom)))
+        x, y = world_position(latitude, longitude)
+        scale = TILE_SIZE * 2 ** zoom
+        with self._lock:
+            self.zoom = zoom
+            self._origin = (x * scale - self.width / 2, y * scale - self.height / 2)
+            self._pixels = {vehicle_id: deque((self._pixel(p) for p in world), self.trace_points)
+                            for vehicle_id, world in self._world.items()}
+            self._generation += 1
+            self._dirty = True
+            return self._generation
+
+    def zoom_by(self, delta):
+        latitude, longitude = self.center()
+        return self.set_view(latitude, longitude, self.zoom + delta)
+
+    def fit(self):
+        # View on the latest position of every vehicle
+        with self._lock:
+            latest = [world[-1] for world in self._world.values() if world]
+        if not latest:
+            return None
+        xs = [p[0] for p in latest]
+        ys = [p[1] for p in latest]
+        # Largest zoom with every vehicle inside 80% of the view
+        scale = min(self.width * 0.8 / max(max(xs) - min(xs), 1e-9),
+                    self.height * 0.8 / max(max(ys) - min(ys), 1e-9)) / TILE_SIZE
+        latitude, longitude = world_to_latlng((max(xs) + min(xs)) / 2, (max(ys) + min(ys)) / 2)
+        return self.set_view(latitude, longitude, min(math.floor(math.log2(scale)), 17))
+
+    def add(self, vehicle_id, latitude, longitude):
+        position = world_position(latitude, longitude)
+        with self._lock:
+            world = self._world.get(vehicle_id)
+            if world is None:
+                world = self._world[vehicle_id] = deque(maxlen=self.trace_points)
+                self._pixels[vehicle_id] = deque(maxlen=self.trace_points)
+            world.append(position)
+            self._pixels[vehicle_id].append(self._pixel(position))
+            self._dirty = True
+
+    def build_base(self):
+        # Stitches the tiles of the current view (slow on a cache miss: run
+        # it off the Tk thread). Returns False if the view changed meanwhile.
+        with self._lock:
+            generation = self._generation
+            zoom = self.zoom
+            origin_x, origin_y = self._origin
+        base = Image.new('RGB', (self.width, self.height), _BACKGROUND)
+        count = 2 ** zoom
+        first_x, first_y = int(origin_x // TILE_SIZE), int(origin_y // TILE_SIZE)
+        last_x, last_y = int((origin_x + self.width) // TILE_SIZE), int((origin_y + self.height) // TILE_SIZE)
+        for tile_y in range(max(first_y, 0), min(last_y, count - 1) + 1):
+            for tile_x in range(first_x, last_x + 1):
+                tile = self.tiles.tile(zoom, tile_x % count, tile_y)
+                base.paste(tile, (round(tile_x * TILE_SIZE - origin_x), round(tile_y * TILE_SIZE - origin_y)))
+        with self._lock:
+            if generation != self._generation:
+                return False
+            self._base = base
+            self._base_view = generation
+            self._dirty = True
+        return True
+
+    def render(self):
+        # PIL image of the current state, None if nothing changed
+        with self._lock:
+            if not self._dirty:
+                return None
+            self._dirty = False
+            base = self._base if self._base_view == self._generation else None
+            traces = [list(pixels) for pixels in self._pixels.values()]
+        image = base.copy() if base is not None else Image.new('RGB', (self.width, self.height), _BACKGROUND)
+        draw = ImageDraw.Draw(image)
+        r = MARKER_RADIUS
+        for trace in traces:
+            if len(trace) > 1:
+                draw.line(trace, fill=_TRACE, width=2)
+        for trace in traces:
+            if trace:
+                x, y = trace[-1]
+                if -r <= x <= self.width + r and -r <= y <= self.height + r:
+                    draw.ellipse((x - r, y - r, x + r, y + r), fill=_MARKER, outline=_OUTLINE)
+        return image
@@ -0,0 +1,117 @@
+import math
+import threading
+import time
+
+# Defaults from the CAM generation rules of ETSI EN 302 637-2: a new CAM
+# when the position moved more than 4 m, the heading changed more than 4
+# degrees or the speed more than 0.5 m/s since the last one, and at least
+# one per second.
+DISTANCE_M = 4.0
+HEADING_DEG = 4.0
+SPEED_MS = 0.5
+MAX_INTERVAL = 1.0
+
+# Why an update was forwarded, in the order the conditions are checked
+REASONS = ('new', 'interval', 'distance', 'heading', 'speed')
+
+_METERS_PER_DEGREE = 111320.0
+
+
+class MotionFilter:
+    # Per-vehicle update suppression: an update is forwarded when the
+    # vehicle moved, turned or changed speed past the thresholds since the
+    # last forwarded update, or max_interval seconds of vehicle time later.
+    # Vehicles without an update for vehicle_timeout seconds are forgotten.
+
+    def __init__(self, distance=DISTANCE_M, heading=HEADING_DEG, speed=SPEED_MS, max_interval=MAX_INTERVAL,
+                 vehicle_timeout=300.0, sweep_interval=5.0, enabled=True):
+        self.distance = distance
+        self.heading = heading
+        self.speed = speed
+        self.max_interval = max_interval
+        self.vehicle_timeout = vehicle_timeout
+        self.sweep_interval = sweep_interval
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._last = {}     # vehicle_id -> (timestamp, latitude, longitude, speed, heading) last forwarded
+        self._seen = {}     # vehicle_id -> time.time() of the latest update, forwarded or not
+        self._last_sweep = time.time()
+        self.received = 0
+        self.suppressed = 0
+        self.forwarded = dict.fromkeys(REASONS, 0)
+
+    def _reason(self, last, timestamp, latitude, longitude, speed, heading):
+        if last is None:
+            return 'new'
+        last_timestamp, last_latitude, last_longitude, last_speed, last_heading = last
+        # Either way, so that a replay starting over is not held back
+        if abs(timestamp - last_timestamp) >= self.max_interval * 1000:
+            return 'interval'
+        # Equirectangular approximation, good to well under a meter at these distances
+        dy = (latitude - last_latitude) * _METERS_PER_DEGREE
+        dx = (longitude - last_longitude) * _METERS_PER_DEGREE * math.cos(math.radians(latitude))
+        if dx * dx + dy * dy > self.distance * self.distance:
+            return 'distance'
+        if abs((heading - last_heading + 180.0) % 360.0 - 180.0) > self.heading:
+            return 'heading'
+        if abs(speed - last_speed) > self.speed:
+            return 'speed'
+        return None
+
+    def select(self, rows, now=None):
+        # rows: (vehicle_id, timestamp ms, latitude, longitude, speed m/s,
+        # heading degrees) -> one bool per row, True for the forwarded ones
+        if now is None:
+            now = time.time()
+        if not self.enabled:
+            return [True] * len(rows)
+        with self._lock:
+            self.received += len(rows)
+            selected = []
+            last = self._last
+            seen = self._seen
+            forwarded = self.forwarded
+            for vehicle_id, timestamp, latitude, longitude, speed, heading in rows:
+                seen[vehicle_id] = now
+                reason = self._reason(last.get(vehicle_id), timestamp, latitude, longitude, speed, heading)
+                if reason is None:
+                    self.suppressed += 1
+                    selected.append(False)
+                    continue
+                forwarded[reason] += 1
+                last[vehicle_id] = (timestamp, latitude, longitude, speed, heading)
+                selected.append(True)
+            if now - self._last_sweep >= self.sweep_interval:
+                self._expire(now)
+            return selected
+
+    def _expire(self, now):
+        self._last_sweep = now
+        silent = now - self.vehicle_timeout
+        for vehicle_id in [v for v, seen in self._seen.items() if seen < silent]:
+            del self._seen[vehicle_id]
+            self._last.pop(vehicle_id, None)
+
+    def set_enabled(self, enabled):
+        # Starts over, so that every vehicle's next update is forwarded
+        with self._lock:
+            if enabled and not self.enabled:
+                self._last = {}
+            self.enabled = enabled
+
+    def stats(self):
+        with self._lock:
+            forwarded = sum(self.forwarded.values())
+            return {
+                'enabled': self.enabled,
+                'distance': self.distance,
+                'heading': self.heading,
+                'speed': self.speed,
+                'max_interval': self.max_interval,
+                'vehicles': len(self._seen),
+                'received': self.received,
+                'forwarded': forwarded,
+                'suppressed': self.suppressed,
+                'suppression_ratio': self.suppressed / self.received if self.received else 0.0,
+                'forwarded_by_reason': dict(self.forwarded),
+            }
@@ -0,0 +1,142 @@
+import mmap
+import os
+import struct
+from collections import namedtuple
+
+LINKTYPE_ETHERNET = 1
+LINKTYPE_IEEE802_11 = 105
+
+# pcap magic -> (byte order, timestamp resolution)
+_PCAP_MAGICS = {
+    b'\xd4\xc3\xb2\xa1': ('<', 1e-6),
+    b'\xa1\xb2\xc3\xd4': ('>', 1e-6),
+    b'\x4d\x3c\xb2\xa1': ('<', 1e-9),
+    b'\xa1\xb2\x3c\x4d': ('>', 1e-9),
+}
+_PCAPNG_SHB = b'\x0a\x0d\x0d\x0a'
+_PCAPNG_BYTE_ORDER = 0x1A2B3C4D
+
+_PCAPNG_IDB = 1
+_PCAPNG_PB = 2
+_PCAPNG_SPB = 3
+_PCAPNG_EPB = 6
+_PCAPNG_OPT_TSRESOL = 9
+_PCAPNG_OPT_TSOFFSET = 14
+
+# offset: position of the frame data in the file, data: memoryview on the
+# memory-mapped file, only valid until the next frame is read.
+Frame = namedtuple('Frame', ['timestamp', 'linktype', 'data', 'offset'])
+
+
+class CaptureFormatError(ValueError):
+    pass
+
+
+def iter_frames(path):
+    # Yields every frame of a pcap/pcapng file without copying or dissecting it.
+    # Callers that need to keep a frame must copy it (bytes(frame.data)).
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mm)
+    try:
+        for timestamp, linktype, offset, length in walk_records(view):
+            data = view[offset:offset + length]
+            yield Frame(timestamp, linktype, data, offset)
+            data.release()
+    finally:
+        view.release()
+        try:
+            mm.close()
+        except BufferError:
+            # A caller kept a frame alive, the mapping goes away with it
+            pass
+
+
+def count_frames(path):
+    # Cheap pre-count: walks the record headers only
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return sum(1 for _ in walk_records(mm))
+
+
+def walk_records(buf):
+    # Yields (timestamp, linktype, offset, length) for every frame in buf
+    magic = bytes(buf[:4])
+    if magic in _PCAP_MAGICS:
+        return _walk_pcap(buf, *_PCAP_MAGICS[magic])
+    if magic == _PCAPNG_SHB:
+        return _walk_pcapng(buf)
+    raise CaptureFormatError("Not a pcap or pcapng file")
+
+
+def _walk_pcap(buf, endian, resolution):
+    size = len(buf)
+    if size < 24:
+        raise CaptureFormatError("Truncated pcap header")
+    linktype = struct.unpack_from(endian + 'I', buf, 20)[0] & 0xFFFF
+    record = struct.Struct(endian + 'IIII')
+    offset = 24
+    while offset + 16 <= size:
+        ts_sec, ts_frac, caplen, _ = record.unpack_from(buf, offset)
+        offset += 16
+        if offset + caplen > size:
+            # Truncated last record (capture still being written)
+            return
+        yield ts_sec + ts_frac * resolution, linktype, offset, caplen
+        offset += caplen
+
+
+def _walk_pcapng(buf):
+    size = len(buf)
+    offset = 0
+    endian = '<'
+    interfaces = []  # (linktype, resolution, ts_offset) per interface of the current section
+    while offset + 12 <= size:
+        if bytes(buf[offset:offset + 4]) == _PCAPNG_SHB:
+            magic = struct.unpack_from('<I', buf, offset + 8)[0]
+            endian = '<' if magic == _PCAPNG_BYTE_ORDER else '>'
+            interfaces = []
+        block_type, block_len = struct.unpack_from(endian + 'II', buf, offset)
+        if block_len < 12 or offset + block_len > size:
+            return
+        body = offset + 8
+        if block_type == _PCAPNG_EPB:
+            iface, ts_high, ts_low, caplen = struct.unpack_from(endian + 'IIII', buf, body)
+            linktype, resolution, ts_offset = interfaces[iface]
+            timestamp = ((ts_high << 32) | ts_low) * resolution + ts_offset
+            yield timestamp, linktype, body + 20, caplen
+        elif block_type == _PCAPNG_SPB:
+            linktype, _, _ = interfaces[0]
+            orig_len = struct.unpack_from(endian + 'I', buf, body)[0]
+            yield None, linktype, body + 4, min(orig_len, block_len - 16)
+        elif block_type == _PCAPNG_PB:
+            iface, _, ts_high, ts_low, caplen = struct.unpack_from(endian + 'HHIII', buf, body)
+            linktype, resolution, ts_offset = interfaces[iface]
+            timestamp = ((ts_high << 32) | ts_low) * resolution + ts_offset
+            yield timestamp, linktype, body + 20, caplen
+        elif block_type == _PCAPNG_IDB:
+            interfaces.append(_read_interface(buf, endian, body, offset + block_len - 4))
+        offset += block_len
+
+
+def _read_interface(buf, endian, start, end):
+    linktype = struct.unpack_from(endian + 'H', buf, start)[0]
+    resolution = 1e-6
+    ts_offset = 0
+    option = start + 8
+    while option + 4 <= end:
+        code, length = struct.unpack_from(endian + 'HH', buf, option)
+        if code == 0:
+            break
+        value = option + 4
+        if code == _PCAPNG_OPT_TSRESOL and length == 1:
+            tsresol = buf[value]
+            resolution = 2.0 ** -(tsresol & 0x7F) if tsresol & 0x80 else 10.0 ** -tsresol
+        elif code == _PCAPNG_OPT_TSOFFSET and length == 8:
+            ts_offset = struct.unpack_from(endian + 'q', buf, value)[0]
+        option = value + ((length + 3) & ~3)
+    return linktype, resolution, ts_offset
@@ -0,0 +1,561 @@
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+import paho.mqtt.client as mqtt
+
+from capture_index import FLAG_SECURED, FLAG_STATION, load_index
+from frame_classifier import KIND_NAMES, SECURED, class_topic, parse_classes
+from publish_pipeline import LatencyHistogram, PublishPipeline
+from replay import MODE_CAPTURE, MODE_DELAY, MODE_RATE, SPEEDS, ReplayScheduler
+
+# Minimum interval between two stats reports of a worker
+STATS_INTERVAL = 0.2
+# How long a worker waits for its in-flight messages at the end of a run
+DRAIN_TIMEOUT = 10.0
+# The schedule starts this long after the last worker is connected
+START_MARGIN = 0.05
+
+# Topic routing: everything on the configured topic, one subtopic per frame
+# class (<topic>/cam, <topic>/secured/cam...), or per class and vehicle
+# (<topic>/cam/<station id>, frames without a station id stay on the class topic)
+ROUTE_SINGLE = 'single'
+ROUTE_CLASS = 'class'
+ROUTE_VEHICLE = 'vehicle'
+ROUTES = (ROUTE_SINGLE, ROUTE_CLASS, ROUTE_VEHICLE)
+
+# start_file/start_packet: where the replay starts (index in files, frame
+# number in that file), start_time: seconds into that file, vehicles: keys
+# (see capture_index.vehicle_key) of the only vehicles to send, None for all,
+# routing: one of ROUTES, drop: frame class names (frame_classifier) not sent
+EngineSettings = namedtuple('EngineSettings', [
+    'broker', 'port', 'topic', 'files',
+    'mode', 'delay', 'speed', 'rate',
+    'workers', 'use_processes', 'client_id',
+    'qos', 'window',
+    'start_file', 'start_packet', 'start_time', 'vehicles',
+    'routing', 'drop',
+])
+EngineSettings.__new__.__defaults__ = (MODE_DELAY, 0.0, 1.0, None, 1, True, "Producer", 0, 100,
+                                       0, 0, None, None, ROUTE_SINGLE, frozenset())
+
+
+def _new_worker_stats(index, start=(0, 0)):
+    # file/next: the worker has handled every frame before frame `next` of
+    # files[file], a stopped run resumes from the smallest of these points
+    return {
+        'worker': index, 'sent': 0, 'errors': 0, 'read_bytes': 0,
+        'file': start[0], 'next': start[1],
+        'delivered': 0, 'pending': 0, 'latency': None,
+        'start': None, 'last': None, 'first_publish': None, 'last_publish': None,
+        'target_rate': 0.0, 'position': 0, 'offset': 0.0, 'scheduled': 0, 'jitter_sum': 0.0, 'jitter_max': 0.0,
+        'class_sent': [0] * len(KIND_NAMES), 'class_bytes': [0] * len(KIND_NAMES),
+        'class_dropped': [0] * len(KIND_NAMES), 'class_dropped_bytes': [0] * len(KIND_NAMES),
+    }
+
+
+def select_frames(settings, file_number, capture):
+    # Positions of the frames of files[file_number] to replay
+    if file_number != settings.start_file:
+        return capture.select(vehicles=settings.vehicles)
+    return capture.select(settings.start_packet, settings.start_time, settings.vehicles)
+
+
+def dropped_frames(settings, entries):
+    # Mask of the index entries whose class is in settings.drop
+    dropped = np.isin(entries['kind'], [KIND_NAMES.index(name) for name in settings.drop if name != SECURED])
+    if SECURED in settings.drop:
+        dropped |= (entries['flags'] & FLAG_SECURED) != 0
+    return dropped
+
+
+def frame_topic(settings, kind, flags, vehicle):
+    if settings.routing == ROUTE_SINGLE:
+        return settings.topic
+    topic = class_topic(settings.topic, kind, flags & FLAG_SECURED)
+    if settings.routing == ROUTE_VEHICLE and flags & FLAG_STATION:
+        return f"{topic}/{vehicle}"
+    return topic
+
+
+def run_worker(index, settings, events, running, stop, go, start):
+    # Publishes the frames of its shard on its own MQTT connection and
+    # reports its counters to the engine through the events queue. Frames
+    # are located through the capture indexes, only the frames of the shard
+    # are read.
+    if settings.use_processes:
+        # Ctrl-C reaches the whole process group, the engine stops the
+        # workers through `stop` so they can report where they stopped
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+    stats = _new_worker_stats(index, (settings.start_file, settings.start_packet))
+    workers = settings.workers
+    # Every worker follows the schedule of the whole capture and only waits
+    # for its own frames, so the total rate and the ordering are kept.
+    scheduler = ReplayScheduler(settings.mode, delay=settings.delay, speed=settings.speed, rate=settings.rate)
+    client = mqtt.Client(client_id=f"{settings.client_id}-{index}" if workers > 1 else settings.client_id)
+    try:
+        client.connect(settings.broker, settings.port)
+        client.loop_start()
+    except Exception as e:
+        events.put(('log', index, f"Erreur de connexion : {e}"))
+        events.put(('done', index, stats))
+        return
+    pipeline = PublishPipeline(client, qos=settings.qos, window=settings.window, stop=stop)
+
+    # The engine sets the schedule origin (start) once every worker is
+    # connected, so that spawn and connection times are not caught up on
+    events.put(('ready', index, None))
+    while not go.wait(0.1):
+        if stop.is_set():
+            break
+    start_at = start.value or time.time()
+    scheduler.begin(start_at)
+    stats['start'] = max(start_at, time.time())
+    last_report = 0
+    files_bytes = sum(_file_size(path) for path in settings.files[:settings.start_file])
+    topics = {}
+    try:
+        for file_number in range(settings.start_file, len(settings.files)):
+            path = settings.files[file_number]
+            scheduler.new_stream()
+            try:
+                size = os.path.getsize(path)
+                capture = load_index(path)
+                positions = select_frames(settings, file_number, capture)
+                stats['file'] = file_number
+                stats['next'] = int(positions[0]) if len(positions) else len(capture)
+                entries = capture.entries[positions]
+                owners = entries['vehicle'] % workers
+                dropped = dropped_frames(settings, entries)
+                frames = capture.frames(positions[(owners == index) & ~dropped])
+                # Dropped frames are neither read nor scheduled, each worker
+                # counts the ones of its shard
+                for position, timestamp, owner, drop, kind, flags, vehicle, length in zip(
+                        positions.tolist(), entries['timestamp'].tolist(), owners.tolist(), dropped.tolist(),
+                        entries['kind'].tolist(), entries['flags'].tolist(), entries['vehicle'].tolist(),
+                        entries['length'].tolist()):
+                    if stop.is_set():
+                        break
+                    if drop:
+                        if owner == index:
+                            stats['class_dropped'][kind] += 1
+                            stats['class_dropped_bytes'][kind] += length
+                        stats['next'] = position + 1
+                        continue
+                    if owner != index:
+                        scheduler.skip(None if math.isnan(timestamp) else timestamp)
+                        stats['next'] = position + 1
+                        continue
+                    topic = topics.get((kind, flags, vehicle))
+                    if topic is None:
+                        topic = topics[kind, flags, vehicle] = frame_topic(settings, kind, flags, vehicle)
+                    _, frame = next(frames)
+                    data = frame.data
+                    if not running.is_set():
+                        paused_at = time.perf_counter()
+                        running.wait()
+                        scheduler.shift(time.perf_counter() - paused_at)
+                    scheduler.wait(frame.timestamp)
+                    if not pipeline.publish(topic, bytes(data)) and stop.is_set():
+                        # Stopped while the window was full: this frame was not sent
+                        break
+                    stats['sent'] += 1
+                    stats['class_sent'][kind] += 1
+                    stats['class_bytes'][kind] += length
+                    stats['next'] = position + 1
+                    now = time.time()
+                    if stats['first_publish'] is None:
+                        stats['first_publish'] = now
+                    stats['last_publish'] = now
+                    if now - last_report >= STATS_INTERVAL:
+                        last_report = now
+                        stats['read_bytes'] = files_bytes + frame.offset + len(data)
+                        _report(events, 'stats', stats, scheduler, pipeline, now)
+                frames.close()
+            except Exception as e:
+                events.put(('log', index, f"Erreur lors de la lecture de {path} : {e}"))
+                size = 0
+            files_bytes += size
+            stats['read_bytes'] = files_bytes
+            if stop.is_set():
+                break
+            stats['file'] = file_number + 1
+            stats['next'] = 0
+        if pipeline.drain(DRAIN_TIMEOUT):
+            events.put(('log', index, f"{pipeline.pending} message(s) sans accusé de réception"))
+    finally:
+        # Disconnect first: paho's network thread does not end while
+        # messages are unacknowledged. The ones left count as failed (already
+        # done by on_disconnect unless the connection was down).
+        client.disconnect()
+        client.loop_stop()
+        pipeline.abandon()
+        _report(events, 'done', stats, scheduler, pipeline, time.time())
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _report(events, kind, stats, scheduler, pipeline, now):
+    stats['last'] = now
+    stats['errors'] = pipeline.failed
+    stats['delivered'] = pipeline.delivered
+    stats['pending'] = pipeline.pending
+    stats['latency'] = list(pipeline.latency.counts)
+    stats['target_rate'] = scheduler.target_rate()
+    stats['position'] = scheduler.offset_position
+    stats['offset'] = scheduler.offset or 0.0
+    stats['scheduled'] = scheduler.scheduled
+    stats['jitter_sum'] = scheduler.jitter_sum
+    stats['jitter_max'] = scheduler.jitter_max
+    events.put((kind, stats['worker'], dict(stats)))
+
+
+class EngineStats:
+    # Counters of all the workers of a run, aggregated by the engine
+
+    def __init__(self, workers, total_bytes, total_frames=None, start=(0, 0)):
+        self.workers = {i: _new_worker_stats(i, start) for i in range(workers)}
+        self.total_bytes = total_bytes
+        self.total_frames = total_frames
+        self.finished = False
+
+    def update(self, worker_stats):
+        self.workers[worker_stats['worker']] = worker_stats
+
+    @property
+    def sent(self):
+        return sum(w['sent'] for w in self.workers.values())
+
+    @property
+    def errors(self):
+        return sum(w['errors'] for w in self.workers.values())
+
+    @property
+    def delivered(self):
+        return sum(w['delivered'] for w in self.workers.values())
+
+    @property
+    def pending(self):
+        return sum(w['pending'] for w in self.workers.values())
+
+    @property
+    def latency(self):
+        histogram = LatencyHistogram()
+        for w in self.workers.values():
+            if w['latency']:
+                histogram.merge(LatencyHistogram(w['latency']))
+        return histogram
+
+    @property
+    def read_bytes(self):
+        # Every worker reads all the files
+        return min(w['read_bytes'] for w in self.workers.values())
+
+    @property
+    def elapsed(self):
+        # Up to the last publish: the final drain and disconnection are not sending time
+        starts = [w['start'] for w in self.workers.values() if w['start']]
+        lasts = [w['last_publish'] for w in self.workers.values() if w['last_publish']]
+        if not starts or not lasts:
+            return 0.0
+        return max(lasts) - min(starts)
+
+    def estimated_total(self):
+        # Exact when the capture indexes gave the number of frames to send
+        if self.total_frames is not None:
+            return self.total_frames, True
+        if self.finished or not self.read_bytes or self.read_bytes >= self.total_bytes:
+            return self.sent, True
+        return int(self.sent * self.total_bytes / self.read_bytes), False
+
+    def achieved_rate(self):
+        # sent packets are sent - 1 intervals from the first publish to the last
+        firsts = [w['first_publish'] for w in self.workers.values() if w['first_publish']]
+        lasts = [w['last_publish'] for w in self.workers.values() if w['last_publish']]
+        if self.sent < 2 or not firsts or not lasts:
+            return 0.0
+        span = max(lasts) - min(firsts)
+        return (self.sent - 1) / span if span > 0 else 0.0
+
+    def target_rate(self):
+        # Workers share one schedule: frames scheduled so far over its span
+        if any(w['target_rate'] is None for w in self.workers.values()):
+            return None
+        position = max(w['position'] for w in self.workers.values())
+        offset = max(w['offset'] for w in self.workers.values())
+        return (position - 1) / offset if position > 1 and offset > 0 else 0.0
+
+    def class_totals(self, key):
+        # Per-class sum of a worker counter list, {class name: value} without zeros
+        totals = [sum(values) for values in zip(*(w[key] for w in self.workers.values()))]
+        return {name: value for name, value in zip(KIND_NAMES, totals) if value}
+
+    def class_summary(self):
+        sent = self.class_totals('class_sent')
+        sizes = self.class_totals('class_bytes')
+        line = "Classes : " + (", ".join(f"{name} {count} ({sizes[name] / 1024:.1f} ko)"
+                                         for name, count in sent.items()) or "-")
+        dropped = self.class_totals('class_dropped')
+        if dropped:
+            saved = sum(self.class_totals('class_dropped_bytes').values())
+            line += (" | Ignorés : " + ", ".join(f"{name} {count}" for name, count in dropped.items())
+                     + f" ({saved / 1024:.1f} ko économisés)")
+        return line
+
+    def resume_point(self):
+        # (file, frame) from which a stopped run can be restarted without
+        # losing frames (frames in flight may be sent twice)
+        return min((w['file'], w['next']) for w in self.workers.values())
+
+    def mean_jitter(self):
+        scheduled = sum(w['scheduled'] for w in self.workers.values())
+        return sum(w['jitter_sum'] for w in self.workers.values()) / scheduled if scheduled else 0.0
+
+    def max_jitter(self):
+        return max(w['jitter_max'] for w in self.workers.values())
+
+    def summary(self):
+        target = self.target_rate()
+        target = "max" if target is None else f"{target:.1f}"
+        return (f"Débit : {self.achieved_rate():.1f} / {target} msg/s | "
+                f"Gigue : moy {self.mean_jitter() * 1000:.2f} ms, max {self.max_jitter() * 1000:.2f} ms")
+
+    def delivery_summary(self):
+        return (f"Livrés : {self.delivered} | En attente : {self.pending} | Échecs : {self.errors} | "
+                f"{self.latency.summary()}")
+
+    def report(self):
+        lines = [f"Paquets envoyés : {self.sent} (erreurs : {self.errors}) en {self.elapsed:.2f}s",
+                 self.summary(),
+                 self.delivery_summary(),
+                 self.class_summary()]
+        if len(self.workers) > 1:
+            for w in self.workers.values():
+                lines.append(f"  worker {w['worker']} : {w['sent']} paquets, {w['delivered']} livrés, "
+                             f"{w['pending']} en attente, {w['errors']} erreurs")
+        return "\n".join(lines)
+
+
+class ProducerEngine:
+    # Runs a replay on settings.workers processes (or threads), each with
+    # its own MQTT client. on_progress(stats) and on_log(message) are called
+    # from the thread that called run().
+
+    def __init__(self, settings, on_progress=None, on_log=None):
+        self.settings = settings
+        self.on_progress = on_progress
+        self.on_log = on_log
+        if settings.use_processes:
+            context = multiprocessing.get_context('spawn')
+            self._events = context.Queue()
+            self._running = context.Event()
+            self._stop = context.Event()
+            self._go = context.Event()
+            self._start = context.Value('d', 0.0)
+            self._worker_class = context.Process
+        else:
+            self._events = queue.Queue()
+            self._running = threading.Event()
+            self._stop = threading.Event()
+            self._go = threading.Event()
+            self._start = multiprocessing.Value('d', 0.0)
+            self._worker_class = threading.Thread
+        self._running.set()
+        total_bytes = sum(_file_size(path) for path in settings.files)
+        # Builds (or loads) the capture indexes once before the workers start
+        total_frames = 0
+        for file_number in range(settings.start_file, len(settings.files)):
+            try:
+                capture = load_index(settings.files[file_number])
+                entries = capture.entries[select_frames(settings, file_number, capture)]
+                total_frames += len(entries) - int(np.count_nonzero(dropped_frames(settings, entries)))
+            except Exception:
+                # The worker reports the error
+                total_frames = None
+                break
+        self.stats = EngineStats(settings.workers, total_bytes, total_frames,
+                                 (settings.start_file, settings.start_packet))
+
+    def pause(self):
+        self._running.clear()
+
+    def resume(self):
+        self._running.set()
+
+    def stop(self):
+        self._stop.set()
+        self._running.set()
+
+    def run(self):
+        workers = [
+            self._worker_class(target=run_worker, daemon=True,
+                               args=(i, self.settings, self._events, self._running, self._stop,
+                                     self._go, self._start))
+            for i in range(self.settings.workers)
+        ]
+        for worker in workers:
+            worker.start()
+        remaining = len(workers)
+        # Workers not connected yet: they all share one schedule origin, set
+        # when the last one is ready (or gave up)
+        connecting = set(range(len(workers)))
+        while remaining:
+            try:
+                kind, index, payload = self._events.get(timeout=0.5)
+            except queue.Empty:
+                if not any(w.is_alive() for w in workers):
+                    break
+                continue
+            if kind in ('ready', 'done') and connecting:
+                connecting.discard(index)
+                if not connecting:
+                    self._start.value = time.time() + START_MARGIN
+                    self._go.set()
+            if kind == 'ready':
+                continue
+            if kind == 'log':
+                if self.on_log:
+                    self.on_log(f"[worker {index}] {payload}" if self.settings.workers > 1 else payload)
+                continue
+            self.stats.update(payload)
+            if kind == 'done':
+                remaining -= 1
+            if self.on_progress:
+                self.on_progress(self.stats)
+        for worker in workers:
+            worker.join()
+        self.stats.finished = True
+        if self.on_progress:
+            self.on_progress(self.stats)
+        return self.stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Producteur MQTT sans interface graphique")
+    parser.add_argument('files', nargs='+', help="Fichiers PCAP/PCAPNG à envoyer")
+    parser.add_argument('--broker', default='localhost')
+    parser.add_argument('--port', type=int, default=1883)
+    parser.add_argument('--topic', default='v2v')
+    parser.add_argument('--mode', choices=[MODE_DELAY, MODE_CAPTURE, MODE_RATE], default=MODE_DELAY)
+    parser.add_argument('--delay', type=float, default=0.0, help="Délai (sec) entre packets, mode delay")
+    parser.add_argument('--speed', choices=list(SPEEDS), default='1x', help="Vitesse, mode capture")
+    parser.add_argument('--rate', type=float, help="Débit cible total (msg/s), mode rate")
+    parser.add_argument('--workers', type=int, default=1, help="Nombre de connexions MQTT")
+    parser.add_argument('--threads', action='store_true',
+                        help="Une connexion par thread au lieu d'un processus par connexion")
+    parser.add_argument('--client-id', default="Producer")
+    parser.add_argument('--qos', type=int, choices=[0, 1, 2], default=0)
+    parser.add_argument('--window', type=int, default=100, help="Messages en vol par connexion")
+    parser.add_argument('--start-packet', type=int, default=0, help="Premier paquet envoyé (numéro dans le fichier)")
+    parser.add_argument('--start-time', type=float, help="Début de l'envoi (sec depuis le début de la capture)")
+    parser.add_argument('--vehicles', help="Identifiants des véhicules à envoyer, séparés par des virgules")
+    parser.add_argument('--route', choices=ROUTES, default=ROUTE_SINGLE,
+                        help="Topic unique, un sous-topic par classe (<topic>/cam) ou par classe et véhicule (<topic>/cam/<id>)")
+    parser.add_argument('--drop', default='',
+                        help="Classes de trames à ne pas envoyer, séparées par des virgules "
+                             f"({', '.join(KIND_NAMES + (SECURED,))})")
+    parser.add_argument('--state', help="Fichier de reprise : lu au démarrage, écrit si l'envoi est interrompu")
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.window < 1:
+        parser.error("--window must be at least 1")
+    if args.mode == MODE_RATE and not (args.rate and args.rate > 0):
+        parser.error("--rate is required in rate mode")
+    vehicles = None
+    if args.vehicles:
+        try:
+            vehicles = frozenset(int(v) for v in args.vehicles.split(','))
+        except ValueError:
+            parser.error("--vehicles must be a comma-separated list of integers")
+
+    try:
+        drop = parse_classes(args.drop)
+    except ValueError as e:
+        parser.error(str(e))
+
+    start_file, start_packet, start_time = 0, args.start_packet, args.start_time
+    state = read_state(args.state, args.files) if args.state else None
+    if state is not None:
+        start_file, start_packet, start_time = state[0], state[1], None
+        print(f"Reprise au paquet {start_packet} de {args.files[start_file]}", file=sys.stderr)
+    settings = EngineSettings(args.broker, args.port, args.topic, args.files,
+                              args.mode, args.delay, SPEEDS[args.speed], args.rate,
+                              args.workers, not args.threads, args.client_id,
+                              args.qos, args.window,
+                              start_file, start_packet, start_time, vehicles,
+                              args.route, drop)
+    last_print = [0]
+
+    def on_progress(stats):
+        now = time.time()
+        if now - last_print[0] >= 1 and not stats.finished:
+            last_print[0] = now
+            total, exact = stats.estimated_total()
+            print(f"{stats.sent} / {'' if exact else '~'}{total} | {stats.summary()}", file=sys.stderr)
+
+    engine = ProducerEngine(settings, on_progress=on_progress, on_log=lambda m: print(m, file=sys.stderr))
+
+    def interrupt(signum, frame):
+        # First Ctrl-C: the workers stop and report where they are (for
+        # --state), a second one interrupts right away
+        signal.signal(signal.SIGINT, previous)
+        print("Arrêt de l'envoi", file=sys.stderr)
+        engine.stop()
+
+    previous = signal.signal(signal.SIGINT, interrupt)
+    try:
+        stats = engine.run()
+    except KeyboardInterrupt:
+        engine.stop()
+        stats = engine.stats
+    finally:
+        signal.signal(signal.SIGINT, previous)
+    print(stats.report())
+    if args.state:
+        write_state(args.state, args.files, stats.resume_point())
+    return 1 if stats.errors or stats.pending else 0
+
+
+def read_state(path, files):
+    # (file, frame) saved by a previous run on the same files, or None
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"Fichier de reprise illisible {path} : {e}", file=sys.stderr)
+        return None
+    if state.get('files') != [os.path.abspath(p) for p in files]:
+        print(f"Fichier de reprise {path} ignoré : autres fichiers", file=sys.stderr)
+        return None
+    return state['file'], state['packet']
+
+
+def write_state(path, files, point):
+    # Removed once every file has been sent
+    if point[0] >= len(files):
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    with open(path, 'w') as f:
+        json.dump({'files': [os.path.abspath(p) for p in files], 'file': point[0], 'packet': point[1]}, f)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
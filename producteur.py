@@ -2,8 +2,13 @@ import tkinter as tk
 from tkinter import filedialog, messagebox, scrolledtext, ttk
 import threading
 import time, os
-import paho.mqtt.client as mqtt
-from scapy.all import rdpcap
+from capture_index import load_index
+from frame_classifier import KIND_NAMES, parse_classes
+from producer_engine import ROUTE_CLASS, ROUTE_SINGLE, ROUTE_VEHICLE, EngineSettings, ProducerEngine
+from replay import MODE_CAPTURE, MODE_DELAY, MODE_RATE, SPEEDS
+
+# Minimum interval between two progress/stats refreshes of the GUI
+GUI_REFRESH_INTERVAL = 0.1
 
 class ProducerApp:
     def __init__(self, root):
@@ -13,9 +18,12 @@ class ProducerApp:
         self.total_packets = 0
         self.sent_packets = 0
         self.start_time = None
-        self.paused = threading.Event()
-        self.paused.set()
+        self.engine = None
+        self.engine_stats = None
+        self.last_refresh = 0
         self.sending_thread = None
+        # (file, frame) where the last stopped run can be resumed
+        self.resume_point = None
         self.build_gui()
 
     def build_gui(self):
@@ -53,6 +61,64 @@ class ProducerApp:
         self.delay_slider.set(0.1)
         self.delay_slider.pack(side=tk.LEFT, padx=5)
 
+        replay_frame = tk.Frame(self.root)
+        replay_frame.pack(padx=10, pady=5, fill=tk.X)
+        tk.Label(replay_frame, text="Mode:").pack(side=tk.LEFT)
+        self.replay_modes = {"Délai fixe": MODE_DELAY, "Timestamps capture": MODE_CAPTURE, "Débit cible": MODE_RATE}
+        self.mode_combo = ttk.Combobox(replay_frame, values=list(self.replay_modes), state="readonly", width=18)
+        self.mode_combo.current(0)
+        self.mode_combo.pack(side=tk.LEFT, padx=5)
+        tk.Label(replay_frame, text="Vitesse:").pack(side=tk.LEFT)
+        self.speed_combo = ttk.Combobox(replay_frame, values=list(SPEEDS), state="readonly", width=6)
+        self.speed_combo.set("1x")
+        self.speed_combo.pack(side=tk.LEFT, padx=5)
+        tk.Label(replay_frame, text="Débit (msg/s):").pack(side=tk.LEFT)
+        self.rate_entry = tk.Entry(replay_frame, width=8)
+        self.rate_entry.insert(tk.END, "100")
+        self.rate_entry.pack(side=tk.LEFT, padx=5)
+
+        range_frame = tk.Frame(self.root)
+        range_frame.pack(padx=10, pady=5, fill=tk.X)
+        tk.Label(range_frame, text="Début (paquet n°):").pack(side=tk.LEFT)
+        self.start_packet_entry = tk.Entry(range_frame, width=8)
+        self.start_packet_entry.insert(tk.END, "0")
+        self.start_packet_entry.pack(side=tk.LEFT, padx=5)
+        tk.Label(range_frame, text="Début (s):").pack(side=tk.LEFT)
+        self.start_time_entry = tk.Entry(range_frame, width=8)
+        self.start_time_entry.pack(side=tk.LEFT, padx=5)
+        tk.Label(range_frame, text="Véhicules:").pack(side=tk.LEFT)
+        self.vehicles_entry = tk.Entry(range_frame, width=24)
+        self.vehicles_entry.pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
+
+        route_frame = tk.Frame(self.root)
+        route_frame.pack(padx=10, pady=5, fill=tk.X)
+        tk.Label(route_frame, text="Routage:").pack(side=tk.LEFT)
+        self.routes = {"Topic unique": ROUTE_SINGLE, "Par type (<topic>/cam)": ROUTE_CLASS,
+                       "Par type et véhicule (<topic>/cam/<id>)": ROUTE_VEHICLE}
+        self.route_combo = ttk.Combobox(route_frame, values=list(self.routes), state="readonly", width=36)
+        self.route_combo.current(0)
+        self.route_combo.pack(side=tk.LEFT, padx=5)
+        tk.Label(route_frame, text="Types ignorés:").pack(side=tk.LEFT)
+        self.drop_entry = tk.Entry(route_frame, width=24)
+        self.drop_entry.pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
+
+        workers_frame = tk.Frame(self.root)
+        workers_frame.pack(padx=10, pady=5, fill=tk.X)
+        tk.Label(workers_frame, text="Connexions MQTT:").pack(side=tk.LEFT)
+        self.workers_spinbox = tk.Spinbox(workers_frame, from_=1, to=64, width=4)
+        self.workers_spinbox.pack(side=tk.LEFT, padx=5)
+        self.processes_var = tk.BooleanVar(value=True)
+        tk.Checkbutton(workers_frame, text="Un processus par connexion", variable=self.processes_var).pack(side=tk.LEFT)
+        tk.Label(workers_frame, text="QoS:").pack(side=tk.LEFT, padx=(10, 0))
+        self.qos_combo = ttk.Combobox(workers_frame, values=["0", "1", "2"], state="readonly", width=3)
+        self.qos_combo.current(0)
+        self.qos_combo.pack(side=tk.LEFT, padx=5)
+        tk.Label(workers_frame, text="Messages en vol:").pack(side=tk.LEFT)
+        self.window_spinbox = tk.Spinbox(workers_frame, from_=1, to=65535, width=6)
+        self.window_spinbox.delete(0, tk.END)
+        self.window_spinbox.insert(0, "100")
+        self.window_spinbox.pack(side=tk.LEFT, padx=5)
+
         progress_frame = tk.Frame(self.root)
         progress_frame.pack(padx=10, pady=5, fill=tk.X)
         tk.Label(progress_frame, text="Progression:").pack(side=tk.LEFT)
@@ -62,7 +128,9 @@ class ProducerApp:
         stats_frame = tk.Frame(self.root)
         stats_frame.pack(padx=10, pady=5, fill=tk.X)
         self.stats_label = tk.Label(stats_frame, text="Paquets envoyés : 0 / 0 | Temps écoulé : 0s")
-        self.stats_label.pack(side=tk.LEFT)
+        self.stats_label.pack(anchor=tk.W)
+        self.delivery_label = tk.Label(stats_frame, text="")
+        self.delivery_label.pack(anchor=tk.W)
 
         preview_frame = tk.Frame(self.root)
         preview_frame.pack(padx=10, pady=5, fill=tk.BOTH, expand=True)
@@ -80,6 +148,11 @@ class ProducerApp:
         self.pause_btn.pack(side=tk.LEFT, padx=5)
         self.resume_btn = tk.Button(btn_frame, text="Reprendre", command=self.resume_sending, state=tk.DISABLED)
         self.resume_btn.pack(side=tk.LEFT, padx=5)
+        self.stop_btn = tk.Button(btn_frame, text="Arrêter", command=self.stop_sending, state=tk.DISABLED)
+        self.stop_btn.pack(side=tk.LEFT, padx=5)
+        self.restart_btn = tk.Button(btn_frame, text="Reprendre l'envoi arrêté", command=self.restart_sending,
+                                     state=tk.DISABLED)
+        self.restart_btn.pack(side=tk.LEFT, padx=5)
 
         log_frame = tk.Frame(self.root)
         log_frame.pack(padx=10, pady=5, fill=tk.BOTH, expand=True)
@@ -95,6 +168,8 @@ class ProducerApp:
         if files:
             self.files = list(files)
             self.files_var.set("; ".join([os.path.basename(f) for f in self.files]))
+            self.resume_point = None
+            self.restart_btn.config(state=tk.DISABLED)
             self.log("Fichiers sélectionnés: " + self.files_var.get())
 
     def preview_files(self):
@@ -104,8 +179,21 @@ class ProducerApp:
             return
         for f in self.files:
             try:
-                packets = rdpcap(f, count=3)
+                # Counts come from the capture index (built once, then read from its sidecar file)
+                capture = load_index(f)
+                vehicles = capture.vehicles()
                 self.preview_text.insert(tk.END, f"--- {os.path.basename(f)} ---\n")
+                self.preview_text.insert(tk.END, f"{len(capture)} paquets, {capture.cam_count} CAM, "
+                                                 f"{len(vehicles)} véhicule(s), durée {capture.duration():.1f}s\n")
+                if vehicles:
+                    self.preview_text.insert(tk.END, "Véhicules : " + ", ".join(map(str, vehicles)) + "\n")
+                frames, sizes = capture.kind_counts()
+                self.preview_text.insert(tk.END, "Types : " + ", ".join(
+                    f"{name} {count} ({size / 1024:.1f} ko)"
+                    for name, count, size in zip(KIND_NAMES, frames, sizes) if count) + "\n")
+                # Scapy only for these summaries, loaded on the first preview
+                from scapy.all import rdpcap
+                packets = rdpcap(f, count=3)
                 for p in packets:
                     self.preview_text.insert(tk.END, p.summary() + "\n")
                 self.preview_text.insert(tk.END, "\n")
@@ -118,79 +206,163 @@ class ProducerApp:
 
     def update_stats(self):
         elapsed = int(time.time() - self.start_time) if self.start_time else 0
-        self.stats_label.config(text=f"Paquets envoyés : {self.sent_packets} / {self.total_packets} | Temps écoulé : {elapsed}s")
+        stats = self.engine_stats
+        if stats is None:
+            self.stats_label.config(text=f"Paquets envoyés : {self.sent_packets} / {self.total_packets} | Temps écoulé : {elapsed}s")
+            return
+        self.progress["value"] = stats.read_bytes
+        # The total is estimated from the bytes read so far until every file has been read
+        self.sent_packets = stats.sent
+        self.total_packets, exact = stats.estimated_total()
+        total = f"{self.total_packets}" if exact else f"~{self.total_packets}"
+        self.stats_label.config(text=f"Paquets envoyés : {self.sent_packets} / {total} | Temps écoulé : {elapsed}s | {stats.summary()}")
+        self.delivery_label.config(text=stats.delivery_summary())
+
+    def on_engine_progress(self, stats):
+        now = time.time()
+        if stats.finished or now - self.last_refresh >= GUI_REFRESH_INTERVAL:
+            self.last_refresh = now
+            self.engine_stats = stats
+            self.root.after(0, self.update_stats)
 
     def pause_sending(self):
-        self.paused.clear()
+        if self.engine:
+            self.engine.pause()
         self.log("Envoi en pause")
         self.pause_btn.config(state=tk.DISABLED)
         self.resume_btn.config(state=tk.NORMAL)
 
     def resume_sending(self):
-        self.paused.set()
+        if self.engine:
+            self.engine.resume()
         self.log("Reprise de l'envoi")
         self.pause_btn.config(state=tk.NORMAL)
         self.resume_btn.config(state=tk.DISABLED)
 
-    def sending_worker(self):
-        broker = self.broker_entry.get()
+    def stop_sending(self):
+        if self.engine:
+            self.engine.stop()
+        self.log("Arrêt de l'envoi")
+        self.stop_btn.config(state=tk.DISABLED)
+
+    def read_settings(self):
         try:
             port = int(self.port_entry.get())
         except ValueError:
             self.log("Erreur: Le port doit être un nombre")
-            return
-        topic = self.topic_entry.get()
-        delay = self.delay_slider.get()
-        client = mqtt.Client(client_id="Producer")  # Removed callback_api_version parameter
+            return None
         try:
-            client.connect(broker, port)
-            client.loop_start()
-            self.log(f"Connecté au broker {broker}:{port} sur le topic '{topic}'")
-        except Exception as e:
-            self.log(f"Erreur de connexion : {e}")
-            return
-
-        self.total_packets = 0
-        pcap_packets = []
-        for f in self.files:
+            workers = int(self.workers_spinbox.get())
+            if workers < 1:
+                raise ValueError
+        except ValueError:
+            self.log("Erreur: Le nombre de connexions doit être un entier positif")
+            return None
+        try:
+            window = int(self.window_spinbox.get())
+            if window < 1:
+                raise ValueError
+        except ValueError:
+            self.log("Erreur: Le nombre de messages en vol doit être un entier positif")
+            return None
+        mode = self.replay_modes[self.mode_combo.get()]
+        rate = None
+        if mode == MODE_RATE:
             try:
-                packets = rdpcap(f)
-                pcap_packets.extend(packets)
-            except Exception as e:
-                self.log(f"Erreur lors de la lecture de {f} : {e}")
-        self.total_packets = len(pcap_packets)
-        self.progress["maximum"] = self.total_packets
-        self.sent_packets = 0
-        self.start_time = time.time()
+                rate = float(self.rate_entry.get())
+                if rate <= 0:
+                    raise ValueError
+            except ValueError:
+                self.log("Erreur: Le débit cible doit être un nombre positif")
+                return None
+        try:
+            start_packet = int(self.start_packet_entry.get() or 0)
+            if start_packet < 0:
+                raise ValueError
+        except ValueError:
+            self.log("Erreur: Le paquet de début doit être un entier positif")
+            return None
+        start_time = None
+        if self.start_time_entry.get().strip():
+            try:
+                start_time = float(self.start_time_entry.get())
+            except ValueError:
+                self.log("Erreur: Le début doit être un nombre de secondes")
+                return None
+        vehicles = None
+        if self.vehicles_entry.get().strip():
+            try:
+                vehicles = frozenset(int(v) for v in self.vehicles_entry.get().split(',') if v.strip())
+            except ValueError:
+                self.log("Erreur: Les véhicules doivent être des identifiants séparés par des virgules")
+                return None
+        try:
+            drop = parse_classes(self.drop_entry.get())
+        except ValueError as e:
+            self.log(f"Erreur: {e}")
+            return None
+        return EngineSettings(self.broker_entry.get(), port, self.topic_entry.get(), list(self.files),
+                              mode, self.delay_slider.get(), SPEEDS[self.speed_combo.get()], rate,
+                              workers, self.processes_var.get(), "Producer",
+                              int(self.qos_combo.get()), window,
+                              0, start_packet, start_time, vehicles,
+                              self.routes[self.route_combo.get()], drop)
 
-        for pkt in pcap_packets:
-            self.paused.wait()
-            payload = bytes(pkt)
-            result = client.publish(topic, payload)
-            if result.rc != mqtt.MQTT_ERR_SUCCESS:
-                self.log(f"Erreur lors de l'envoi d'un paquet: {result}")
-            self.sent_packets += 1
-            self.root.after(0, self.progress.step, 1)
-            self.root.after(0, self.update_stats)
-            time.sleep(delay)
-        client.loop_stop()
-        client.disconnect()
-        self.log("Tous les paquets ont été envoyés.")
+    def sending_worker(self, settings):
+        # The replay itself runs in producer_engine, on one or more MQTT connections
+        self.log(f"Envoi vers {settings.broker}:{settings.port} sur le topic '{settings.topic}' "
+                 f"({settings.workers} connexion(s))")
+        self.engine = ProducerEngine(settings, on_progress=self.on_engine_progress,
+                                     on_log=lambda m: self.root.after(0, self.log, m))
+        self.progress["maximum"] = max(self.engine.stats.total_bytes, 1)
+        try:
+            stats = self.engine.run()
+            self.root.after(0, self.log, stats.report())
+            file_number, packet = stats.resume_point()
+            if file_number < len(settings.files):
+                self.resume_point = (file_number, packet)
+                self.root.after(0, self.log, f"Envoi arrêté au paquet {packet} de "
+                                             f"{os.path.basename(settings.files[file_number])}")
+            else:
+                self.resume_point = None
+                self.root.after(0, self.log, "Tous les paquets ont été envoyés.")
+        except Exception as e:
+            self.root.after(0, self.log, f"Erreur lors de l'envoi : {e}")
+        self.engine = None
+        self.root.after(0, self.sending_done)
+
+    def sending_done(self):
         # Re-enable MQTT configuration fields after sending
         self.broker_entry.config(state=tk.NORMAL)
         self.port_entry.config(state=tk.NORMAL)
         self.topic_entry.config(state=tk.NORMAL)
         self.pause_btn.config(state=tk.DISABLED)
         self.resume_btn.config(state=tk.DISABLED)
+        self.stop_btn.config(state=tk.DISABLED)
         self.start_btn.config(state=tk.NORMAL)
+        self.restart_btn.config(state=tk.NORMAL if self.resume_point else tk.DISABLED)
+
+    def restart_sending(self):
+        # Same settings, from the first frame not handled by the stopped run
+        settings = self.read_settings()
+        if settings is None or not self.resume_point:
+            return
+        file_number, packet = self.resume_point
+        self.log(f"Reprise au paquet {packet} de {os.path.basename(self.files[file_number])}")
+        self.start_sending(settings._replace(start_file=file_number, start_packet=packet, start_time=None))
 
-    def start_sending(self):
+    def start_sending(self, settings=None):
         if not self.files:
             messagebox.showerror("Erreur", "Veuillez sélectionner au moins un fichier PCAP.")
             return
+        if settings is None:
+            settings = self.read_settings()
+        if settings is None:
+            return
         self.progress["value"] = 0
         self.sent_packets = 0
         self.total_packets = 0
+        self.engine_stats = None
         self.start_time = time.time()
         # Lock MQTT configuration so changes mid-send are prevented
         self.broker_entry.config(state=tk.DISABLED)
@@ -198,9 +370,10 @@ class ProducerApp:
         self.topic_entry.config(state=tk.DISABLED)
         self.pause_btn.config(state=tk.NORMAL)
         self.resume_btn.config(state=tk.DISABLED)
+        self.stop_btn.config(state=tk.NORMAL)
+        self.restart_btn.config(state=tk.DISABLED)
         self.start_btn.config(state=tk.DISABLED)
-        self.paused.set()
-        self.sending_thread = threading.Thread(target=self.sending_worker, daemon=True)
+        self.sending_thread = threading.Thread(target=self.sending_worker, args=(settings,), daemon=True)
         self.sending_thread.start()
 
 if __name__ == "__main__":
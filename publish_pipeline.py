@@ -0,0 +1,164 @@
+import math
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+# Log-scaled latency buckets: 10 per decade from 10 us to 100 s
+_BUCKETS_PER_DECADE = 10
+_MIN_LATENCY = 1e-5
+_BUCKET_COUNT = 7 * _BUCKETS_PER_DECADE + 1
+
+# Seconds between two checks of the stop event while the window is full
+SLOT_WAIT = 0.1
+
+
+class LatencyHistogram:
+    # Fixed buckets so that the histograms of several workers can be merged
+    # exactly by adding their counts.
+
+    def __init__(self, counts=None):
+        self.counts = list(counts) if counts else [0] * _BUCKET_COUNT
+
+    @staticmethod
+    def upper_bound(index):
+        return _MIN_LATENCY * 10 ** (index / _BUCKETS_PER_DECADE)
+
+    def add(self, seconds):
+        if seconds <= _MIN_LATENCY:
+            index = 0
+        else:
+            index = min(math.ceil(math.log10(seconds / _MIN_LATENCY) * _BUCKETS_PER_DECADE), _BUCKET_COUNT - 1)
+        self.counts[index] += 1
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+
+    @property
+    def total(self):
+        return sum(self.counts)
+
+    def percentile(self, p):
+        total = self.total
+        if not total:
+            return None
+        rank = p / 100 * total
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return self.upper_bound(index)
+        return self.upper_bound(_BUCKET_COUNT - 1)
+
+    def summary(self):
+        if not self.total:
+            return "Latence : -"
+        p50, p90, p99 = (self.percentile(p) * 1000 for p in (50, 90, 99))
+        return f"Latence p50/p90/p99 : {p50:.2f} / {p90:.2f} / {p99:.2f} ms"
+
+
+class PublishPipeline:
+    # Keeps up to `window` messages in flight on one MQTT client. publish()
+    # blocks while the window is full (backpressure) and every completion
+    # reported by on_publish (PUBACK/PUBCOMP for QoS 1/2, written to the
+    # socket for QoS 0) frees a slot and records the publish-to-ack latency.
+    # publish() gives up when `stop` is set, so that a broker that never
+    # acknowledges cannot block the sender for good. paho keeps the messages
+    # in flight across a reconnection and sends them again, they keep their
+    # slots; they only fail once the client is disconnected on purpose (see
+    # abandon).
+
+    def __init__(self, client, qos=0, window=100, stop=None):
+        self.client = client
+        self.qos = qos
+        self.window = window
+        self.stop = stop
+        self.delivered = 0
+        self.failed = 0
+        self.latency = LatencyHistogram()
+        self._slots = threading.Semaphore(window)
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._pending = {}  # mid -> publish time
+        self._early_acks = {}  # mid -> ack time, when on_publish beats publish() returning
+        self._abandoned = set()  # mids failed by the last abandon(), their late acks are ignored
+        client.max_inflight_messages_set(window)
+        client.on_publish = self._on_publish
+        client.on_disconnect = self._on_disconnect
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def publish(self, topic, payload):
+        # False when the message could not be queued, or when stop was set
+        # while waiting for a slot
+        while not self._slots.acquire(timeout=SLOT_WAIT):
+            if self.stop is not None and self.stop.is_set():
+                return False
+        sent_at = time.perf_counter()
+        info = self.client.publish(topic, payload, qos=self.qos)
+        # Not connected: paho queues the message and sends it once reconnected
+        if info.rc not in (mqtt.MQTT_ERR_SUCCESS, mqtt.MQTT_ERR_NO_CONN):
+            with self._lock:
+                self.failed += 1
+            self._slots.release()
+            return False
+        with self._lock:
+            self._abandoned.discard(info.mid)
+            acked_at = self._early_acks.pop(info.mid, None)
+            if acked_at is None:
+                self._pending[info.mid] = sent_at
+            else:
+                self._complete(sent_at, acked_at)
+        return True
+
+    def _on_publish(self, client, userdata, mid):
+        now = time.perf_counter()
+        with self._lock:
+            sent_at = self._pending.pop(mid, None)
+            if sent_at is None:
+                if mid in self._abandoned:
+                    self._abandoned.discard(mid)
+                    return
+                self._early_acks[mid] = now
+            else:
+                self._complete(sent_at, now)
+
+    def _on_disconnect(self, client, userdata, rc):
+        # rc 0: disconnect() was called, nothing will be sent again. Otherwise
+        # the connection was lost and paho reconnects.
+        if rc == mqtt.MQTT_ERR_SUCCESS:
+            self.abandon()
+
+    def abandon(self):
+        # The messages still in flight count as failed and give their slots
+        # back, for a client that will not reconnect
+        with self._lock:
+            count = len(self._pending)
+            if not count:
+                return
+            self._abandoned = set(self._pending)
+            self._pending.clear()
+            self.failed += count
+            self._idle.notify_all()
+        self._slots.release(count)
+
+    def _complete(self, sent_at, acked_at):
+        self.delivered += 1
+        self.latency.add(acked_at - sent_at)
+        self._slots.release()
+        if not self._pending:
+            self._idle.notify_all()
+
+    def drain(self, timeout):
+        # Waits for the in-flight messages (not past a stop), returns how
+        # many are still pending
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while self._pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or (self.stop is not None and self.stop.is_set()):
+                    break
+                self._idle.wait(min(remaining, SLOT_WAIT))
+            return len(self._pending)
@@ -0,0 +1,133 @@
+import time
+
+MODE_DELAY = 'delay'      # fixed delay between two packets
+MODE_CAPTURE = 'capture'  # capture timestamps, scaled by a speed factor
+MODE_RATE = 'rate'        # constant target rate in messages per second
+
+# Speed factors offered for capture replay, None replays as fast as possible
+SPEEDS = {'0.5x': 0.5, '1x': 1.0, '2x': 2.0, '10x': 10.0, 'max': None}
+
+
+class ReplayScheduler:
+    # Every packet gets an absolute deadline from the start of the replay,
+    # so the time spent publishing (or oversleeping) is caught up on the
+    # next packets instead of accumulating like consecutive sleeps would.
+
+    def __init__(self, mode=MODE_DELAY, delay=0.0, speed=1.0, rate=None):
+        if mode == MODE_RATE and not (rate and rate > 0):
+            raise ValueError("A positive target rate is required in rate mode")
+        self.mode = mode
+        self.delay = delay
+        self.speed = speed
+        self.rate = rate
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.position = 0
+        self.offset_position = 0
+        self.start = None
+        self.first = None  # time of the first packet
+        self.last = None
+        self.offset = 0.0
+        self.capture_elapsed = 0.0
+        self.last_capture_ts = None
+        self.scheduled = 0
+        self.jitter_sum = 0.0
+        self.jitter_max = 0.0
+        self.paused_time = 0.0
+
+    def new_stream(self):
+        # Capture timestamps restart with every file, the first packet of
+        # the next file is sent right after the last one of the previous.
+        self.last_capture_ts = None
+
+    def begin(self, wall_time=None):
+        # Several schedulers sharing one capture (one per worker) must start
+        # from the same instant, given as a time.time() value.
+        now = time.perf_counter()
+        self.start = now if wall_time is None else now + (wall_time - time.time())
+
+    def skip(self, capture_ts=None):
+        # Frame handled by another worker: it keeps its place in the schedule
+        self.position += 1
+        if self.mode == MODE_CAPTURE:
+            self._advance_capture(capture_ts)
+
+    def shift(self, seconds):
+        # Pauses move the whole schedule instead of causing a catch-up burst
+        if self.start is not None:
+            self.start += seconds
+            self.paused_time += seconds
+        if self.first is not None:
+            self.first += seconds
+
+    def wait(self, capture_ts=None):
+        now = time.perf_counter()
+        if self.start is None:
+            self.start = now
+        self.offset = self._next_offset(capture_ts)
+        self.position += 1
+        self.offset_position = self.position
+        self.count += 1
+        self.last = now
+        if self.offset is None:
+            if self.first is None:
+                self.first = now
+            return
+        deadline = self.start + self.offset
+        if deadline > now:
+            time.sleep(deadline - now)
+            now = self.last = time.perf_counter()
+        if self.first is None:
+            self.first = now
+        late = now - deadline
+        self.scheduled += 1
+        self.jitter_sum += late
+        if late > self.jitter_max:
+            self.jitter_max = late
+
+    def _next_offset(self, capture_ts):
+        if self.mode == MODE_RATE:
+            return self.position / self.rate
+        if self.mode == MODE_CAPTURE:
+            if self.speed is None:
+                return None
+            self._advance_capture(capture_ts)
+            return self.capture_elapsed / self.speed
+        if not self.delay:
+            return None
+        return self.position * self.delay
+
+    def _advance_capture(self, capture_ts):
+        if capture_ts is None:
+            return
+        if self.last_capture_ts is not None and capture_ts > self.last_capture_ts:
+            self.capture_elapsed += capture_ts - self.last_capture_ts
+        self.last_capture_ts = capture_ts
+
+    def achieved_rate(self):
+        # count packets are count - 1 intervals from the first to the last
+        if self.first is None or self.count < 2:
+            return 0.0
+        elapsed = self.last - self.first
+        return (self.count - 1) / elapsed if elapsed > 0 else 0.0
+
+    def target_rate(self):
+        # None when there is no target (as fast as possible)
+        if self.mode == MODE_RATE:
+            return self.rate
+        if self.offset is None:
+            return None
+        if self.offset_position < 2 or self.offset <= 0:
+            return 0.0
+        return (self.offset_position - 1) / self.offset
+
+    def mean_jitter(self):
+        return self.jitter_sum / self.scheduled if self.scheduled else 0.0
+
+    def summary(self):
+        target = self.target_rate()
+        target = "max" if target is None else f"{target:.1f}"
+        return (f"Débit : {self.achieved_rate():.1f} / {target} msg/s | "
+                f"Gigue : moy {self.mean_jitter() * 1000:.2f} ms, max {self.jitter_max * 1000:.2f} ms")
@@ -0,0 +1,59 @@
+import math
+
+
+class GridIndex:
+    # Uniform lat/lon grid of the current vehicle positions, cell_size in
+    # degrees. Queries visit the cells overlapping the box, or scan all the
+    # positions when the box covers more cells than there are vehicles.
+
+    def __init__(self, cell_size=0.01):
+        self.cell_size = cell_size
+        self._positions = {}  # vehicle_id -> (lat, lon, cell)
+        self._cells = {}      # cell -> set of vehicle ids
+
+    def __len__(self):
+        return len(self._positions)
+
+    def _cell(self, latitude, longitude):
+        return (math.floor(latitude / self.cell_size), math.floor(longitude / self.cell_size))
+
+    def update(self, vehicle_id, latitude, longitude):
+        cell = self._cell(latitude, longitude)
+        previous = self._positions.get(vehicle_id)
+        if previous is not None and previous[2] != cell:
+            self._discard(vehicle_id, previous[2])
+        if previous is None or previous[2] != cell:
+            self._cells.setdefault(cell, set()).add(vehicle_id)
+        self._positions[vehicle_id] = (latitude, longitude, cell)
+
+    def remove(self, vehicle_id):
+        previous = self._positions.pop(vehicle_id, None)
+        if previous is not None:
+            self._discard(vehicle_id, previous[2])
+
+    def _discard(self, vehicle_id, cell):
+        members = self._cells.get(cell)
+        if members is not None:
+            members.discard(vehicle_id)
+            if not members:
+                del self._cells[cell]
+
+    def query(self, south, west, north, east):
+        min_row, min_col = self._cell(south, west)
+        max_row, max_col = self._cell(north, east)
+        cells = (max_row - min_row + 1) * (max_col - min_col + 1)
+        if cells > len(self._positions):
+            candidates = self._positions
+        else:
+            candidates = set()
+            for row in range(min_row, max_row + 1):
+                for col in range(min_col, max_col + 1):
+                    members = self._cells.get((row, col))
+                    if members:
+                        candidates.update(members)
+        result = set()
+        for vehicle_id in candidates:
+            latitude, longitude, _ = self._positions[vehicle_id]
+            if south <= latitude <= north and west <= longitude <= east:
+                result.add(vehicle_id)
+        return result
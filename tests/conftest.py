@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the top of the repository, as for the benchmarks
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+CAPTURES = {
+    'ieee802_11': 'v2v-EVA-2-0.pcap',
+    'ethernet': 'etsi-its-cam-unsecured.pcapng',
+    'secured': 'etsi-its-cam-secured.pcapng',
+}
+
+
+@pytest.fixture(params=sorted(CAPTURES))
+def capture(request):
+    return os.path.join(ROOT, CAPTURES[request.param])
@@ -0,0 +1,95 @@
+import os
+import struct
+
+import pytest
+
+import cam_decoder
+from cam_batch import decode_payloads
+from cam_decoder import (CamRecord, cam_layout, decode_binary, decode_payload, decode_text, format_record,
+                         is_text_payload)
+from frame_classifier import KIND_CAM, classify, geonetworking_headers, geonetworking_offset
+from pcap_reader import LINKTYPE_ETHERNET, LINKTYPE_IEEE802_11, iter_frames
+
+from conftest import CAPTURES, ROOT
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    cam_decoder._LAYOUTS.clear()
+    yield
+    cam_decoder._LAYOUTS.clear()
+
+
+def _frames(path):
+    return [(bytes(frame.data), frame.linktype) for frame in iter_frames(path)]
+
+
+def _reference(frame, linktype):
+    # CAM fields found by the full header walk of frame_classifier
+    classification = classify(frame, linktype)
+    if classification.kind != KIND_CAM:
+        return None
+    headers = geonetworking_headers(frame, geonetworking_offset(frame, linktype))
+    if len(frame) < headers.btp + 10 or frame[headers.btp + 5] != 2:
+        return None
+    position = headers.extended + (0 if (headers.header_type, headers.subtype) in ((5, 0), (1, 0)) else 4)
+    timestamp, latitude, longitude, speed, heading = struct.unpack_from('>IiiHH', frame, position + 8)
+    return (classification.station, timestamp, latitude / 1e7, longitude / 1e7, speed / 100.0, heading / 10)
+
+
+def test_captures_have_the_expected_link_layers():
+    assert {linktype for _, linktype in _frames(os.path.join(ROOT, CAPTURES['ieee802_11']))} == {LINKTYPE_IEEE802_11}
+    for name in ('ethernet', 'secured'):
+        assert {linktype for _, linktype in _frames(os.path.join(ROOT, CAPTURES[name]))} == {LINKTYPE_ETHERNET}
+
+
+def test_layout_matches_the_header_walk(capture):
+    frames = _frames(capture)
+    cams = 0
+    for frame, linktype in frames:
+        record = decode_binary(frame)
+        assert (tuple(record) if record else None) == _reference(frame, linktype)
+        cams += record is not None
+    assert cams
+    # One layout per kind of headers, not per frame
+    assert 0 < len(cam_decoder._LAYOUTS) <= 4
+
+
+def test_truncated_frames(capture):
+    for frame, linktype in _frames(capture)[:50]:
+        for cut in range(0, len(frame), 7):
+            record = decode_binary(frame[:cut])
+            assert (tuple(record) if record else None) == _reference(frame[:cut], linktype)
+
+
+def test_batch_decoder_matches_frame_decoder(capture):
+    payloads = [frame for frame, _ in _frames(capture)]
+    records, decoded = decode_payloads(payloads)
+    expected = [(decode_binary(p), p) for p in payloads if decode_binary(p) is not None]
+    assert records == [record for record, _ in expected]
+    assert decoded == [payload for _, payload in expected]
+
+
+@pytest.mark.parametrize('frame', [
+    b'',
+    b'\x00' * 13,
+    bytes(range(256)) * 2,
+    b'\xff' * 200,
+    # Ethernet frame of another ethertype (IPv4)
+    b'\xff' * 12 + b'\x08\x00' + b'\x45' * 100,
+    # 802.11 management frame (beacon)
+    b'\x80\x00' + b'\x00' * 120,
+])
+def test_junk_is_not_a_cam_and_is_not_cached(frame):
+    assert cam_layout(frame) is None
+    assert not cam_decoder._LAYOUTS
+
+
+def test_text_payloads():
+    record = CamRecord('car-7', None, 45.5, 7.25, 12.5, 90.0)
+    payload = format_record(record).encode()
+    assert is_text_payload(payload)
+    assert decode_text(payload) == record
+    assert decode_payload(payload) == record
+    assert decode_text(b"Vehicle ID: car-7\nLatitude: 45.5") is None
+    assert not is_text_payload(b'\x00\xff')
@@ -0,0 +1,147 @@
+import os
+import random
+import sys
+import threading
+
+import pytest
+
+from cam_log import INDEX_SUFFIX, SEGMENT_SUFFIX, CamLog, vehicle_key
+
+SEGMENT_RECORDS = 500
+
+
+def _records(count, vehicles=20, seed=1):
+    # Vehicle 7's timestamps do not arrive in order
+    rng = random.Random(seed)
+    clock = {vehicle: 1000 * vehicle for vehicle in range(vehicles)}
+    records = []
+    for _ in range(count):
+        vehicle = rng.randrange(vehicles)
+        clock[vehicle] += rng.randint(50, 150)
+        timestamp = clock[vehicle] - (rng.randint(0, 400) if vehicle == 7 else 0)
+        records.append((vehicle, timestamp, 45 + rng.random() / 10, 7 + rng.random() / 10,
+                        rng.random() * 30, rng.random() * 360))
+    return records
+
+
+def _fill(log, records):
+    for i in range(0, len(records), 32):
+        log.append(records[i:i + 32])
+
+
+@pytest.fixture
+def records():
+    return _records(6100)
+
+
+@pytest.fixture
+def log(tmp_path, records):
+    log = CamLog(str(tmp_path), SEGMENT_RECORDS)
+    _fill(log, records)
+    yield log
+    log.close()
+
+
+def _check_queries(log, records):
+    for vehicle in (1, 7, 19):
+        start, end = 20000, 300000
+        expected = sorted(r[1] for r in records if r[0] == vehicle and start <= r[1] <= end)
+        assert sorted(r.timestamp for r in log.track(vehicle, start, end)) == expected
+    at = 200000
+    expected = {}
+    for vehicle, timestamp, *_ in records:
+        if timestamp <= at:
+            expected[vehicle] = max(expected.get(vehicle, timestamp), timestamp)
+    assert {r.vehicle_id: r.timestamp for r in log.snapshot(at)} == expected
+    expected = sorted(r[1] for r in records if 100000 <= r[1] <= 120000)
+    assert sorted(r.timestamp for r in log.between(100000, 120000)) == expected
+
+
+def test_rotation(log, tmp_path):
+    stats = log.stats()
+    assert stats['records'] == 6100
+    # A segment is closed when a record does not fit in it any more
+    assert stats['segments'] == 6100 // SEGMENT_RECORDS + 1
+    # Closed segments have their index
+    names = os.listdir(str(tmp_path))
+    assert sum(name.endswith(SEGMENT_SUFFIX) for name in names) == stats['segments']
+    assert sum(name.endswith(INDEX_SUFFIX) for name in names) == stats['segments'] - 1
+
+
+def test_queries(log, records):
+    _check_queries(log, records)
+
+
+def test_record_values(log, records):
+    vehicle, timestamp, latitude, longitude, speed, heading = records[0]
+    point = next(p for p in log.track(vehicle) if p.timestamp == timestamp)
+    assert point.vehicle_id == vehicle_key(vehicle)
+    assert point.latitude == pytest.approx(latitude, abs=1e-7)
+    assert point.longitude == pytest.approx(longitude, abs=1e-7)
+    assert point.speed == pytest.approx(speed, abs=0.01)
+    assert point.heading == pytest.approx(heading, abs=0.1)
+
+
+def test_limits(log):
+    assert len(log.track(1, limit=5)) == 5
+    assert len(log.between(limit=10)) == 10
+
+
+def test_reopen_and_rebuild_index(log, records, tmp_path):
+    log.close()
+    reopened = CamLog(str(tmp_path), SEGMENT_RECORDS)
+    _check_queries(reopened, records)
+    reopened.close()
+    os.remove(os.path.join(str(tmp_path), f"{3:08d}{INDEX_SUFFIX}"))
+    rebuilt = CamLog(str(tmp_path), SEGMENT_RECORDS)
+    _check_queries(rebuilt, records)
+    rebuilt.close()
+
+
+def test_retention(tmp_path, records):
+    log = CamLog(str(tmp_path), SEGMENT_RECORDS, max_segments=3)
+    _fill(log, records)
+    stats = log.stats()
+    # The closed segments kept plus the active one
+    assert stats['segments'] == 4
+    assert stats['records'] == 3 * SEGMENT_RECORDS + 100
+    assert sum(name.endswith(SEGMENT_SUFFIX) for name in os.listdir(str(tmp_path))) == 4
+    kept = records[-(3 * SEGMENT_RECORDS + 100):]
+    assert sorted(r.timestamp for r in log.between()) == sorted(r[1] for r in kept)
+    log.close()
+
+
+def test_text_vehicle_ids(tmp_path):
+    log = CamLog(str(tmp_path), SEGMENT_RECORDS)
+    log.append([('abc', 1000, 45.0, 7.0, 10.0, 90.0), ('42', 1001, 45.0, 7.0, 10.0, 90.0)])
+    assert [p.timestamp for p in log.track('abc')] == [1000]
+    assert [p.timestamp for p in log.track(42)] == [1001]
+    log.close()
+
+
+def test_queries_while_appending(tmp_path):
+    log = CamLog(str(tmp_path), 5000, max_segments=3)
+    stop = threading.Event()
+
+    def writer():
+        timestamp = 0
+        while not stop.is_set():
+            log.append([(i % 200, timestamp + i, 45.0, 7.0, 10.0, 90.0) for i in range(50)])
+            timestamp += 50
+
+    # Frequent thread switches, so that appends land in the middle of queries
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        for i in range(200):
+            for point in log.track(i % 200):
+                assert point.vehicle_id == i % 200
+            log.snapshot(10 ** 9)
+            log.between(0, 10 ** 9, limit=100)
+    finally:
+        stop.set()
+        thread.join()
+        sys.setswitchinterval(interval)
+        log.close()
@@ -0,0 +1,82 @@
+import threading
+import time
+
+import pytest
+
+from ingest_queue import POLICY_BLOCK, POLICY_DROP_NEWEST, POLICY_DROP_OLDEST, IngestQueue
+
+
+def test_batch_waits_for_max_items_or_max_wait():
+    queue = IngestQueue()
+    for i in range(5):
+        queue.put(i)
+    assert queue.get_batch(3, 1.0) == [0, 1, 2]
+    start = time.monotonic()
+    assert queue.get_batch(10, 0.05) == [3, 4]
+    assert time.monotonic() - start < 1.0
+    stats = queue.stats()
+    assert stats['enqueued'] == stats['dequeued'] == 5
+    assert stats['depth'] == 0
+
+
+@pytest.mark.parametrize('policy, kept, accepted', [
+    (POLICY_DROP_OLDEST, [2, 3, 4], False),
+    (POLICY_DROP_NEWEST, [0, 1, 2], False),
+])
+def test_overflow_policies(policy, kept, accepted):
+    queue = IngestQueue(3, policy)
+    results = [queue.put(i) for i in range(5)]
+    assert results[:3] == [True] * 3
+    assert results[-1] is accepted
+    assert queue.stats()['dropped'] == 2
+    assert queue.get_batch(10, 0) == kept
+
+
+def test_block_policy_waits_for_room():
+    queue = IngestQueue(1, POLICY_BLOCK)
+    queue.put(0)
+    putter = threading.Thread(target=queue.put, args=(1,))
+    putter.start()
+    putter.join(0.1)
+    assert putter.is_alive()
+    assert queue.get_batch(1, 0) == [0]
+    putter.join(1.0)
+    assert queue.get_batch(1, 0) == [1]
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        IngestQueue(policy='spill')
+
+
+def test_competing_consumers_never_get_an_empty_batch():
+    # Workers waiting out max_wait while another one empties the queue
+    queue = IngestQueue(100000)
+    received = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker():
+        try:
+            while True:
+                batch = queue.get_batch(32, 0.02)
+                assert batch
+                with lock:
+                    received.extend(batch)
+        except Exception as e:
+            errors.append(e)
+
+    workers = [threading.Thread(target=worker, daemon=True) for _ in range(4)]
+    for thread in workers:
+        thread.start()
+    for i in range(5000):
+        queue.put(i)
+        if i % 50 == 0:
+            time.sleep(0.001)
+    deadline = time.monotonic() + 5
+    while len(received) < 5000 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not errors
+    assert sorted(received) == list(range(5000))
+    # All still waiting for the next batch (daemon threads)
+    assert all(thread.is_alive() for thread in workers)
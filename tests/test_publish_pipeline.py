@@ -0,0 +1,129 @@
+import threading
+from collections import namedtuple
+
+import paho.mqtt.client as mqtt
+import pytest
+
+from publish_pipeline import LatencyHistogram, PublishPipeline
+
+Info = namedtuple('Info', ['rc', 'mid'])
+
+
+class FakeClient:
+    # Records the published mids; acks are sent by the test (or right away
+    # with ack_now, before publish() returns as paho does for QoS 0)
+    def __init__(self, rc=mqtt.MQTT_ERR_SUCCESS, ack_now=False):
+        self.rc = rc
+        self.ack_now = ack_now
+        self.mids = []
+        self.on_publish = None
+        self.on_disconnect = None
+
+    def max_inflight_messages_set(self, window):
+        self.window = window
+
+    def publish(self, topic, payload, qos=0):
+        mid = len(self.mids) + 1
+        self.mids.append(mid)
+        if self.ack_now:
+            self.on_publish(self, None, mid)
+        return Info(self.rc, mid)
+
+    def ack(self, mid):
+        self.on_publish(self, None, mid)
+
+
+def test_window_blocks_until_acked():
+    client = FakeClient()
+    pipeline = PublishPipeline(client, qos=1, window=2)
+    assert pipeline.publish('t', b'1') and pipeline.publish('t', b'2')
+    blocked = threading.Thread(target=pipeline.publish, args=('t', b'3'))
+    blocked.start()
+    blocked.join(0.2)
+    assert blocked.is_alive()
+    client.ack(1)
+    blocked.join(1.0)
+    assert not blocked.is_alive()
+    assert pipeline.pending == 2
+    client.ack(2)
+    client.ack(3)
+    assert pipeline.drain(1.0) == 0
+    assert pipeline.delivered == 3
+    assert pipeline.latency.total == 3
+
+
+def test_ack_before_publish_returns():
+    pipeline = PublishPipeline(FakeClient(ack_now=True), window=1)
+    for _ in range(5):
+        assert pipeline.publish('t', b'x')
+    assert pipeline.delivered == 5
+    assert pipeline.pending == 0
+
+
+def test_stop_while_the_window_is_full():
+    stop = threading.Event()
+    pipeline = PublishPipeline(FakeClient(), qos=1, window=1, stop=stop)
+    assert pipeline.publish('t', b'1')
+    stop.set()
+    assert not pipeline.publish('t', b'2')
+    assert pipeline.drain(10.0) == 1
+
+
+def test_lost_connection_keeps_the_messages_in_flight():
+    # paho sends them again once reconnected
+    client = FakeClient()
+    pipeline = PublishPipeline(client, qos=1, window=2)
+    pipeline.publish('t', b'1')
+    pipeline.publish('t', b'2')
+    client.on_disconnect(client, None, mqtt.MQTT_ERR_CONN_LOST)
+    assert pipeline.pending == 2
+    assert pipeline.failed == 0
+    client.ack(1)
+    client.ack(2)
+    assert pipeline.delivered == 2
+    assert pipeline.pending == 0
+
+
+def test_requested_disconnect_fails_the_messages_in_flight():
+    client = FakeClient()
+    pipeline = PublishPipeline(client, qos=1, window=2)
+    pipeline.publish('t', b'1')
+    pipeline.publish('t', b'2')
+    client.on_disconnect(client, None, mqtt.MQTT_ERR_SUCCESS)
+    assert pipeline.pending == 0
+    assert pipeline.failed == 2
+    # Slots given back, late acks ignored
+    assert pipeline.publish('t', b'3')
+    client.ack(1)
+    assert pipeline.delivered == 0
+    pipeline.abandon()
+    assert pipeline.failed == 3
+
+
+def test_publish_errors():
+    pipeline = PublishPipeline(FakeClient(rc=mqtt.MQTT_ERR_QUEUE_SIZE), qos=1, window=1)
+    assert not pipeline.publish('t', b'1')
+    assert not pipeline.publish('t', b'2')
+    assert pipeline.failed == 2
+
+
+def test_not_connected_is_still_pending():
+    # paho queues the message until the connection is back
+    client = FakeClient(rc=mqtt.MQTT_ERR_NO_CONN)
+    pipeline = PublishPipeline(client, qos=1, window=2)
+    assert pipeline.publish('t', b'1')
+    assert pipeline.pending == 1
+    client.ack(1)
+    assert pipeline.delivered == 1
+
+
+def test_latency_histograms_merge():
+    first, second = LatencyHistogram(), LatencyHistogram()
+    for seconds in (0.001, 0.002, 0.003):
+        first.add(seconds)
+    second.add(1.0)
+    first.merge(second)
+    assert first.total == 4
+    assert first.percentile(50) == pytest.approx(0.002, rel=0.3)
+    assert first.percentile(100) == pytest.approx(1.0, rel=0.3)
+    assert LatencyHistogram().percentile(50) is None
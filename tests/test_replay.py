@@ -0,0 +1,66 @@
+import pytest
+
+from replay import MODE_CAPTURE, MODE_DELAY, MODE_RATE, ReplayScheduler
+
+
+def test_rate_mode_needs_a_rate():
+    with pytest.raises(ValueError):
+        ReplayScheduler(MODE_RATE)
+
+
+def test_rate_mode_reaches_the_target():
+    scheduler = ReplayScheduler(MODE_RATE, rate=500)
+    for _ in range(51):
+        scheduler.wait()
+    # 51 packets are 50 intervals of 2 ms
+    assert scheduler.target_rate() == 500
+    assert scheduler.achieved_rate() == pytest.approx(500, rel=0.1)
+
+
+def test_skipped_frames_keep_their_place():
+    # Two workers sharing a capture: each one waits for every other frame
+    scheduler = ReplayScheduler(MODE_RATE, rate=1000)
+    for _ in range(20):
+        scheduler.wait()
+        scheduler.skip()
+    assert scheduler.position == 40
+    assert scheduler.achieved_rate() == pytest.approx(500, rel=0.1)
+
+
+def test_capture_timestamps_are_scaled():
+    scheduler = ReplayScheduler(MODE_CAPTURE, speed=2.0)
+    for i in range(11):
+        scheduler.wait(100.0 + i * 0.01)
+    # 10 intervals of 10 ms replayed in 50 ms
+    assert scheduler.offset == pytest.approx(0.05)
+    assert scheduler.target_rate() == pytest.approx(200)
+    assert scheduler.achieved_rate() == pytest.approx(200, rel=0.15)
+
+
+def test_new_stream_does_not_wait_for_the_gap():
+    scheduler = ReplayScheduler(MODE_CAPTURE, speed=1.0)
+    scheduler.wait(100.0)
+    scheduler.new_stream()
+    scheduler.wait(5000.0)
+    assert scheduler.capture_elapsed == 0.0
+
+
+def test_as_fast_as_possible():
+    scheduler = ReplayScheduler(MODE_DELAY)
+    assert scheduler.achieved_rate() == 0.0
+    scheduler.wait()
+    assert scheduler.achieved_rate() == 0.0
+    scheduler.wait()
+    assert scheduler.target_rate() is None
+    assert scheduler.scheduled == 0
+    assert "max" in scheduler.summary()
+
+
+def test_shift_moves_the_schedule():
+    scheduler = ReplayScheduler(MODE_DELAY, delay=0.001)
+    scheduler.wait()
+    first, start = scheduler.first, scheduler.start
+    scheduler.shift(1.0)
+    assert scheduler.first == first + 1.0
+    assert scheduler.start == start + 1.0
+    assert scheduler.paused_time == 1.0
@@ -0,0 +1,72 @@
+import struct
+
+import pytest
+
+from wire_format import HEADER_SIZE, MAX_IDS, UPDATE_RECORD_SIZE, IdDictionary, decode_updates, encode_updates
+
+
+def _updates(count):
+    return [{
+        'vehicle_id': f'vehicle-{i}',
+        'latitude': 45.0531766 + i * 1e-5,
+        'longitude': -7.6578907 - i * 1e-5,
+        'speed': 13.5,
+        'heading': 270.25,
+        'timestamp': 1700000000000.0 + i,
+        'elapsed': 125.0 * i,
+    } for i in range(count)]
+
+
+def _ids(dictionary):
+    return {index: vehicle_id for vehicle_id, index in dictionary.ids.items()}
+
+
+@pytest.mark.parametrize('count', [0, 1, 7, 300])
+def test_round_trip(count):
+    dictionary = IdDictionary()
+    updates = _updates(count)
+    payload = encode_updates(updates, dictionary)
+    assert len(payload) == HEADER_SIZE + count * UPDATE_RECORD_SIZE
+    decoded = decode_updates(payload, _ids(dictionary))
+    assert len(decoded) == count
+    for update, result in zip(updates, decoded):
+        assert result['vehicle_id'] == update['vehicle_id']
+        assert result['latitude'] == pytest.approx(update['latitude'], abs=1e-7)
+        assert result['longitude'] == pytest.approx(update['longitude'], abs=1e-7)
+        assert result['speed'] == pytest.approx(update['speed'])
+        assert result['heading'] == pytest.approx(update['heading'])
+        assert result['timestamp'] == update['timestamp']
+        assert result['elapsed'] == update['elapsed']
+
+
+@pytest.mark.parametrize('payload', [b'', b'\x01\x00', struct.pack('<2I', 2, 0), struct.pack('<2I', 10 ** 9, 0)])
+def test_bad_sizes_raise_value_error(payload):
+    with pytest.raises(ValueError):
+        decode_updates(payload, {})
+
+
+def test_truncated_payload():
+    dictionary = IdDictionary()
+    payload = encode_updates(_updates(3), dictionary)
+    with pytest.raises(ValueError):
+        decode_updates(payload[:-1], _ids(dictionary))
+
+
+def test_dictionary_announces_new_ids_once():
+    dictionary = IdDictionary()
+    assert [dictionary.index(v) for v in ('a', 'b', 'a')] == [0, 1, 0]
+    assert dictionary.announce() == ([[0, 'a'], [1, 'b']], False)
+    dictionary.index('c')
+    assert dictionary.announce() == ([[2, 'c']], False)
+    assert dictionary.announce() == ([], False)
+
+
+def test_dictionary_reset_when_full():
+    dictionary = IdDictionary(max_ids=2)
+    dictionary.index('a')
+    dictionary.index('b')
+    dictionary.clear_if_full()
+    assert len(dictionary) == 0
+    assert dictionary.index('c') == 0
+    assert dictionary.announce() == ([[0, 'c']], True)
+    assert IdDictionary().max_ids == MAX_IDS
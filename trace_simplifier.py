@@ -0,0 +1,83 @@
+import math
+
+# (minimum map zoom, tolerance in meters) from the finest level to the coarsest
+TRACE_LEVELS = ((17, 1.0), (14, 5.0), (11, 20.0), (0, 100.0))
+
+_METERS_PER_DEGREE = 111320.0
+
+
+def level_for_zoom(zoom, levels=TRACE_LEVELS):
+    for level, (min_zoom, _) in enumerate(levels):
+        if zoom >= min_zoom:
+            return level
+    return len(levels) - 1
+
+
+def _segment_distance(point, start, end):
+    # Distance in meters from point to the segment [start, end], on a local
+    # equirectangular projection (fine at the scale of a trace segment)
+    scale = math.cos(math.radians(start[0]))
+    px, py = (point[1] - start[1]) * scale, point[0] - start[0]
+    ex, ey = (end[1] - start[1]) * scale, end[0] - start[0]
+    length = ex * ex + ey * ey
+    if length == 0:
+        return math.hypot(px, py) * _METERS_PER_DEGREE
+    t = max(0.0, min(1.0, (px * ex + py * ey) / length))
+    return math.hypot(px - t * ex, py - t * ey) * _METERS_PER_DEGREE
+
+
+class StreamSimplifier:
+    # Streaming line simplification (opening window): a point is kept once
+    # the segment from the last kept point can no longer cover every point
+    # seen since within `tolerance` meters. Every dropped point is therefore
+    # within `tolerance` of the simplified line. The window is capped at
+    # max_window points to bound the work per point.
+    #
+    # Points are tuples whose items `lat_index` and `lat_index + 1` are the
+    # latitude and longitude.
+
+    def __init__(self, tolerance, lat_index=0, max_window=64):
+        self.tolerance = tolerance
+        self.lat_index = lat_index
+        self.max_window = max_window
+        self.anchor = None
+        self.window = []
+        self.window_error = 0.0
+        self.points_in = 0
+        self.points_out = 0
+        self.max_error = 0.0
+
+    def _position(self, point):
+        return point[self.lat_index], point[self.lat_index + 1]
+
+    def add(self, point):
+        # Returns the points that became part of the simplified line
+        self.points_in += 1
+        if self.anchor is None:
+            self.anchor = point
+            self.points_out += 1
+            return [point]
+        if self.window and len(self.window) < self.max_window:
+            start = self._position(self.anchor)
+            end = self._position(point)
+            error = 0.0
+            for candidate in self.window:
+                error = max(error, _segment_distance(self._position(candidate), start, end))
+                if error > self.tolerance:
+                    break
+            if error <= self.tolerance:
+                self.window.append(point)
+                self.window_error = error
+                return []
+        elif not self.window:
+            self.window.append(point)
+            self.window_error = 0.0
+            return []
+        # The last point of the window becomes the new anchor
+        kept = self.window[-1]
+        self.max_error = max(self.max_error, self.window_error)
+        self.anchor = kept
+        self.window = [point]
+        self.window_error = 0.0
+        self.points_out += 1
+        return [kept]
@@ -0,0 +1,306 @@
+import threading
+import time
+from array import array
+from collections import deque
+from itertools import islice
+
+from trace_simplifier import TRACE_LEVELS, StreamSimplifier
+
+# Per-point columns: name -> array typecode
+_COLUMNS = (
+    ('received', 'd'),   # reception time (time.time()), used for age eviction
+    ('timestamp', 'q'),  # vehicle timestamp (ms)
+    ('latitude', 'd'),
+    ('longitude', 'd'),
+    ('speed', 'f'),
+    ('heading', 'f'),
+)
+POINT_SIZE = sum(array(code).itemsize for _, code in _COLUMNS)
+
+
+class VehicleTrack:
+    # Ring buffer of the last `capacity` points of one vehicle, one array per
+    # column. The arrays grow up to capacity, then the oldest point is
+    # overwritten.
+    #
+    # Only the points kept by the finest trace level are stored in the ring,
+    # `tail` is the latest raw point. The coarser levels keep their points
+    # in deques of at most `capacity` tuples. `kept[level]` counts the points
+    # kept so far by each level, readers use it as a sequence number.
+
+    __slots__ = ('capacity', 'start', 'size', 'last_seen', 'columns',
+                 'tail', 'simplifiers', 'levels', 'kept')
+
+    def __init__(self, capacity, tolerances=()):
+        self.capacity = capacity
+        self.start = 0
+        self.size = 0
+        self.last_seen = 0.0
+        self.columns = [array(code) for _, code in _COLUMNS]
+        self.tail = None
+        self.simplifiers = [StreamSimplifier(tolerance, lat_index=2) for tolerance in tolerances]
+        self.levels = [None] + [deque(maxlen=capacity) for _ in tolerances[1:]]
+        self.kept = [0] * len(tolerances)
+
+    def append(self, point):
+        length = len(self.columns[0])
+        if self.size < length:
+            index = (self.start + self.size) % length
+            for column, value in zip(self.columns, point):
+                column[index] = value
+            self.size += 1
+        elif length < self.capacity:
+            if self.start:
+                self._compact()
+            for column, value in zip(self.columns, point):
+                column.append(value)
+            self.size += 1
+        else:
+            for column, value in zip(self.columns, point):
+                column[self.start] = value
+            self.start = (self.start + 1) % length
+
+    def add(self, point):
+        # Feeds the raw point to the finest level, the points it keeps to the
+        # next one and so on. Returns the number of evicted ring points.
+        self.tail = point
+        self.last_seen = point[0]
+        if not self.simplifiers:
+            evicted = self.size == self.capacity
+            self.append(point)
+            return evicted
+        evicted = 0
+        kept = [point]
+        for level, simplifier in enumerate(self.simplifiers):
+            kept = [p for candidate in kept for p in simplifier.add(candidate)]
+            if not kept:
+                break
+            self.kept[level] += len(kept)
+            if level:
+                self.levels[level].extend(kept)
+            else:
+                for p in kept:
+                    evicted += self.size == self.capacity
+                    self.append(p)
+        return evicted
+
+    def evict_before(self, received):
+        # Points are stored in reception order, the oldest are at the start
+        received_column = self.columns[0]
+        length = len(received_column)
+        evicted = 0
+        while self.size and received_column[self.start] < received:
+            self.start = (self.start + 1) % length
+            self.size -= 1
+            evicted += 1
+        if not self.size:
+            self.start = 0
+            for column in self.columns:
+                del column[:]
+        for points in self.levels[1:]:
+            while points and points[0][0] < received:
+                points.popleft()
+        return evicted
+
+    def _compact(self):
+        for i, column in enumerate(self.columns):
+            self.columns[i] = column[self.start:] + column[:self.start]
+        self.start = 0
+
+    def _indices(self):
+        length = len(self.columns[0])
+        return ((self.start + i) % length for i in range(self.size))
+
+    def _last(self):
+        index = (self.start + self.size - 1) % len(self.columns[0])
+        return tuple(column[index] for column in self.columns)
+
+    def points(self):
+        # Stored points, ending with the latest raw point
+        points = [tuple(column[i] for column in self.columns) for i in self._indices()]
+        if self.tail is not None and (not points or points[-1] != self.tail):
+            points.append(self.tail)
+        return points
+
+    def latlngs(self):
+        latitude, longitude = self.columns[2], self.columns[3]
+        latlngs = [[latitude[i], longitude[i]] for i in self._indices()]
+        if self.tail is not None and (not self.size or self._last() != self.tail):
+            latlngs.append([self.tail[2], self.tail[3]])
+        return latlngs
+
+    def oldest_seq(self, level):
+        # Sequence number of the oldest point still stored for a level
+        return self.kept[level] - (len(self.levels[level]) if level else self.size)
+
+    def trace(self, level, first, last):
+        # [[lat, lon, timestamp], ...] of the stored points kept by a level
+        # with a sequence number in [first, last)
+        oldest = self.oldest_seq(level)
+        first = max(first, oldest) - oldest
+        last = min(last, self.kept[level]) - oldest
+        if first >= last:
+            return []
+        if level:
+            return [[p[2], p[3], p[1]] for p in islice(self.levels[level], first, last)]
+        length = len(self.columns[0])
+        timestamp, latitude, longitude = self.columns[1], self.columns[2], self.columns[3]
+        indices = ((self.start + i) % length for i in range(first, last))
+        return [[latitude[i], longitude[i], timestamp[i]] for i in indices]
+
+    def latest(self):
+        return self.tail
+
+    def allocated_bytes(self):
+        ring = sum(column.itemsize * column.buffer_info()[1] for column in self.columns)
+        return ring + sum(len(points) for points in self.levels[1:]) * POINT_SIZE
+
+
+class TrackStore:
+    # Thread-safe store of the recent positions of every vehicle: at most
+    # max_points points and max_age seconds of history per vehicle, vehicles
+    # silent for vehicle_timeout seconds are dropped. Written by the MQTT
+    # thread, read by the Flask request threads.
+    #
+    # With trace levels ((min zoom, tolerance in meters), finest first, see
+    # trace_simplifier), the history is simplified as it arrives: only the
+    # points kept by the finest level are stored in full, each coarser level
+    # simplifies the output of the previous one, so the error of level k is
+    # at most the sum of the tolerances up to k.
+
+    def __init__(self, max_points=1000, max_age=3600.0, vehicle_timeout=300.0, sweep_interval=5.0,
+                 levels=TRACE_LEVELS):
+        self.max_points = max_points
+        self.max_age = max_age
+        self.vehicle_timeout = vehicle_timeout
+        self.sweep_interval = sweep_interval
+        self.levels = levels
+        self.tolerances = tuple(tolerance for _, tolerance in levels)
+        self._lock = threading.RLock()
+        self._tracks = {}
+        self._last_sweep = time.time()
+        self.evicted_points = 0
+        self.expired_vehicles = 0
+        self.points_in = 0
+        self.points_kept = [0] * len(self.tolerances)
+        self.max_errors = [0.0] * len(self.tolerances)
+
+    def add(self, vehicle_id, timestamp, latitude, longitude, speed, heading, received=None):
+        if received is None:
+            received = time.time()
+        with self._lock:
+            track = self._tracks.get(vehicle_id)
+            if track is None:
+                track = self._tracks[vehicle_id] = VehicleTrack(self.max_points, self.tolerances)
+            before = list(track.kept)
+            self.evicted_points += track.add((received, timestamp, latitude, longitude, speed, heading))
+            self.points_in += 1
+            for level, simplifier in enumerate(track.simplifiers):
+                if track.kept[level] == before[level]:
+                    break
+                self.points_kept[level] += track.kept[level] - before[level]
+                if simplifier.max_error > self.max_errors[level]:
+                    self.max_errors[level] = simplifier.max_error
+            if received - self._last_sweep >= self.sweep_interval:
+                self.expire(received)
+
+    def touch(self, vehicle_ids, received=None):
+        # Updates that were not stored still keep their vehicle from expiring
+        if received is None:
+            received = time.time()
+        with self._lock:
+            for vehicle_id in vehicle_ids:
+                track = self._tracks.get(vehicle_id)
+                if track is not None:
+                    track.last_seen = received
+
+    def expire(self, now=None):
+        if now is None:
+            now = time.time()
+        with self._lock:
+            self._last_sweep = now
+            oldest = now - self.max_age
+            silent = now - self.vehicle_timeout
+            for vehicle_id, track in list(self._tracks.items()):
+                if track.last_seen < silent:
+                    self.evicted_points += track.size
+                    self.expired_vehicles += 1
+                    del self._tracks[vehicle_id]
+                else:
+                    self.evicted_points += track.evict_before(oldest)
+
+    def vehicles(self):
+        with self._lock:
+            return list(self._tracks)
+
+    def track(self, vehicle_id):
+        # [[lat, lon], ...] from the oldest to the newest point
+        with self._lock:
+            track = self._tracks.get(vehicle_id)
+            return track.latlngs() if track else []
+
+    def trace_since(self, vehicle_id, level, seq, until=None):
+        # Points kept by a trace level after the first `seq` ones (and
+        # before the first `until` ones), the new sequence number and whether
+        # the points follow the first `seq` ones (False when some were
+        # evicted in between or the track was dropped and started again):
+        # ([[lat, lon, timestamp], ...], seq, contiguous)
+        with self._lock:
+            track = self._tracks.get(vehicle_id)
+            if track is None or not track.kept:
+                return [], 0, False
+            count = track.kept[level]
+            if until is not None and until < count:
+                count = until
+            if seq > count:
+                return track.trace(level, 0, count), count, False
+            return track.trace(level, seq, count), count, seq >= track.oldest_seq(level)
+
+    def points(self, vehicle_id):
+        # [(received, timestamp, lat, lon, speed, heading), ...]
+        with self._lock:
+            track = self._tracks.get(vehicle_id)
+            return track.points() if track else []
+
+    def latest(self, vehicle_id):
+        with self._lock:
+            track = self._tracks.get(vehicle_id)
+            return track.latest() if track else None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._tracks)
+
+    def __contains__(self, vehicle_id):
+        with self._lock:
+            return vehicle_id in self._tracks
+
+    def stats(self):
+        with self._lock:
+            points = sum(track.size for track in self._tracks.values())
+            coarse_points = sum(len(p) for track in self._tracks.values() for p in track.levels[1:])
+            levels = []
+            error_bound = 0.0
+            for level, tolerance in enumerate(self.tolerances):
+                error_bound += tolerance
+                kept = self.points_kept[level]
+                levels.append({
+                    'tolerance': tolerance,
+                    'error_bound': error_bound,
+                    'max_step_error': self.max_errors[level],
+                    'points_kept': kept,
+                    'compression_ratio': self.points_in / kept if kept else 0,
+                })
+            return {
+                'vehicles': len(self._tracks),
+                'points': points,
+                'bytes_used': (points + coarse_points) * POINT_SIZE,
+                'bytes_allocated': sum(track.allocated_bytes() for track in self._tracks.values()),
+                'evicted_points': self.evicted_points,
+                'expired_vehicles': self.expired_vehicles,
+                'max_points': self.max_points,
+                'max_age': self.max_age,
+                'vehicle_timeout': self.vehicle_timeout,
+                'points_in': self.points_in,
+                'trace_levels': levels,
+            }
@@ -0,0 +1,97 @@
+import struct
+from functools import lru_cache
+
+# Binary encoding of the updates of a 'vehicles' frame: a u32 record count,
+# a reserved u32, then one little-endian column per field, every column
+# aligned on its item size so the browser reads them as typed arrays:
+#   timestamp (f64 ms), elapsed (f64 ms), latitude and longitude (i32,
+#   1e-7 deg), speed (f32 m/s), heading (f32 deg), vehicle (u32 index in
+#   the id dictionary of the connection)
+HEADER_SIZE = 4 + 4
+UPDATE_RECORD_SIZE = 8 + 8 + 4 + 4 + 4 + 4 + 4
+
+# Dictionaries are cleared (and the clients told so) past this many ids
+MAX_IDS = 65536
+
+
+@lru_cache(maxsize=256)
+def _layout(count):
+    return struct.Struct(f'<2I{count}d{count}d{count}i{count}i{count}f{count}f{count}I')
+
+
+class IdDictionary:
+    # Vehicle id -> small integer, for one connection (or the unfiltered
+    # room). Entries added since the last announce() are sent along with
+    # the next frame, after a clear() the clients drop their copy first.
+
+    def __init__(self, max_ids=MAX_IDS, reset=False):
+        self.max_ids = max_ids
+        self.ids = {}
+        self.new = []
+        self.reset = reset
+
+    def __len__(self):
+        return len(self.ids)
+
+    def copy(self):
+        other = IdDictionary(self.max_ids, self.reset)
+        other.ids = dict(self.ids)
+        other.new = list(self.new)
+        return other
+
+    def index(self, vehicle_id):
+        index = self.ids.get(vehicle_id)
+        if index is None:
+            index = self.ids[vehicle_id] = len(self.ids)
+            self.new.append([index, vehicle_id])
+        return index
+
+    def clear_if_full(self):
+        if len(self.ids) >= self.max_ids:
+            self.ids.clear()
+            self.new = []
+            self.reset = True
+
+    def entries(self):
+        return [[index, vehicle_id] for vehicle_id, index in self.ids.items()]
+
+    def announce(self):
+        # ([index, vehicle_id] entries added since the previous call, cleared in between)
+        new, reset = self.new, self.reset
+        self.new = []
+        self.reset = False
+        return new, reset
+
+
+def encode_updates(updates, dictionary):
+    count = len(updates)
+    values = [count, 0]
+    values += [update['timestamp'] for update in updates]
+    values += [update['elapsed'] for update in updates]
+    values += [round(update['latitude'] * 1e7) for update in updates]
+    values += [round(update['longitude'] * 1e7) for update in updates]
+    values += [update['speed'] for update in updates]
+    values += [update['heading'] for update in updates]
+    values += [dictionary.index(update['vehicle_id']) for update in updates]
+    return _layout(count).pack(*values)
+
+
+def decode_updates(payload, ids):
+    # Inverse of encode_updates, ids mapping indexes back to vehicle ids
+    if len(payload) < HEADER_SIZE:
+        raise ValueError(f"{len(payload)} bytes, shorter than the {HEADER_SIZE} byte header")
+    count = struct.unpack_from('<I', payload)[0]
+    # Checked before building the layout of a count read from the payload
+    if len(payload) != HEADER_SIZE + count * UPDATE_RECORD_SIZE:
+        raise ValueError(f"{len(payload)} bytes for {count} updates, expected {HEADER_SIZE + count * UPDATE_RECORD_SIZE}")
+    values = _layout(count).unpack(payload)
+    columns = [values[2 + i * count:2 + (i + 1) * count] for i in range(7)]
+    return [{
+        'vehicle_id': ids[vehicle],
+        'latitude': latitude / 1e7,
+        'longitude': longitude / 1e7,
+        'speed': speed,
+        'heading': heading,
+        'timestamp': timestamp,
+        'elapsed': elapsed,
+    } for timestamp, elapsed, latitude, longitude, speed, heading, vehicle in zip(*columns)]